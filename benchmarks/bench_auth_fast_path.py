@@ -0,0 +1,131 @@
+# Benchmark of the api_auth fast path, requests/sec of a single worker thread
+# Compares the original handler (full request.headers logged at INFO, matched item logged at INFO,
+# jsonify responses built up front, DEBUG logging level) against the current api_auth
+# (sampled request logging, prebuilt response bodies, INFO logging level)
+# The requests go straight to the WSGI app, without the HTTP server, and the log records
+# are formatted and written to /dev/null so the logging cost is included but not the disk I/O
+#
+# Requires hubmap-auth/src/instance/app.cfg (copy of app.cfg.example is enough)
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_auth_fast_path.py [--seconds 3]
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from flask import jsonify, make_response, request
+from werkzeug.test import EnvironBuilder
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+
+import app
+from endpoints_config import EndpointsConfig
+
+AUTHORITY = 'ingest.api.hubmapconsortium.org'
+
+ENDPOINTS = {
+    AUTHORITY: [
+        {"method": "GET", "endpoint": "/", "auth": False},
+        {"method": "GET", "endpoint": "/datasets/<*>/file-system-abs-path", "auth": False},
+        {"method": "PUT", "endpoint": "/datasets/<*>/submit", "auth": True, "groups": ["5777527e-ec11-11e8-ab41-0af86edb4424"]}
+    ]
+}
+
+# Typical headers forwarded by nginx auth_request
+HEADERS = {
+    'Host': AUTHORITY,
+    'X-Original-Request-Method': 'GET',
+    'X-Original-URI': '/datasets/a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6/file-system-abs-path',
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Referer': 'https://portal.hubmapconsortium.org/',
+    'X-Real-Ip': '10.0.0.1',
+    'X-Forwarded-For': '10.0.0.1'
+}
+
+
+# The original api_auth() before the fast path changes
+def legacy_api_auth():
+    app.logger.info("======api_auth request.headers======")
+    app.logger.info(request.headers)
+
+    response_200 = make_response(jsonify({"message": "OK: Authorized"}), 200)
+    response_401 = make_response(jsonify({"message": "ERROR: Unauthorized"}), 401)
+
+    if ("X-Original-Request-Method" in request.headers) and ("Host" in request.headers) and ("X-Original-URI" in request.headers):
+        item = app.endpoints_config.route_index().match(request.headers.get("Host"),
+                                                         request.headers.get("X-Original-Request-Method"),
+                                                         request.headers.get("X-Original-URI"))
+        if item is None:
+            return response_401
+
+        app.logger.info("======Matched endpoint======")
+        app.logger.info(item)
+
+        if app.api_access_allowed(item, request):
+            return response_200
+
+    return response_401
+
+
+def run(path, seconds):
+    environ = EnvironBuilder(path=path, headers=HEADERS).get_environ()
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(status)
+
+    count = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            b''.join(app.app(dict(environ), start_response))
+        count += 100
+
+    elapsed = time.perf_counter() - start
+    assert statuses[-1].startswith('200'), statuses[-1]
+
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the api_auth fast path")
+    parser.add_argument('--seconds', type=float, default=3, help="Duration of each run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        endpoints_file = os.path.join(tmp_dir, 'api_endpoints.json')
+        with open(endpoints_file, 'w') as f:
+            json.dump(ENDPOINTS, f)
+
+        app.endpoints_config = EndpointsConfig(endpoints_file, poll_interval=0)
+        app.app.add_url_rule('/legacy_api_auth', 'legacy_api_auth', legacy_api_auth)
+
+        # Format the records as in production but write them nowhere
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers:
+            handler.setStream(open(os.devnull, 'w'))
+
+        root_logger.setLevel(logging.DEBUG)
+        before = run('/legacy_api_auth', args.seconds)
+
+        root_logger.setLevel(logging.INFO)
+        app.request_log_sample_rate = 0.01
+        after = run('/api_auth', args.seconds)
+
+    print(f"{'':>8} {'requests/sec per thread':>24}")
+    print(f"{'before':>8} {before:>24,.0f}")
+    print(f"{'after':>8} {after:>24,.0f}")
+    print(f"{'speedup':>8} {after / before:>23.2f}x")
+
+
+if __name__ == '__main__':
+    main()
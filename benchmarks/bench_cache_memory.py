@@ -0,0 +1,125 @@
+# Memory benchmark of the gateway cache entries
+# Fills a TTLCache of CACHE_MAXSIZE entries with realistic entity-api responses and compares
+# caching the whole requests.Response (before) against the compact UpstreamResult (after)
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_cache_memory.py [--maxsize 1024]
+import argparse
+import gc
+import json
+import pickle
+import random
+import sys
+import tracemalloc
+import uuid
+from pathlib import Path
+
+import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+
+from gateway_cache import compact_response
+
+ENTITY_API_URL = 'http://entity-api:8080'
+
+
+# An entity-api /entities/<uuid> payload with the usual Dataset fields,
+# the size mostly comes from the metadata and the files list
+def generate_entity(rng):
+    entity_uuid = uuid.UUID(int=rng.getrandbits(128)).hex
+    file_count = rng.randint(5, 300)
+    return {
+        'uuid': entity_uuid,
+        'hubmap_id': f"HBM{rng.randint(100, 999)}.ABCD.{rng.randint(100, 999)}",
+        'entity_type': 'Dataset',
+        'data_access_level': rng.choice(['public', 'consortium', 'protected']),
+        'status': rng.choice(['Published', 'QA', 'New']),
+        'contains_human_genetic_sequences': False,
+        'created_by_user_displayname': 'HuBMAP Process',
+        'created_by_user_email': 'hubmap@hubmapconsortium.org',
+        'created_timestamp': 1600000000000,
+        'group_name': 'University of Florida TMC',
+        'group_uuid': uuid.UUID(int=rng.getrandbits(128)).hex,
+        'dataset_type': 'RNAseq',
+        'title': 'RNAseq data from the kidney of a 60-year-old white female',
+        'description': 'Lorem ipsum dolor sit amet ' * rng.randint(5, 40),
+        'metadata': {f"key_{i}": f"value_{i}" * 3 for i in range(rng.randint(20, 120))},
+        'files': [{'rel_path': f"raw/sample_{i}/fastq/R1_{i}.fastq.gz",
+                   'size': rng.randint(10**3, 10**10),
+                   'type': 'unknown',
+                   'description': 'FASTQ file',
+                   'edam_term': 'EDAM_1.24.format_1930'} for i in range(file_count)],
+        'direct_ancestors': [{'uuid': uuid.UUID(int=rng.getrandbits(128)).hex, 'entity_type': 'Sample'}]
+    }
+
+
+# A requests.Response as returned by requests.get() once the body has been read
+def build_response(url, entity, adapter):
+    request = requests.Request('GET', url, headers={'Authorization': 'Bearer ' + 'x' * 120}).prepare()
+
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.url = url
+    response.encoding = 'utf-8'
+    response._content = json.dumps(entity).encode('utf-8')
+    response.headers = CaseInsensitiveDict({'Content-Type': 'application/json',
+                                            'Content-Length': str(len(response._content)),
+                                            'Date': 'Sun, 18 Oct 2026 00:00:00 GMT',
+                                            'Server': 'nginx'})
+    response.request = request
+    response.connection = adapter
+    return response
+
+
+def measure(entries):
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+
+    cache = TTLCache(maxsize=len(entries), ttl=7200)
+    for url, value_factory in entries:
+        cache[url] = value_factory()
+
+    gc.collect()
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    pickled_bytes = sum(len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) for value in cache.values())
+    return cache, end - start, pickled_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the memory used by the gateway cache entries")
+    parser.add_argument('--maxsize', type=int, default=1024, help="CACHE_MAXSIZE")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    adapter = HTTPAdapter()
+
+    # Serialize the payloads up front so only the cached objects are measured
+    payloads = []
+    for _ in range(args.maxsize):
+        entity = generate_entity(rng)
+        payloads.append((f"{ENTITY_API_URL}/entities/{entity['uuid']}", entity))
+
+    before_entries = [(url, lambda url=url, entity=entity: build_response(url, entity, adapter)) for url, entity in payloads]
+    after_entries = [(url, lambda url=url, entity=entity: compact_response(build_response(url, entity, adapter))) for url, entity in payloads]
+
+    before_cache, before_bytes, before_pickled = measure(before_entries)
+    del before_cache
+    after_cache, after_bytes, after_pickled = measure(after_entries)
+
+    print(f"Entries: {args.maxsize}")
+    print(f"{'':>28} {'heap total':>14} {'heap/entry':>12} {'pickled/entry':>14}")
+    print(f"{'requests.Response (before)':>28} {before_bytes / 2**20:>11.2f} MB {before_bytes / args.maxsize:>10.0f} B {before_pickled / args.maxsize:>12.0f} B")
+    print(f"{'UpstreamResult (after)':>28} {after_bytes / 2**20:>11.2f} MB {after_bytes / args.maxsize:>10.0f} B {after_pickled / args.maxsize:>12.0f} B")
+    print(f"Reduction: {before_bytes / after_bytes:.0f}x heap, {before_pickled / after_pickled:.0f}x pickled")
+
+
+if __name__ == '__main__':
+    main()
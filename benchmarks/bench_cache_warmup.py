@@ -0,0 +1,122 @@
+# Benchmark of the first requests after a restart, without and with the cache warm-up
+# The assets traffic is skewed (a few hot datasets and files) and drawn twice from the same distribution:
+# once written as the nginx access log the warm-up reads, once replayed against /file_auth right after
+# the restart (empty caches) against local mock uuid-api and entity-api with the given latency
+# Reports the warm-up run and, for the replayed requests, the upstream calls, the fraction of the
+# requests needing no upstream call and the mean latency
+#
+# Requires hubmap-auth/src/instance/app.cfg (copy of app.cfg.example is enough)
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_cache_warmup.py [--datasets 200] [--requests 1000] [--latency 0.02]
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+sys.path.insert(0, str(Path(__file__).absolute().parent))
+
+import app
+from cache_warmer import CacheWarmer
+from mock_upstreams import MockEntityApi, MockUuidApi
+
+FILES_PER_DATASET = 5
+
+
+# Stand-in of the hubmap_commons AuthHelper, only the internal token is used without a user token
+class LocalAuthHelper:
+    def getProcessSecret(self):
+        return 'internal-token'
+
+
+def restart():
+    app.cache.clear()
+    app.entity_index.clear()
+    app.file_access_decision_cache.clear()
+
+
+# Dataset uuids and file uuids, requested with a Zipf-like skew
+def traffic(datasets, count, rng):
+    uuids = []
+    for i in range(datasets):
+        uuids.append(f"{i:032x}")
+        uuids.extend(f"ffff{i:014x}{j:014x}" for j in range(FILES_PER_DATASET))
+
+    weights = [1 / (rank + 1) for rank in range(len(uuids))]
+    return rng.choices(uuids, weights=weights, k=count)
+
+
+def replay(client, uuids, mocks):
+    for mock in mocks:
+        mock.reset()
+
+    latencies = []
+    upstream_calls = 0
+    without_upstream = 0
+
+    for uuid in uuids:
+        before = sum(sum(mock.calls.values()) for mock in mocks)
+        start = time.perf_counter()
+        response = client.get('/file_auth', headers={'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{uuid}/image.png"})
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+
+        calls = sum(sum(mock.calls.values()) for mock in mocks) - before
+        upstream_calls += calls
+        without_upstream += calls == 0
+
+    return upstream_calls, without_upstream / len(uuids), sum(latencies) / len(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cache warm-up")
+    parser.add_argument('--datasets', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=1000, help="Requests in the access log and replayed")
+    parser.add_argument('--latency', type=float, default=0.02, help="Mock upstream latency in seconds")
+    parser.add_argument('--concurrency', type=int, default=8, help="Warm-up concurrency")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(0)
+    logged = traffic(args.datasets, args.requests, rng)
+    replayed = traffic(args.datasets, args.requests, rng)
+
+    files = {f"ffff{i:014x}{j:014x}": f"{i:032x}" for i in range(args.datasets) for j in range(FILES_PER_DATASET)}
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+         MockUuidApi(files=files, latency=args.latency) as uuid_api, \
+         MockEntityApi(latency=args.latency) as entity_api:
+        access_log = os.path.join(tmp_dir, 'nginx_access_assets.log')
+        with open(access_log, 'w') as f:
+            for uuid in logged:
+                f.write(f'10.0.0.1 - - [01/Oct/2026:10:00:00 +0000] "GET /{uuid}/image.png HTTP/1.1" 200 1024 "-" "-"\n')
+
+        app.app.config['UUID_API_URL'] = uuid_api.url
+        app.app.config['ENTITY_API_URL'] = entity_api.url
+        app.auth_helper_instance = LocalAuthHelper()
+        client = app.app.test_client()
+        mocks = (uuid_api, entity_api)
+
+        restart()
+        cold = replay(client, replayed, mocks)
+
+        restart()
+        warmer = CacheWarmer(app.warm_up_file_access, app.cache, access_logs=[access_log], concurrency=args.concurrency)
+        report = warmer.run()
+        warm = replay(client, replayed, mocks)
+
+    print(f"warm-up: {report['uuids']} uuids in {report['duration']:.2f}s, {report['fetched']} fetched, {report['failed']} failed")
+    print()
+    print(f"{'after restart':>14} {'upstream calls':>15} {'no upstream call':>17} {'mean ms':>8}")
+    for name, (upstream_calls, hit_rate, mean_latency) in [('cold', cold), ('warmed up', warm)]:
+        print(f"{name:>14} {upstream_calls:>15} {hit_rate:>16.1%} {mean_latency * 1000:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
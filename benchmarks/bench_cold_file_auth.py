@@ -0,0 +1,77 @@
+# Benchmark of the cold /file_auth latency, in round trips to the mocked upstreams
+# Each case starts with empty caches (gateway cache, entity index, decision cache):
+#   entity:       a dataset uuid, uuid-api /hmuuid and entity-api /entities at the same time
+#   file:         a file uuid of an unknown dataset, /file-id then the dataset lookups
+#   sibling file: a file uuid of a dataset resolved by a previous request, /file-id only
+#
+# Requires hubmap-auth/src/instance/app.cfg (copy of app.cfg.example is enough)
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_cold_file_auth.py [--latency 0.05] [--rounds 20]
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+sys.path.insert(0, str(Path(__file__).absolute().parent))
+
+import app
+from mock_upstreams import MockEntityApi, MockUuidApi
+
+
+# Stand-in of the hubmap_commons AuthHelper, only the internal token is used without a user token
+class LocalAuthHelper:
+    def getProcessSecret(self):
+        return 'internal-token'
+
+
+def clear_caches():
+    app.cache.clear()
+    app.entity_index.clear()
+    app.file_access_decision_cache.clear()
+
+
+def timed_file_auth(client, uuid):
+    start = time.perf_counter()
+    response = client.get('/file_auth', headers={'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{uuid}/image.png"})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.status_code
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cold /file_auth latency")
+    parser.add_argument('--latency', type=float, default=0.05, help="Mock upstream latency in seconds")
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    files = {f"ffff{i:028x}": f"{i // 2:032x}" for i in range(args.rounds * 2)}
+
+    with MockUuidApi(files=files, latency=args.latency) as uuid_api, MockEntityApi(latency=args.latency) as entity_api:
+        app.app.config['UUID_API_URL'] = uuid_api.url
+        app.app.config['ENTITY_API_URL'] = entity_api.url
+        app.auth_helper_instance = LocalAuthHelper()
+        client = app.app.test_client()
+
+        timings = {'entity': [], 'file': [], 'sibling file': []}
+
+        for i in range(args.rounds):
+            clear_caches()
+            timings['entity'].append(timed_file_auth(client, f"e{i:031x}"))
+
+            clear_caches()
+            timings['file'].append(timed_file_auth(client, f"ffff{i * 2:028x}"))
+            timings['sibling file'].append(timed_file_auth(client, f"ffff{i * 2 + 1:028x}"))
+
+    print(f"{'case':>13} {'mean ms':>8} {'round trips':>12}")
+    for case, values in timings.items():
+        mean = sum(values) / len(values)
+        print(f"{case:>13} {mean * 1000:>8.1f} {mean / args.latency:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# Benchmark of the entity store (entity_store.py) at millions of uuids
+# For each size, fills a store of that capacity with file uuids (ancestor) and entities (type, access level, status),
+# then measures the lookup latency of stored and unknown uuids, the file size and the memory of the mapping,
+# and reopens it as a restarted worker would. The per-process entity index (one TTLCache per worker process)
+# is measured on --index-sample entries and extrapolated to the same size for comparison
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_entity_store.py [--sizes 1000000 10000000] [--lookups 200000] [--dir /tmp]
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+
+from entity_index import EntityIndex, entity_metadata, file_metadata
+from entity_store import EntityStore
+
+# Fraction of the stored uuids that are files, the others are their datasets
+FILE_RATIO = 0.8
+# Stored per put_many() call
+BATCH_SIZE = 10000
+
+
+def random_uuid(rng):
+    return f"{rng.getrandbits(128):032x}"
+
+
+# The (uuid, EntityMetadata) items in batches, without holding all of them in memory
+def generate_items(rng, count):
+    datasets = [random_uuid(rng) for _ in range(max(1, int(count * (1 - FILE_RATIO))))]
+    batch = []
+
+    for index in range(count):
+        if index < len(datasets):
+            item = (datasets[index], entity_metadata('Dataset', rng.choice(['public', 'consortium', 'protected']),
+                                                     rng.choice(['Published', 'QA', 'New'])))
+        else:
+            item = ('ffff' + random_uuid(rng)[4:], file_metadata(rng.choice(datasets)))
+
+        batch.append(item)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+# Resident memory of the process from /proc/self/status, in bytes
+def resident_memory():
+    memory = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('VmRSS', 'RssFile'):
+                memory[name] = int(value.split()[0]) * 1024
+    return memory
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def measure_lookups(store, uuids):
+    latencies = []
+    found = 0
+
+    for uuid in uuids:
+        start = time.perf_counter()
+        metadata = store.get(uuid)
+        latencies.append(time.perf_counter() - start)
+        found += metadata is not None
+
+    latencies.sort()
+    return found, sum(latencies) / len(latencies), percentile(latencies, 0.5), percentile(latencies, 0.99)
+
+
+# Heap bytes per entry and mean hit latency of the per-process entity index
+def measure_index(count, seed):
+    rng = random.Random(seed)
+    items = [item for batch in generate_items(rng, count) for item in batch]
+
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+
+    index = EntityIndex(maxsize=count, ttl=7200)
+    for uuid, metadata in items:
+        index.put(uuid, metadata)
+
+    gc.collect()
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    _, hit_mean, _, _ = measure_lookups(index, [uuid for uuid, _ in items])
+    return (end - start) / count, hit_mean
+
+
+def run(size, args, directory):
+    path = os.path.join(directory, f"entity_store_{size}.bin")
+    rng = random.Random(args.seed)
+    sample = []
+
+    store = EntityStore(path, size, ttl=86400)
+
+    start = time.perf_counter()
+    stored = 0
+    for batch in generate_items(rng, size):
+        stored += store.put_many(batch)
+        sample.extend(uuid for uuid, _ in rng.sample(batch, min(len(batch), args.lookups * BATCH_SIZE // size + 1)))
+    build_seconds = time.perf_counter() - start
+
+    rng.shuffle(sample)
+    hits = sample[:args.lookups]
+    misses = [random_uuid(rng) for _ in range(args.lookups)]
+
+    memory_before = resident_memory()
+    hit_found, hit_mean, hit_p50, hit_p99 = measure_lookups(store, hits)
+    miss_found, miss_mean, miss_p50, miss_p99 = measure_lookups(store, misses)
+    memory_after = resident_memory()
+    store.close()
+
+    # A restarted worker process opens the existing file and finds the entries at once
+    start = time.perf_counter()
+    reopened = EntityStore(path, size, ttl=86400)
+    reopen_seconds = time.perf_counter() - start
+    reopen_found = sum(reopened.get(uuid) is not None for uuid in hits[:1000])
+    reopened.close()
+
+    stat = os.stat(path)
+    if not args.keep:
+        os.remove(path)
+
+    print(f"Entries: {size} ({stored} stored, {size - stored} dropped by the probe limit)")
+    print(f"  build:    {build_seconds:.1f} s ({size / build_seconds:,.0f} puts/s in batches of {BATCH_SIZE})")
+    print(f"  hit:      mean {hit_mean * 1e6:.2f} us  p50 {hit_p50 * 1e6:.2f} us  p99 {hit_p99 * 1e6:.2f} us  ({hit_found}/{len(hits)} found)")
+    print(f"  miss:     mean {miss_mean * 1e6:.2f} us  p50 {miss_p50 * 1e6:.2f} us  p99 {miss_p99 * 1e6:.2f} us  ({miss_found}/{len(misses)} found)")
+    print(f"  reopen:   {reopen_seconds * 1e3:.2f} ms ({reopen_found}/1000 found)")
+    print(f"  file:     {stat.st_size / 2**20:.0f} MB ({stat.st_blocks * 512 / 2**20:.0f} MB allocated), "
+          f"{stat.st_size / size:.0f} B/entry, shared by all the worker processes")
+    print(f"  resident: {memory_after['VmRSS'] / 2**20:.0f} MB process, "
+          f"{memory_after['RssFile'] / 2**20:.0f} MB of mapped file (+{(memory_after['RssFile'] - memory_before['RssFile']) / 2**20:.0f} MB by the lookups)")
+
+    return stat.st_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the entity store lookups and footprint")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 10000000], help="Stored uuids")
+    parser.add_argument('--lookups', type=int, default=200000, help="Lookups of stored uuids and of unknown ones")
+    parser.add_argument('--index-sample', type=int, default=100000, help="Entries of the entity index measured")
+    parser.add_argument('--processes', type=int, default=12, help="uWSGI worker processes, each with its own entity index")
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help="Directory of the store files")
+    parser.add_argument('--keep', action='store_true', help="Keep the store files")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    index_bytes, index_hit_mean = measure_index(args.index_sample, args.seed)
+
+    for size in args.sizes:
+        file_size = run(size, args, args.dir)
+        index_total = index_bytes * size * args.processes
+        print(f"  entity index for comparison: hit mean {index_hit_mean * 1e6:.2f} us, {index_bytes:.0f} B/entry of heap, "
+              f"{index_total / 2**20:,.0f} MB for {args.processes} worker processes vs {file_size / 2**20:.0f} MB")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Benchmark of POST /file_auth/batch against one /file_auth per file
+# The files belong to a few datasets served by local mock uuid-api and entity-api with the given latency,
+# each run starts with an empty cache
+#
+# Requires hubmap-auth/src/instance/app.cfg (copy of app.cfg.example is enough)
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_file_auth_batch.py [--datasets 5] [--latency 0.05]
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+sys.path.insert(0, str(Path(__file__).absolute().parent))
+
+import app
+from mock_upstreams import MockEntityApi, MockUuidApi
+
+FILE_COUNTS = [10, 100, 500]
+
+
+# Stand-in of the hubmap_commons AuthHelper, only the internal token is used without a user token
+class LocalAuthHelper:
+    def getProcessSecret(self):
+        return 'internal-token'
+
+
+def clear_caches(*mocks):
+    app.cache.clear()
+    app.file_access_decision_cache.clear()
+    for mock in mocks:
+        mock.reset()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark POST /file_auth/batch")
+    parser.add_argument('--datasets', type=int, default=5, help="Number of parent datasets of the files")
+    parser.add_argument('--latency', type=float, default=0.05, help="Mock upstream latency in seconds")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    file_uuids = [f"ffff{i:028x}" for i in range(max(FILE_COUNTS))]
+    files = {file_uuid: f"{i % args.datasets:032x}" for i, file_uuid in enumerate(file_uuids)}
+
+    with MockUuidApi(files=files, latency=args.latency) as uuid_api, MockEntityApi(latency=args.latency) as entity_api:
+        app.app.config['UUID_API_URL'] = uuid_api.url
+        app.app.config['ENTITY_API_URL'] = entity_api.url
+        app.auth_helper_instance = LocalAuthHelper()
+        client = app.app.test_client()
+
+        print(f"{'files':>6} {'one /file_auth per file':>24} {'upstream calls':>15} {'/file_auth/batch':>17} {'upstream calls':>15}")
+
+        for count in FILE_COUNTS:
+            clear_caches(uuid_api, entity_api)
+            start = time.perf_counter()
+            for file_uuid in file_uuids[:count]:
+                client.get('/file_auth', headers={'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{file_uuid}/image.png"})
+            single_elapsed = time.perf_counter() - start
+            single_calls = sum(uuid_api.calls.values()) + sum(entity_api.calls.values())
+
+            clear_caches(uuid_api, entity_api)
+            start = time.perf_counter()
+            response = client.post('/file_auth/batch', json={'items': [f"{file_uuid}/image.png" for file_uuid in file_uuids[:count]]})
+            batch_elapsed = time.perf_counter() - start
+            batch_calls = sum(uuid_api.calls.values()) + sum(entity_api.calls.values())
+            assert response.status_code == 200 and len(response.json) == count
+
+            print(f"{count:>6} {single_elapsed:>23.2f}s {single_calls:>15} {batch_elapsed:>16.2f}s {batch_calls:>15}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Micro-benchmark of the api_auth endpoint lookup
+# Compares the original two-pass linear scan against the precompiled RouteIndex
+# as the number of routes per authority grows
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_route_index.py [--lookups 20000]
+import argparse
+import random
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+
+from route_index import RouteIndex, WILDCARD_DELIMITER, WILDCARD_REGEX_PATTERN
+
+AUTHORITY = 'ingest.api.hubmapconsortium.org'
+METHODS = ['GET', 'POST', 'PUT']
+ROUTE_COUNTS = [78, 500, 1000, 2000, 5000]
+
+
+# The original two-pass linear scan of api_auth()
+def legacy_match(data, authority, method, endpoint):
+    if authority in data.keys():
+        for item in data[authority]:
+            if (item['method'].upper() == method.upper()) and (WILDCARD_DELIMITER not in item['endpoint']):
+                target_endpoint = endpoint.split("?")[0]
+                if item['endpoint'].strip('/') == target_endpoint.strip('/'):
+                    return item
+
+        for item in data[authority]:
+            if (item['method'].upper() == method.upper()) and (WILDCARD_DELIMITER in item['endpoint']):
+                endpoint_pattern = item['endpoint'].replace(WILDCARD_DELIMITER, WILDCARD_REGEX_PATTERN)
+                target_endpoint = endpoint.split("?")[0]
+                if re.fullmatch(endpoint_pattern.strip('/'), target_endpoint.strip('/')) is not None:
+                    return item
+    return None
+
+
+# Generate a synthetic endpoints dict with roughly the same static/wildcard mix as api_endpoints.prod.json
+def generate_endpoints(route_count, rng):
+    items = []
+    for i in range(route_count):
+        method = rng.choice(METHODS)
+        if rng.random() < 0.4:
+            endpoint = f"/resource{i}/<*>" if rng.random() < 0.7 else f"/resource{i}/<*>/action/<*>"
+        else:
+            endpoint = f"/resource{i}/static"
+        items.append({'method': method, 'endpoint': endpoint, 'auth': False})
+    return {AUTHORITY: items}
+
+
+# Build a request sample: mostly hits spread over the whole table plus some misses
+def generate_requests(data, count, rng):
+    items = data[AUTHORITY]
+    sample = []
+    for _ in range(count):
+        if rng.random() < 0.1:
+            sample.append(('GET', f"/unknown/{rng.randint(0, 10**6)}"))
+            continue
+        item = rng.choice(items)
+        endpoint = item['endpoint'].replace(WILDCARD_DELIMITER, format(rng.getrandbits(64), 'x'))
+        sample.append((item['method'], endpoint + '?format=json'))
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the api_auth endpoint lookup")
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    print(f"{'routes':>8} {'legacy us/lookup':>18} {'index us/lookup':>17} {'speedup':>9} {'index build ms':>16}")
+
+    for route_count in ROUTE_COUNTS:
+        data = generate_endpoints(route_count, rng)
+        sample = generate_requests(data, args.lookups, rng)
+
+        build_seconds = timeit.timeit(lambda: RouteIndex(data), number=1)
+        index = RouteIndex(data)
+
+        # Sanity check both implementations agree before timing them
+        for method, endpoint in sample[:500]:
+            assert index.match(AUTHORITY, method, endpoint) is legacy_match(data, AUTHORITY, method, endpoint)
+
+        # The legacy scan gets slow with thousands of routes, time it on a smaller sample
+        legacy_sample = sample[:max(200, args.lookups * 78 // route_count // 10)]
+        legacy_seconds = timeit.timeit(lambda: [legacy_match(data, AUTHORITY, m, e) for m, e in legacy_sample], number=1)
+        index_seconds = timeit.timeit(lambda: [index.match(AUTHORITY, m, e) for m, e in sample], number=1)
+
+        legacy_us = legacy_seconds / len(legacy_sample) * 1e6
+        index_us = index_seconds / len(sample) * 1e6
+
+        print(f"{route_count:>8} {legacy_us:>18.2f} {index_us:>17.2f} {legacy_us / index_us:>8.1f}x {build_seconds * 1000:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
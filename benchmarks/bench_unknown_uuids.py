@@ -0,0 +1,86 @@
+# Benchmark of the /file_auth requests for junk uuids, e.g., scanners and broken links
+#   malformed:    paths like /wp-login.php/ or /.env/
+#   unknown:      well-formed entity uuids unknown to uuid-api (404, cached for CACHE_TTL_NEGATIVE)
+#   invalid file: ffff uuids uuid-api rejects as invalid file ids (400, never cached)
+# Each uuid is requested --repeats times, without the uuid format check and unknown uuid filter (before)
+# and with them (after), against a local mock uuid-api and entity-api with the given latency
+#
+# Requires hubmap-auth/src/instance/app.cfg (copy of app.cfg.example is enough)
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_unknown_uuids.py [--uuids 50] [--repeats 20] [--latency 0.02]
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+sys.path.insert(0, str(Path(__file__).absolute().parent))
+
+import app
+from mock_upstreams import MockEntityApi, MockUuidApi
+
+MALFORMED_PATHS = ['wp-login.php', '.env', 'HBM123.ABCD.456', 'admin', 'favicon.ico']
+
+
+# Stand-in of the hubmap_commons AuthHelper, only the internal token is used without a user token
+class LocalAuthHelper:
+    def getProcessSecret(self):
+        return 'internal-token'
+
+
+def run(client, uuids, repeats, mocks):
+    app.cache.clear()
+    app.entity_index.clear()
+    app.file_access_decision_cache.clear()
+    app.unknown_uuid_filter.clear()
+    for mock in mocks:
+        mock.reset()
+
+    latencies = []
+    for _ in range(repeats):
+        for uuid in uuids:
+            start = time.perf_counter()
+            client.get('/file_auth', headers={'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{uuid}/index.html"})
+            latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    upstream_calls = sum(sum(mock.calls.values()) for mock in mocks)
+    return upstream_calls, sum(latencies) / len(latencies), latencies[len(latencies) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /file_auth requests of junk uuids")
+    parser.add_argument('--uuids', type=int, default=50, help="Distinct unknown uuids of each kind")
+    parser.add_argument('--repeats', type=int, default=20, help="Requests of each uuid")
+    parser.add_argument('--latency', type=float, default=0.02, help="Mock upstream latency in seconds")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    unknown_uuids = [f"{i:08x}" * 4 for i in range(args.uuids)]
+    invalid_file_uuids = [f"ffff{i:028x}" for i in range(args.uuids)]
+
+    with MockUuidApi(missing=unknown_uuids, invalid=invalid_file_uuids, latency=args.latency) as uuid_api, \
+         MockEntityApi(missing=unknown_uuids, latency=args.latency) as entity_api:
+        app.app.config['UUID_API_URL'] = uuid_api.url
+        app.app.config['ENTITY_API_URL'] = entity_api.url
+        app.auth_helper_instance = LocalAuthHelper()
+        client = app.app.test_client()
+        mocks = (uuid_api, entity_api)
+
+        print(f"{'uuids':>13} {'':>7} {'requests':>9} {'upstream calls':>15} {'mean ms':>8} {'p50 ms':>8}")
+        for name, uuids in [('malformed', MALFORMED_PATHS), ('unknown', unknown_uuids), ('invalid file', invalid_file_uuids)]:
+            with patch.object(app, 'is_unknown_uuid', return_value=False):
+                before = run(client, uuids, args.repeats, mocks)
+            after = run(client, uuids, args.repeats, mocks)
+
+            for mode, (upstream_calls, mean_latency, median_latency) in [('before', before), ('after', after)]:
+                print(f"{name:>13} {mode:>7} {len(uuids) * args.repeats:>9} {upstream_calls:>15} "
+                      f"{mean_latency * 1000:>8.3f} {median_latency * 1000:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# Load test of the two serving modes of /file_auth under the same mocked upstream latencies
+#   sync: the Flask app on a WSGI server with a fixed pool of threads, like one uWSGI worker process
+#   async: the ASGI app (asgi.py) on uvicorn, one event loop
+# Every request asks for a different file uuid so it misses the cache and needs the three upstream calls
+# (uuid-api /file-id and /hmuuid, entity-api /entities) against local mock servers with the given latency
+# The mocks and the load generator run in their own processes so their threads don't compete
+# with the server under test for the GIL, still compare the two modes with each other
+# rather than reading the numbers as absolute capacity
+#
+# Requires hubmap-auth/src/instance/app.cfg (copy of app.cfg.example is enough), aiohttp and uvicorn
+#
+# Usage (from the repository root):
+#   python benchmarks/load_serving_modes.py [--requests 2000] [--concurrency 500] [--threads 24] [--latency 0.05]
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+import aiohttp
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+sys.path.insert(0, str(Path(__file__).absolute().parent))
+
+import app
+import asgi
+from mock_upstreams import MockEntityApi, MockUuidApi
+
+
+# Stand-in of the hubmap_commons AuthHelper, only the internal token is used without a user token
+class LocalAuthHelper:
+    def getProcessSecret(self):
+        return 'internal-token'
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# WSGI server handling the requests with a fixed pool of threads, like the `threads` of a uWSGI worker
+# The connections beyond the pool wait in the listen backlog
+class ThreadPoolWSGIServer(WSGIServer):
+    request_queue_size = 512
+
+    def __init__(self, server_address, threads):
+        super().__init__(server_address, _QuietHandler)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def start_sync_server(threads):
+    server = ThreadPoolWSGIServer(('127.0.0.1', 0), threads)
+    server.set_app(app.app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", server.shutdown
+
+
+def start_async_server():
+    server = uvicorn.Server(uvicorn.Config(asgi.application, host='127.0.0.1', port=0, log_level='warning', access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    while not server.started:
+        time.sleep(0.05)
+
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+
+    return server, f"http://127.0.0.1:{port}", stop
+
+
+# Every file uuid belongs to a generated public dataset
+class _AnyFile(dict):
+    def __contains__(self, key):
+        return True
+
+    def __getitem__(self, key):
+        return 'd' + key[4:]
+
+
+# Run the mock uuid-api and entity-api until told to stop, then send back the number of calls they got
+def run_mock_upstreams(latency, conn):
+    with MockUuidApi(files=_AnyFile(), latency=latency) as uuid_api, MockEntityApi(latency=latency) as entity_api:
+        conn.send((uuid_api.url, entity_api.url))
+
+        while conn.recv() == 'reset':
+            conn.send(sum(uuid_api.calls.values()) + sum(entity_api.calls.values()))
+            uuid_api.reset()
+            entity_api.reset()
+
+
+def run_load(base_url, requests, concurrency, offset, conn):
+    conn.send(asyncio.run(generate_load(base_url, requests, concurrency, offset)))
+
+
+async def generate_load(base_url, requests, concurrency, offset):
+    latencies = []
+    statuses = {}
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as client:
+        async def user():
+            while not queue.empty():
+                i = queue.get_nowait()
+                headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/ffff{offset + i:028x}/image.png"}
+                start = time.perf_counter()
+                try:
+                    async with client.get(f"{base_url}/file_auth", headers=headers) as response:
+                        await response.read()
+                        status = response.status
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[user() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return elapsed, latencies, statuses
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the sync and async serving modes of /file_auth")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=500, help="Concurrent clients")
+    parser.add_argument('--threads', type=int, default=24, help="Threads of the sync server")
+    parser.add_argument('--latency', type=float, default=0.05, help="Mock upstream latency in seconds")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    context = multiprocessing.get_context('fork')
+    mocks_conn, conn = context.Pipe()
+    mocks = context.Process(target=run_mock_upstreams, args=(args.latency, conn), daemon=True)
+    mocks.start()
+    uuid_api_url, entity_api_url = mocks_conn.recv()
+
+    app.app.config['UUID_API_URL'] = uuid_api_url
+    app.app.config['ENTITY_API_URL'] = entity_api_url
+    app.auth_helper_instance = LocalAuthHelper()
+
+    print(f"{'mode':>6} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'upstream calls':>15}  statuses")
+
+    for offset, (mode, start_server) in enumerate([('sync', lambda: start_sync_server(args.threads)),
+                                                   ('async', start_async_server)]):
+        app.cache.clear()
+        app.file_access_decision_cache.clear()
+
+        server, base_url, stop = start_server()
+        try:
+            load_conn, conn = context.Pipe()
+            load = context.Process(target=run_load, args=(base_url, args.requests, args.concurrency, offset * args.requests, conn))
+            load.start()
+            elapsed, latencies, statuses = load_conn.recv()
+            load.join()
+        finally:
+            stop()
+
+        mocks_conn.send('reset')
+        upstream_calls = mocks_conn.recv()
+
+        print(f"{mode:>6} {args.requests:>9} {args.requests / elapsed:>8.0f} {percentile(latencies, 0.5) * 1000:>8.0f} "
+              f"{percentile(latencies, 0.95) * 1000:>8.0f} {percentile(latencies, 0.99) * 1000:>8.0f} {upstream_calls:>15}  {statuses}")
+
+    mocks_conn.send('stop')
+    mocks.join()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Load test of the request coalescing (single-flight) on the gateway cache misses
+# Fires concurrent threads asking for the same few entity-api URLs against a local mock entity-api
+# and counts the upstream requests per key with plain cachetools.cached() (before)
+# and with cached_single_flight() (after)
+#
+# Usage (from the repository root):
+#   python benchmarks/load_single_flight.py [--threads 200] [--keys 5] [--latency 0.2]
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+from cachetools import TTLCache, cached
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+sys.path.insert(0, str(Path(__file__).absolute().parent))
+
+from gateway_cache import cached_single_flight, compact_response
+from mock_upstreams import MockEntityApi
+from upstream import UpstreamClient
+
+
+def run(name, decorator, entity_api, client, threads, keys):
+    entity_api.reset()
+
+    @decorator(TTLCache(maxsize=1024, ttl=7200))
+    def make_api_request_get(target_url):
+        return compact_response(client.get(target_url))
+
+    urls = [f"{entity_api.url}/entities/dataset-{i}" for i in range(keys)]
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def worker(i):
+        barrier.wait()
+        try:
+            make_api_request_get(urls[i % keys])
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - start
+
+    calls = [entity_api.calls[f"/entities/dataset-{i}"] for i in range(keys)]
+    print(f"{name:>24} {threads:>8} {keys:>5} {sum(calls):>15} {max(calls):>13} {len(errors):>7} {elapsed:>10.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the request coalescing of the gateway cache misses")
+    parser.add_argument('--threads', type=int, default=200)
+    parser.add_argument('--keys', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.2, help="Mock entity-api latency in seconds")
+    args = parser.parse_args()
+
+    client = UpstreamClient(pool_size=args.threads, policies={'default': {'read_timeout': 30}})
+
+    with MockEntityApi(latency=args.latency) as entity_api:
+        print(f"{'':>24} {'threads':>8} {'keys':>5} {'upstream calls':>15} {'max per key':>13} {'errors':>7} {'elapsed':>11}")
+        run('cachetools.cached', cached, entity_api, client, args.threads, args.keys)
+        run('cached_single_flight', cached_single_flight, entity_api, client, args.threads, args.keys)
+
+
+if __name__ == '__main__':
+    main()
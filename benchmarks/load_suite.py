@@ -0,0 +1,388 @@
+# Load test suite of the auth endpoints against local mock uuid-api, entity-api, Globus and UMLS servers
+# Replays a traffic mix of the request kinds below and reports the throughput, the p50/p95/p99 latencies
+# and the upstream calls, overall and per kind, optionally diffed against a stored baseline
+#
+#   api_static:     /api_auth of a public static route
+#   api_wildcard:   /api_auth of a wildcard route requiring the read group, with a user token (a few invalid ones)
+#   file_public:    /file_auth of a hot file of a public dataset, without token
+#   file_protected: /file_auth of a hot file of a protected dataset, with a token of a protected data user
+#   file_cold:      /file_auth of a file of a dataset never requested before
+#   umls:           /umls_auth with one of a few UMLS keys
+#
+# The hot files are requested with a Zipf-like skew. The server under test runs either in-process
+# (the Flask app on a thread pool WSGI server, like one uWSGI worker) or under uWSGI with the processes,
+# threads and shared cache of src/uwsgi.ini. The mocks and the load generator run in their own processes
+#
+# Requires hubmap-auth/src/instance/app.cfg (copy of app.cfg.example is enough), aiohttp, and uwsgi for --mode uwsgi
+#
+# Usage (from the repository root):
+#   python benchmarks/load_suite.py [--mix mixed] [--requests 5000] [--concurrency 64] [--latency 0.02] [--error-rate 0]
+#                                   [--mode inprocess|uwsgi] [--save results.json] [--baseline baseline.json]
+import argparse
+import asyncio
+import configparser
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+BENCHMARKS_DIR = Path(__file__).absolute().parent
+SRC_DIR = BENCHMARKS_DIR.parent / 'hubmap-auth' / 'src'
+
+sys.path.insert(0, str(SRC_DIR))
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+from load_serving_modes import start_sync_server, percentile
+from load_suite_app import PROTECTED_GROUP_UUID, READ_GROUP_UUID, configure
+from mock_upstreams import MockEntityApi, MockGlobus, MockUmls, MockUuidApi
+
+# The authority of the generated API endpoints file
+API_AUTHORITY = 'load-suite.api.local'
+
+ENDPOINTS = {
+    API_AUTHORITY: [
+        {'method': 'GET', 'endpoint': '/status', 'auth': False},
+        {'method': 'GET', 'endpoint': '/datasets/<*>', 'auth': True, 'groups': [READ_GROUP_UUID]}
+    ]
+}
+
+KINDS = ('api_static', 'api_wildcard', 'file_public', 'file_protected', 'file_cold', 'umls')
+
+# Weight of each request kind in the traffic mixes
+MIXES = {
+    'mixed': {'api_static': 20, 'api_wildcard': 20, 'file_public': 30, 'file_protected': 10, 'file_cold': 15, 'umls': 5},
+    'api': {'api_static': 50, 'api_wildcard': 50},
+    'files': {'file_public': 60, 'file_protected': 25, 'file_cold': 15},
+    'cold': {'file_cold': 100}
+}
+
+FILES_PER_DATASET = 10
+TOKENS = 20
+UMLS_KEYS = 5
+
+# Metrics compared with the baseline, and whether higher is better
+COMPARED_METRICS = (('req/s', True), ('p50_ms', False), ('p95_ms', False), ('p99_ms', False), ('upstream_calls', False))
+
+
+def file_uuid(dataset_index, file_index):
+    return f"ffff{dataset_index:014x}{file_index:014x}"
+
+
+def dataset_uuid(dataset_index):
+    return f"{dataset_index:032x}"
+
+
+# The requests of the mix as (kind, path, headers), and the data of the mock upstreams they need
+def generate_traffic(mix, count, hot_datasets, seed):
+    rng = random.Random(seed)
+    weights = MIXES[mix]
+    kinds = rng.choices(list(weights), weights=list(weights.values()), k=count)
+
+    # The even hot datasets are public, the odd ones protected
+    hot_files = {visibility: [file_uuid(i, j) for i in range(hot_datasets) if i % 2 == parity for j in range(FILES_PER_DATASET)]
+                 for visibility, parity in (('public', 0), ('protected', 1))}
+    zipf = {visibility: [1 / (rank + 1) for rank in range(len(uuids))] for visibility, uuids in hot_files.items()}
+
+    files = {file_uuid(i, j): dataset_uuid(i) for i in range(hot_datasets) for j in range(FILES_PER_DATASET)}
+    entities = {dataset_uuid(i): {'uuid': dataset_uuid(i), 'entity_type': 'Dataset', 'status': 'Published',
+                                  'data_access_level': 'public' if i % 2 == 0 else 'protected'}
+                for i in range(hot_datasets)}
+    tokens = {}
+    for i in range(TOKENS):
+        tokens[f"consortium-{i}"] = [READ_GROUP_UUID]
+        tokens[f"protected-{i}"] = [READ_GROUP_UUID, PROTECTED_GROUP_UUID]
+
+    traffic = []
+    for n, kind in enumerate(kinds):
+        if kind == 'api_static':
+            traffic.append((kind, '/api_auth', {'Host': API_AUTHORITY, 'X-Original-Request-Method': 'GET', 'X-Original-URI': '/status'}))
+        elif kind == 'api_wildcard':
+            token = f"consortium-{rng.randrange(TOKENS)}" if rng.random() < 0.95 else f"invalid-{n}"
+            traffic.append((kind, '/api_auth', {'Host': API_AUTHORITY, 'X-Original-Request-Method': 'GET',
+                                                'X-Original-URI': f"/datasets/{dataset_uuid(rng.randrange(hot_datasets))}",
+                                                'Authorization': f"Bearer {token}"}))
+        elif kind in ('file_public', 'file_protected'):
+            visibility = kind[len('file_'):]
+            uuid = rng.choices(hot_files[visibility], weights=zipf[visibility])[0]
+            headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{uuid}/image.png"}
+            if visibility == 'protected':
+                headers['Authorization'] = f"Bearer protected-{rng.randrange(TOKENS)}"
+            traffic.append((kind, '/file_auth', headers))
+        elif kind == 'file_cold':
+            # A dataset of its own, after the hot ones
+            uuid = file_uuid(hot_datasets + n, 0)
+            files[uuid] = dataset_uuid(hot_datasets + n)
+            traffic.append((kind, '/file_auth', {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{uuid}/data.tsv"}))
+        else:
+            traffic.append((kind, '/umls_auth', {'X-Original-Request-Method': 'GET',
+                                                 'X-Original-URI': f"/umls/download.zip?umls-key=key-{rng.randrange(UMLS_KEYS)}"}))
+
+    return traffic, files, entities, tokens
+
+
+# Run the mock upstreams until told to stop, on 'reset' send back the calls each of them got
+def run_mock_upstreams(files, entities, tokens, latency, globus_latency, error_rate, conn):
+    mocks = {'uuid_api': MockUuidApi(files=files, latency=latency, error_rate=error_rate),
+             'entity_api': MockEntityApi(entities=entities, latency=latency, error_rate=error_rate),
+             'globus': MockGlobus(tokens=tokens, latency=globus_latency, error_rate=error_rate),
+             'umls': MockUmls(latency=latency, error_rate=error_rate)}
+
+    for mock in mocks.values():
+        mock.start()
+
+    conn.send({name: mock.url for name, mock in mocks.items()})
+
+    while conn.recv() == 'reset':
+        conn.send({name: sum(mock.calls.values()) for name, mock in mocks.items()})
+        for mock in mocks.values():
+            mock.reset()
+
+    for mock in mocks.values():
+        mock.stop()
+
+
+def run_load(base_url, traffic, concurrency, conn):
+    conn.send(asyncio.run(generate_load(base_url, traffic, concurrency)))
+
+
+# Replay the traffic with `concurrency` clients, return the elapsed time and (kind, status, latency) of each request
+async def generate_load(base_url, traffic, concurrency):
+    results = []
+    queue = asyncio.Queue()
+    for request in traffic:
+        queue.put_nowait(request)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as client:
+        async def user():
+            while not queue.empty():
+                kind, path, headers = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    async with client.get(f"{base_url}{path}", headers=headers) as response:
+                        await response.read()
+                        status = response.status
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status = type(e).__name__
+                results.append((kind, status, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[user() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return elapsed, results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# The gateway under uWSGI, with the processes, threads and cache2 of src/uwsgi.ini unless overridden
+def start_uwsgi_server(settings_file, processes, threads):
+    uwsgi = shutil.which('uwsgi')
+    if uwsgi is None:
+        sys.exit("uwsgi is not installed, run `pip install uwsgi` or use --mode inprocess")
+
+    ini = configparser.ConfigParser(inline_comment_prefixes=('#',))
+    ini.read(SRC_DIR / 'uwsgi.ini')
+    options = ini['uwsgi']
+
+    port = free_port()
+    command = [uwsgi, '--master', '--http-socket', f"127.0.0.1:{port}",
+               '--chdir', str(SRC_DIR), '--wsgi-file', str(BENCHMARKS_DIR / 'load_suite_app.py'),
+               '--processes', str(processes or options['processes']), '--threads', str(threads or options['threads']),
+               '--enable-threads', '--buffer-size', options['buffer-size'], '--listen', options['listen'],
+               '--cache2', options['cache2'], '--disable-logging', '--die-on-term']
+    process = subprocess.Popen(command, env={**os.environ, 'LOAD_SUITE_SETTINGS': settings_file},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while True:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                break
+        except OSError:
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                sys.exit("uWSGI failed to start")
+            time.sleep(0.2)
+
+    def stop():
+        process.terminate()
+        process.wait(timeout=30)
+
+    return process, base_url, stop
+
+
+def summarize(latencies, elapsed, statuses, upstream_calls=None):
+    latencies = sorted(latencies)
+    summary = {'requests': len(latencies),
+               'req/s': round(len(latencies) / elapsed, 1),
+               'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+               'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+               'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+               'statuses': statuses}
+
+    if upstream_calls is not None:
+        summary['upstream_calls'] = sum(upstream_calls.values())
+        summary['upstream_calls_by_service'] = upstream_calls
+
+    return summary
+
+
+def report(elapsed, results, upstream_calls):
+    by_kind = {}
+    for kind, status, latency in results:
+        entry = by_kind.setdefault(kind, {'latencies': [], 'statuses': {}})
+        entry['latencies'].append(latency)
+        entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+
+    statuses = {}
+    for entry in by_kind.values():
+        for status, count in entry['statuses'].items():
+            statuses[status] = statuses.get(status, 0) + count
+
+    return {'overall': summarize([latency for _, _, latency in results], elapsed, statuses, upstream_calls),
+            'kinds': {kind: summarize(entry['latencies'], elapsed, entry['statuses'])
+                      for kind, entry in sorted(by_kind.items(), key=lambda item: KINDS.index(item[0]))}}
+
+
+def print_results(results):
+    print(f"{'kind':>15} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for name, summary in [('overall', results['overall'])] + list(results['kinds'].items()):
+        print(f"{name:>15} {summary['requests']:>9} {summary['req/s']:>8.0f} {summary['p50_ms']:>8.1f} "
+              f"{summary['p95_ms']:>8.1f} {summary['p99_ms']:>8.1f}  {summary['statuses']}")
+
+    print()
+    print(f"upstream calls: {results['overall']['upstream_calls']} {results['overall']['upstream_calls_by_service']}")
+
+
+# Print the change of each compared metric against the baseline results
+# Return the regressions worse than `threshold` percent
+def compare(results, baseline, threshold):
+    regressions = []
+
+    print(f"{'kind':>15} {'metric':>15} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, summary in [('overall', results['overall'])] + list(results['kinds'].items()):
+        base = baseline['overall'] if name == 'overall' else baseline['kinds'].get(name)
+        if base is None:
+            continue
+
+        for metric, higher_is_better in COMPARED_METRICS:
+            if metric not in summary or not base.get(metric):
+                continue
+
+            change = (summary[metric] - base[metric]) / base[metric] * 100
+            regressed = (-change if higher_is_better else change) > threshold
+            if regressed:
+                regressions.append((name, metric, change))
+
+            print(f"{name:>15} {metric:>15} {base[metric]:>10} {summary[metric]:>10} {change:>+7.1f}%{'  REGRESSION' if regressed else ''}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the auth endpoints against local mock upstreams")
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=64, help="Concurrent clients")
+    parser.add_argument('--hot-datasets', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help="uuid-api, entity-api and UMLS latency in seconds")
+    parser.add_argument('--globus-latency', type=float, default=0.1, help="Globus latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0, help="Fraction of the upstream requests failing with 500")
+    parser.add_argument('--mode', choices=['inprocess', 'uwsgi'], default='inprocess')
+    parser.add_argument('--threads', type=int, help="Server threads, default to the threads of uwsgi.ini")
+    parser.add_argument('--processes', type=int, help="uWSGI processes, default to the processes of uwsgi.ini")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="Write the results to this JSON file, e.g., to use as the baseline")
+    parser.add_argument('--baseline', help="Compare with the results of a previous --save")
+    parser.add_argument('--threshold', type=float, default=10, help="Percent change counted as a regression")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    traffic, files, entities, tokens = generate_traffic(args.mix, args.requests, args.hot_datasets, args.seed)
+
+    context = multiprocessing.get_context('fork')
+    mocks_conn, conn = context.Pipe()
+    mocks = context.Process(target=run_mock_upstreams,
+                            args=(files, entities, tokens, args.latency, args.globus_latency, args.error_rate, conn), daemon=True)
+    mocks.start()
+    urls = mocks_conn.recv()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        endpoints_file = os.path.join(tmp_dir, 'api_endpoints.json')
+        with open(endpoints_file, 'w') as f:
+            json.dump(ENDPOINTS, f)
+
+        settings = {'uuid_api_url': urls['uuid_api'], 'entity_api_url': urls['entity_api'], 'globus_url': urls['globus'],
+                    'umls_url': urls['umls'], 'endpoints_file': endpoints_file}
+
+        if args.mode == 'uwsgi':
+            settings_file = os.path.join(tmp_dir, 'settings.json')
+            with open(settings_file, 'w') as f:
+                json.dump(settings, f)
+            server, base_url, stop = start_uwsgi_server(settings_file, args.processes, args.threads)
+        else:
+            configure(settings)
+            server, base_url, stop = start_sync_server(args.threads or 24)
+
+        try:
+            load_conn, conn = context.Pipe()
+            load = context.Process(target=run_load, args=(base_url, traffic, args.concurrency, conn))
+            load.start()
+            elapsed, results = load_conn.recv()
+            load.join()
+        finally:
+            stop()
+
+    mocks_conn.send('reset')
+    upstream_calls = mocks_conn.recv()
+    mocks_conn.send('stop')
+    mocks.join()
+
+    results = {'settings': {key: value for key, value in vars(args).items() if key not in ('save', 'baseline', 'threshold')},
+               **report(elapsed, results, upstream_calls)}
+
+    print(f"mix {args.mix}, {args.mode}, {args.requests} requests, {args.concurrency} clients, "
+          f"upstream latency {args.latency * 1000:.0f} ms (Globus {args.globus_latency * 1000:.0f} ms), error rate {args.error_rate}")
+    print()
+    print_results(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline['settings'] != results['settings']:
+            print()
+            print(f"Warning: the baseline settings differ: {baseline['settings']}")
+
+        print()
+        regressions = compare(results, baseline, args.threshold)
+
+        if regressions:
+            print()
+            print(f"{len(regressions)} regression(s) over {args.threshold}%")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
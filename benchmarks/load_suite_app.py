@@ -0,0 +1,105 @@
+# The gateway app configured against the mock upstreams of the load test suite (load_suite.py)
+# Imported by the suite for the in-process mode, and loaded by uWSGI as the wsgi-file for the uwsgi mode
+# where the settings come from the JSON file named by the LOAD_SUITE_SETTINGS environment variable
+#
+# hubmap_commons AuthHelper calls the Globus Auth and Groups APIs at their fixed URLs, so the app gets
+# a stand-in AuthHelper making the same calls to the mock Globus server instead
+import json
+import os
+import sys
+from pathlib import Path
+
+import requests
+from flask import Response
+from hubmap_commons.exceptions import HTTPException
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src'))
+
+import app
+from endpoints_config import EndpointsConfig
+
+INTERNAL_TOKEN = 'internal-token'
+
+# Group uuids of the mock Globus tokens, the highest one sets the data access level of the user
+READ_GROUP_UUID = '5777527e-ec11-11e8-ab41-0af86edb4424'
+PROTECTED_GROUP_UUID = '89a69625-99d7-11ea-9366-0e98982705c1'
+
+
+# Stand-in of the hubmap_commons AuthHelper calling the mock Globus server
+# Same return values and exceptions as the AuthHelper methods used by the gateway
+class MockGlobusAuthHelper:
+    def __init__(self, globus_url):
+        self.globus_url = globus_url
+        self.session = requests.Session()
+        # One connection per server thread
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=64))
+
+    def getProcessSecret(self):
+        return INTERNAL_TOKEN
+
+    def getAuthorizationTokens(self, headers):
+        auth_header = headers.get('Authorization')
+
+        if auth_header is None or not auth_header.lower().startswith('bearer '):
+            return Response("No Authorization header", 401)
+
+        return auth_header[7:].strip()
+
+    def _user_info(self, token, get_groups):
+        introspection = self.session.post(f"{self.globus_url}/v2/oauth2/token/introspect", data={'token': token}).json()
+
+        if not introspection.get('active'):
+            return None
+
+        if get_groups:
+            groups = self.session.get(f"{self.globus_url}/v2/groups/my_groups/{token}").json()
+            introspection['hmgroupids'] = [group['id'] for group in groups]
+
+        return introspection
+
+    def getUserInfoUsingRequest(self, request, getGroups=False):
+        token = self.getAuthorizationTokens(request.headers)
+
+        if isinstance(token, Response):
+            return token
+
+        user_info = self._user_info(token, getGroups)
+        return user_info if user_info is not None else Response("Invalid token", 401)
+
+    def getUserDataAccessLevel(self, request):
+        token = self.getAuthorizationTokens(request.headers)
+        user_info = None if isinstance(token, Response) else self._user_info(token, True)
+
+        if user_info is None:
+            raise HTTPException("No valid authorization token found.", 401)
+
+        if PROTECTED_GROUP_UUID in user_info['hmgroupids']:
+            user_info['data_access_level'] = 'protected'
+        elif READ_GROUP_UUID in user_info['hmgroupids']:
+            user_info['data_access_level'] = 'consortium'
+        else:
+            user_info['data_access_level'] = 'public'
+
+        return user_info
+
+
+# Point the app to the mock upstreams and the generated API endpoints file
+# settings: {"uuid_api_url", "entity_api_url", "globus_url", "umls_url", "endpoints_file"}
+def configure(settings):
+    app.app.config['UUID_API_URL'] = settings['uuid_api_url']
+    app.app.config['ENTITY_API_URL'] = settings['entity_api_url']
+    app.app.config['UMLS_KEY'] = 'load-suite-validator-key'
+    app.app.config['UMLS_VALIDATE_URL'] = f"{settings['umls_url']}/validate"
+
+    auth_helper = MockGlobusAuthHelper(settings['globus_url'])
+    app.auth_helper_instance = auth_helper
+    app.token_cache.auth_helper = auth_helper
+
+    app.endpoints_config = EndpointsConfig(settings['endpoints_file'], 0)
+
+    return app.app
+
+
+if 'LOAD_SUITE_SETTINGS' in os.environ:
+    with open(os.environ['LOAD_SUITE_SETTINGS']) as f:
+        application = configure(json.load(f))
@@ -0,0 +1,201 @@
+# Local mock uuid-api, entity-api, Globus and UMLS servers for the benchmarks and load tests
+# Each server runs in a background thread on a random local port, with a configurable
+# latency and error rate, and counts the requests received per path
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle(lambda mock: mock.respond(self.path))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        self._handle(lambda mock: mock.respond_post(self.path, form))
+
+    def _handle(self, respond):
+        mock = self.server.mock
+        mock.record(urlsplit(self.path).path)
+
+        if mock.latency:
+            time.sleep(mock.latency)
+
+        if mock.error_rate and mock.rng.random() < mock.error_rate:
+            status, body = 500, {'error': 'Injected error'}
+        else:
+            status, body = respond(mock)
+
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+# Base class of the mock servers, subclasses implement respond(path) -> (status, body) for GET
+# and respond_post(path, form) for POST with the parsed form data
+# The calls are counted per path without the query string
+class MockUpstream:
+    def __init__(self, latency=0, error_rate=0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def record(self, path):
+        with self._lock:
+            self.calls[path] += 1
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def respond(self, path):
+        raise NotImplementedError
+
+    def respond_post(self, path, form):
+        return 405, {'error': 'Method not allowed'}
+
+    def start(self):
+        self._server = _QuietServer(('127.0.0.1', 0), _Handler)
+        self._server.mock = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Mock entity-api serving GET /entities/<uuid>
+# `entities` maps the uuid to the entity dict, unknown uuids get a generated public Dataset
+# unless listed in `missing`
+class MockEntityApi(MockUpstream):
+    def __init__(self, entities=None, missing=(), **kwargs):
+        super().__init__(**kwargs)
+        self.entities = entities or {}
+        self.missing = set(missing)
+
+    def respond(self, path):
+        parts = path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'entities':
+            return 404, {'error': 'Not found'}
+
+        entity_uuid = parts[1]
+        if entity_uuid in self.missing:
+            return 404, {'error': f"Entity {entity_uuid} not found"}
+
+        entity = self.entities.get(entity_uuid, {'uuid': entity_uuid,
+                                                 'entity_type': 'Dataset',
+                                                 'data_access_level': 'public',
+                                                 'status': 'Published'})
+        return 200, entity
+
+
+# Mock uuid-api serving GET /hmuuid/<uuid> and GET /file-id/<uuid>
+# `files` maps the file uuid to the ancestor entity uuid, `types` maps the entity uuid to its type
+# The uuids in `invalid` get 400 like the ids uuid-api can't parse
+class MockUuidApi(MockUpstream):
+    def __init__(self, files=None, types=None, missing=(), invalid=(), **kwargs):
+        super().__init__(**kwargs)
+        self.files = files or {}
+        self.types = types or {}
+        self.missing = set(missing)
+        self.invalid = set(invalid)
+
+    def respond(self, path):
+        parts = path.strip('/').split('/')
+        if len(parts) != 2:
+            return 404, {'error': 'Not found'}
+
+        endpoint, uuid = parts
+        if uuid in self.invalid:
+            return 400, {'error': f"Invalid id {uuid}"}
+
+        if uuid in self.missing:
+            return 404, {'error': f"Could not find the target uuid {uuid}"}
+
+        if endpoint == 'file-id':
+            if uuid not in self.files:
+                return 404, {'error': f"Could not find the target file uuid {uuid}"}
+            return 200, {'file_uuid': uuid, 'ancestor_uuid': self.files[uuid]}
+
+        if endpoint == 'hmuuid':
+            return 200, {'uuid': uuid, 'type': self.types.get(uuid, 'DATASET')}
+
+        return 404, {'error': 'Not found'}
+
+
+# Mock Globus Auth token introspection (POST /v2/oauth2/token/introspect) and Groups API (GET /v2/groups/my_groups)
+# `tokens` maps the token to the list of its group uuids, the other tokens are inactive
+# The Groups API gets the token from the path, /v2/groups/my_groups/<token>, since the handler doesn't parse headers
+class MockGlobus(MockUpstream):
+    def __init__(self, tokens=None, **kwargs):
+        super().__init__(**kwargs)
+        self.tokens = tokens or {}
+
+    def respond_post(self, path, form):
+        if path != '/v2/oauth2/token/introspect':
+            return 404, {'error': 'Not found'}
+
+        token = form.get('token', [None])[0]
+        if token not in self.tokens:
+            return 200, {'active': False}
+
+        return 200, {'active': True, 'sub': f"user-{token}", 'username': f"{token}@example.org",
+                     'exp': int(time.time()) + 3600}
+
+    def respond(self, path):
+        parts = path.strip('/').split('/')
+        if len(parts) != 4 or parts[:3] != ['v2', 'groups', 'my_groups']:
+            return 404, {'error': 'Not found'}
+
+        if parts[3] not in self.tokens:
+            return 401, {'error': 'Invalid token'}
+
+        return 200, [{'id': group_uuid} for group_uuid in self.tokens[parts[3]]]
+
+
+# Mock UMLS key validation service, GET /validate?validatorApiKey=<key>&apiKey=<key>
+# Any key is valid except the ones in `invalid_keys`
+class MockUmls(MockUpstream):
+    def __init__(self, invalid_keys=(), **kwargs):
+        super().__init__(**kwargs)
+        self.invalid_keys = set(invalid_keys)
+
+    def respond(self, path):
+        parts = urlsplit(path)
+        if parts.path != '/validate':
+            return 404, {'error': 'Not found'}
+
+        api_key = parse_qs(parts.query).get('apiKey', [None])[0]
+        return 200, api_key is not None and api_key not in self.invalid_keys
@@ -1,25 +1,46 @@
 from json import JSONDecodeError
 
-from flask import Flask, request, jsonify, make_response, Response
+from flask import Flask, request, jsonify
 import requests
 # Don't confuse urllib (Python native library) with urllib3 (3rd-party library, requests also uses urllib3)
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from http import HTTPStatus
-import re
 import os
 import time
 import json
+import hashlib
+import random
+import functools
 import logging
+import threading
+import contextvars
 from cachetools import cached, TTLCache
+from cachetools.keys import hashkey
 from pathlib import Path
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, urlsplit
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 # HuBMAP commons
 from hubmap_commons.hm_auth import AuthHelper
 from hubmap_commons.exceptions import HTTPException
 
-
-# Set logging format and level (default is warning)
+# Local modules
+from endpoints_config import EndpointsConfig
+from entity_index import EntityIndex, avr_metadata, entity_metadata, file_metadata
+from entity_store import EntityStore
+from token_cache import CustomRequest, TokenCache, UPSTREAM_GLOBUS
+from status_poller import StatusPoller
+from upstream import UpstreamClient, DeadlineExceeded, completed_within_budget, deadline_budget, result_within_budget
+from circuit_breaker import CircuitOpen
+from gateway_cache import cached_single_flight, compact_response, create_cache, evict_by_prefix, register_worker_clear, broadcast_worker_clear, register_post_fork, CACHE_BACKEND_LOCAL, MeteredTTLCache, UwsgiCache, WorkerBroadcast
+from cache_warmer import CacheWarmer
+from uuid_filter import DecayingBloomFilter, is_valid_uuid
+from cache_invalidation import parse_invalidation, uuids_of_urls, CATEGORY_ENDPOINTS, CATEGORY_ENTITIES, CATEGORY_FILE_ACCESS, CATEGORY_TOKENS, CATEGORY_UMLS
+from load_shedding import RouteGuard, queue_time
+from metrics import observe_request, record_cache_lookup, record_rejection, requests_in_flight, exposition, CONTENT_TYPE as METRICS_CONTENT_TYPE, OTHER_AUTHORITY
+
+
+# Set logging format and level (default is warning), the level is then set by LOG_LEVEL in app.cfg
 # All the API logging is forwarded to the uWSGI server and gets written into the log file `uwsgi-hubmap-auth.log`
 # Log rotation is handled via logrotate on the host system with a configuration file
 # Do NOT handle log file and rotation via the Python logging to avoid issues with multi-worker processes
@@ -30,6 +51,12 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, instance_path=os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance'), instance_relative_config=True)
 app.config.from_pyfile('app.cfg')
 
+# DEBUG logs every step of each auth request, keep INFO or higher in production
+logging.getLogger().setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+
+# Fraction of the auth requests to log the headers of at INFO level, 0 to disable, 1 to log all of them
+request_log_sample_rate = app.config.get('LOG_REQUEST_SAMPLE_RATE', 0)
+
 # Remove trailing slash / from URL base to avoid "//" caused by config with trailing slash
 app.config['UUID_API_URL'] = app.config['UUID_API_URL'].strip('/')
 app.config['ENTITY_API_URL'] = app.config['ENTITY_API_URL'].strip('/')
@@ -52,7 +79,147 @@ app.config['SCFIND_API_STATUS_URL'] = app.config['SCFIND_API_STATUS_URL'].strip(
 # with a memoizing callable that saves up to maxsize results based on a Least Frequently Used (LFU) algorithm
 # with a per-item time-to-live (TTL) value
 # Here we use two hours, 7200 seconds for ttl
-cache = TTLCache(maxsize=app.config['CACHE_MAXSIZE'], ttl=app.config['CACHE_TTL'])
+# With CACHE_BACKEND = 'uwsgi' this cache is shared by all the uWSGI worker processes
+# and survives the worker recycling, otherwise each worker process has its own cache
+# Each entry has its own expiry based on its category, see cache_ttl_* below,
+# the backend TTL only needs to outlive the longest of them
+cache_ttl_positive = app.config.get('CACHE_TTL_POSITIVE', app.config['CACHE_TTL'])
+cache_ttl_negative = app.config.get('CACHE_TTL_NEGATIVE', app.config['CACHE_TTL'])
+cache_ttl_error = app.config.get('CACHE_TTL_ERROR', 0)
+cache_stale_ttl = app.config.get('CACHE_STALE_TTL', 0)
+
+# The UMLS key validations are cached in the same cache by the hash of the key,
+# the valid keys for UMLS_CACHE_TTL and the invalid ones for the shorter UMLS_CACHE_NEGATIVE_TTL
+umls_cache_ttl = app.config.get('UMLS_CACHE_TTL', 3600)
+umls_cache_negative_ttl = app.config.get('UMLS_CACHE_NEGATIVE_TTL', 60)
+
+cache = create_cache(app.config.get('CACHE_BACKEND', CACHE_BACKEND_LOCAL),
+                     maxsize=app.config['CACHE_MAXSIZE'],
+                     ttl=max(app.config['CACHE_TTL'], cache_ttl_positive + cache_stale_ttl,
+                             cache_ttl_negative, cache_ttl_error, umls_cache_ttl, umls_cache_negative_ttl),
+                     uwsgi_cache_name=app.config.get('UWSGI_CACHE_NAME'))
+
+# The cachetools caches are not thread-safe, guard the access from the uWSGI threads
+cache_lock = threading.RLock()
+
+# Per-process cache for the data that doesn't belong to the shared cache, e.g., the gateway version
+local_cache = TTLCache(maxsize=app.config['CACHE_MAXSIZE'], ttl=app.config['CACHE_TTL'])
+
+# The API endpoints file compiled into the route index used by api_auth
+# Watched for changes by each worker process every API_ENDPOINTS_POLL_INTERVAL seconds (0 to disable)
+# and swapped in atomically, a bad file is rejected and the last good version kept
+endpoints_config = EndpointsConfig(app.config['API_ENDPOINTS_FILE'], app.config.get('API_ENDPOINTS_POLL_INTERVAL', 5))
+
+# Clear the per-process cache of every worker on /cache_clear and reload the API endpoints file
+register_worker_clear(local_cache.clear)
+register_worker_clear(lambda: endpoints_config.reload(force=True))
+
+# Access tiers of the file_auth callers without token or with an invalid token,
+# the callers with a valid token are tiered by their highest data access level
+ACCESS_TIER_ANONYMOUS = 'anonymous'
+ACCESS_TIER_INVALID_TOKEN = 'invalid_token'
+
+# The file_auth decisions that only depend on the entity data and the caller access tier
+FILE_ACCESS_CACHEABLE_CODES = (200, 401, 403)
+
+# Per-process cache of the file_auth decisions (200/401/403) keyed by (uuid, caller access tier)
+# A hit is a single dict lookup without any upstream call. A change of the entity data access level or status
+# is seen once the entity index and the entity store entries expire too, or when invalidated with /cache_invalidate
+file_access_decision_cache = MeteredTTLCache(maxsize=app.config.get('FILE_AUTH_DECISION_CACHE_MAXSIZE', 65536),
+                                             ttl=app.config.get('FILE_AUTH_DECISION_TTL', 300),
+                                             name='file_access_decision')
+register_worker_clear(file_access_decision_cache.clear)
+
+entity_index_ttl = app.config.get('ENTITY_INDEX_TTL', cache_ttl_positive)
+
+# Store of the entity metadata shared by all the worker processes behind their entity index, in a memory-mapped file
+# kept across the restarts (ENTITY_STORE_PATH, '' to disable) sized for ENTITY_STORE_CAPACITY uuids, see entity_store.py
+entity_store = None
+if app.config.get('ENTITY_STORE_PATH'):
+    try:
+        entity_store = EntityStore(app.config['ENTITY_STORE_PATH'],
+                                   app.config.get('ENTITY_STORE_CAPACITY', 2000000),
+                                   app.config.get('ENTITY_STORE_TTL', entity_index_ttl))
+    except OSError:
+        logger.exception(f"Unable to open the entity store {app.config['ENTITY_STORE_PATH']}, running without it")
+
+# Per-process index of the file ancestors and entity metadata resolved from uuid-api and entity-api
+# A file of an already resolved dataset only needs the uuid-api /file-id lookup
+entity_index = EntityIndex(maxsize=app.config.get('ENTITY_INDEX_MAXSIZE', app.config['CACHE_MAXSIZE']),
+                           ttl=entity_index_ttl,
+                           store=entity_store)
+register_worker_clear(entity_index.clear)
+
+# Per-process filter of the uuids unknown to uuid-api (404, or 400 for an invalid file uuid), e.g., scanners and broken links
+# The same unknown uuid asked again within FILE_AUTH_UNKNOWN_UUID_TTL (up to twice as long) gets 404 without any upstream request
+# Sized for FILE_AUTH_UNKNOWN_UUID_FILTER_CAPACITY uuids per TTL with about twice FILE_AUTH_UNKNOWN_UUID_FILTER_ERROR_RATE
+# of the other uuids wrongly rejected, 0 capacity to disable
+unknown_uuid_filter_capacity = app.config.get('FILE_AUTH_UNKNOWN_UUID_FILTER_CAPACITY', 100000)
+unknown_uuid_filter = DecayingBloomFilter(unknown_uuid_filter_capacity,
+                                          app.config.get('FILE_AUTH_UNKNOWN_UUID_FILTER_ERROR_RATE', 1e-6),
+                                          app.config.get('FILE_AUTH_UNKNOWN_UUID_TTL', 3600)) if unknown_uuid_filter_capacity > 0 else None
+if unknown_uuid_filter is not None:
+    register_worker_clear(unknown_uuid_filter.clear)
+
+# Cache-Control max-age (seconds) of the /api_auth and /file_auth decisions for nginx to cache them in its workers,
+# see nginx/conf.d-*/auth_cache.conf. The decisions on the public endpoints and the data anyone can access last longer
+# than the ones depending on the token, the errors are never cached. /cache_invalidate doesn't reach the nginx cache
+auth_decision_ttl_public = app.config.get('AUTH_DECISION_TTL_PUBLIC', 300)
+auth_decision_ttl_protected = app.config.get('AUTH_DECISION_TTL_PROTECTED', 30)
+
+# Per-process admission of the /api_auth, /file_auth, /file_auth/batch, /umls_auth and /status.json requests,
+# so the slow routes (status checks, UMLS, batches) can't take all the uWSGI threads of the worker from /api_auth
+# The rejected requests get 503 at once, see ROUTE_CONCURRENCY_LIMITS and LOAD_SHEDDING
+route_guard = RouteGuard(app.config.get('ROUTE_CONCURRENCY_LIMITS', {}), app.config.get('LOAD_SHEDDING', {}))
+
+# Threads of each worker process making the independent uuid-api and entity-api lookups of an entity at the same time
+# The threads are only started on first use, within the worker process
+upstream_lookup_executor = ThreadPoolExecutor(max_workers=app.config.get('UPSTREAM_LOOKUP_THREADS', 48), thread_name_prefix='upstream-lookup')
+
+# Threads of each worker process resolving the uncached decisions of /file_auth/batch concurrently
+# The threads are only started on first use, within the worker process
+batch_executor = ThreadPoolExecutor(max_workers=app.config.get('FILE_AUTH_BATCH_CONCURRENCY', 16), thread_name_prefix='file-auth-batch')
+
+# Threads of each worker process making the status checks of /status.json, shared by the concurrent requests
+# A check still running after STATUS_DEADLINE keeps its thread, the checks of the next requests queue behind it
+# The threads are only started on first use, within the worker process
+status_executor = ThreadPoolExecutor(max_workers=app.config.get('STATUS_CHECK_THREADS', 22), thread_name_prefix='status-check')
+
+# Background poller of /status.json, only when STATUS_POLL_INTERVAL (seconds) is set
+# Lazily started by the first /status.json request in each worker process
+status_poller = None
+if app.config.get('STATUS_POLL_INTERVAL'):
+    status_poller = StatusPoller(lambda: get_status_data(), app.config['STATUS_POLL_INTERVAL'], cache, cache_lock)
+
+# Warm-up of the resolution of the hot uuids listed in CACHE_WARMUP_UUIDS_FILE and/or the most requested
+# ones of the assets server nginx access logs CACHE_WARMUP_ACCESS_LOGS, at the worker start and then every
+# CACHE_WARMUP_INTERVAL seconds (0 for only at start)
+# With the shared uWSGI cache only the first worker runs it, otherwise each worker warms up its own cache
+cache_warmer = None
+if app.config.get('CACHE_WARMUP_UUIDS_FILE') or app.config.get('CACHE_WARMUP_ACCESS_LOGS'):
+    cache_warmer = CacheWarmer(lambda uuid: warm_up_file_access(uuid), cache, cache_lock,
+                               uuids_file=app.config.get('CACHE_WARMUP_UUIDS_FILE'),
+                               access_logs=app.config.get('CACHE_WARMUP_ACCESS_LOGS', []),
+                               max_uuids=app.config.get('CACHE_WARMUP_MAX_UUIDS', 5000),
+                               concurrency=app.config.get('CACHE_WARMUP_CONCURRENCY', 8),
+                               interval=app.config.get('CACHE_WARMUP_INTERVAL', 3600))
+    register_post_fork(cache_warmer.start, first_worker_only=isinstance(cache, UwsgiCache))
+
+# Upstream name of each configured upstream host, used to pick the policy in UPSTREAM_POLICIES
+upstream_names = {}
+for url_key, upstream_name in [('UUID_API_URL', 'uuid_api'), ('ENTITY_API_URL', 'entity_api'), ('UMLS_VALIDATE_URL', 'umls')]:
+    if app.config.get(url_key):
+        upstream_names[urlsplit(app.config[url_key]).netloc] = upstream_name
+
+# Keep-alive connection pool per upstream host shared by all the threads of this worker process
+# Timeouts, retries and circuit breakers are configured per upstream, the hosts not listed use the 'default' policy
+upstream_client = UpstreamClient(pool_size=app.config.get('UPSTREAM_POOL_SIZE', 24),
+                                 policies=app.config.get('UPSTREAM_POLICIES', {}),
+                                 upstream_names=upstream_names)
+
+# Seconds all the upstream calls of one /api_auth, /file_auth or /file_auth/batch request get in total
+# (Globus token validation, uuid-api and entity-api lookups), the request gets 500 once it runs out, 0 for no deadline
+auth_request_deadline = app.config.get('AUTH_REQUEST_DEADLINE', 10)
 
 # Suppress InsecureRequestWarning warning when requesting status on https with ssl cert verify disabled
 requests.packages.urllib3.disable_warnings(category = InsecureRequestWarning)
@@ -76,6 +243,124 @@ except Exception:
     # Log the full stack trace, prepend a line with our message
     logger.exception(msg)
 
+# Gateway level cache of the Globus token introspection and group lookup made by AuthHelper
+# Keyed by the hash of the token, uses the same backend as the gateway cache
+token_cache = TokenCache(AuthHelper.instance() if AuthHelper.isInitialized() else None,
+                         create_cache(app.config.get('CACHE_BACKEND', CACHE_BACKEND_LOCAL),
+                                      maxsize=app.config.get('TOKEN_CACHE_MAXSIZE', 4096),
+                                      ttl=app.config.get('TOKEN_CACHE_TTL', 900),
+                                      uwsgi_cache_name=app.config.get('UWSGI_CACHE_NAME'),
+                                      name='token'),
+                         ttl=app.config.get('TOKEN_CACHE_TTL', 900),
+                         negative_ttl=app.config.get('TOKEN_CACHE_NEGATIVE_TTL', 30),
+                         breaker=upstream_client.breaker(UPSTREAM_GLOBUS),
+                         executor=upstream_lookup_executor)
+
+# With the per-process CACHE_BACKEND, each worker also has its own gateway and token caches to clear
+for per_process_cache in (cache, token_cache.cache):
+    if not isinstance(per_process_cache, UwsgiCache):
+        register_worker_clear(per_process_cache.clear)
+
+# Delivers the targeted invalidations of /cache_invalidate to every worker process
+# through the shared uWSGI cache, see invalidate_worker_caches()
+worker_invalidation = WorkerBroadcast(cache, 'cache_invalidation_log')
+
+
+####################################################################################################
+## Auth responses
+####################################################################################################
+
+# Nginx auth_request only cares about the response status code, it ignores the response body
+# The body is only for description purposes and direct visit to the auth endpoints
+# so it's serialized once here instead of on every request
+# Note: 400 and 404 are not supported http://nginx.org/en/docs/http/ngx_http_auth_request_module.html
+# Any response code other than 200/401/403 returned by the subrequest is considered an error 500
+AUTH_RESPONSE_BODIES = {
+    200: json.dumps({"message": "OK: Authorized"}),
+    400: json.dumps({"message": "ERROR: Bad Request"}),
+    401: json.dumps({"message": "ERROR: Unauthorized"}),
+    403: json.dumps({"message": "ERROR: Forbidden"}),
+    404: json.dumps({"message": "ERROR: Not Found"}),
+    500: json.dumps({"message": "ERROR: Internal Server Error"}),
+    503: json.dumps({"message": "ERROR: Service Unavailable"})
+}
+
+# The decisions nginx auth_request acts on, the other codes are errors
+AUTH_DECISION_CODES = (200, 401, 403)
+
+# The Cache-Control of an auth response: the decisions are cacheable for `ttl` seconds, the errors never
+def auth_cache_control(status_code, ttl):
+    if status_code in AUTH_DECISION_CODES and ttl > 0:
+        return f"max-age={ttl}"
+    return 'no-store'
+
+# The response of the given status code with the prebuilt body, cacheable by nginx for `ttl` seconds
+# A new response object is still needed per request since Flask may modify it while finalizing the request
+def auth_response(status_code, ttl=0):
+    response = app.response_class(AUTH_RESPONSE_BODIES[status_code], status=status_code, mimetype='application/json')
+    response.headers['Cache-Control'] = auth_cache_control(status_code, ttl)
+    return response
+
+# Host of the file assets service, its requests are labeled with it in the metrics
+file_assets_authority = urlsplit(app.config['FILE_ASSETS_STATUS_URL']).netloc
+
+# The authority label of the request metrics, only the authorities of the API endpoints file
+# and the file assets service are kept as is to bound the number of time series
+def metric_authority(host):
+    if host == file_assets_authority or host in endpoints_config.authorities():
+        return host
+    return OTHER_AUTHORITY
+
+# Record the decorated endpoint requests in the metrics: in flight, then the duration labeled
+# with the authority and the decision (response status code)
+def metered(route):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            in_flight = requests_in_flight.labels(route)
+            in_flight.inc()
+            start = time.perf_counter()
+            decision = 500
+
+            try:
+                response = app.make_response(func(*args, **kwargs))
+                decision = response.status_code
+                return response
+            finally:
+                in_flight.dec()
+                observe_request(route, metric_authority(request.headers.get('Host')), decision, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+# Admit the decorated endpoint requests with the route guard, a rejected request gets 503 without running the endpoint
+# The queue time is based on the X-Request-Start header set by nginx
+def guarded(route):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            reason = route_guard.enter(route, queue_time(request.headers.get('X-Request-Start')))
+
+            if reason is not None:
+                record_rejection(route, reason)
+                return auth_response(503)
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                route_guard.leave(route)
+
+        return wrapper
+
+    return decorator
+
+# Log the headers of a sample of the auth requests, see LOG_REQUEST_SAMPLE_RATE
+# The headers only get formatted when the record is actually emitted
+def log_sampled_request(name, headers):
+    if request_log_sample_rate and random.random() < request_log_sample_rate and logger.isEnabledFor(logging.INFO):
+        logger.info("======%s request.headers (sampled)======\n%s", name, headers)
+
 
 ####################################################################################################
 ## Default route
@@ -92,9 +377,36 @@ def home():
 
 
 # JSON version of status
+# With STATUS_POLL_INTERVAL set, return the last snapshot refreshed by the background poller
 @app.route('/status.json', methods = ['GET'])
+@metered('status.json')
+@guarded('status.json')
 def status_json():
-    return jsonify(get_status_data())
+    return jsonify(current_status_data())
+
+
+# The last snapshot of the background poller if enabled, otherwise check all the services now
+def current_status_data():
+    if status_poller is not None:
+        status_poller.start()
+        return status_poller.snapshot()
+
+    return get_status_data()
+
+
+# Report of the last cache warm-up run: duration, number of uuids, already cached, fetched and failed,
+# and the hit rate (fraction of the uuids already cached)
+@app.route('/cache_warmup', methods = ['GET'])
+def cache_warmup():
+    if cache_warmer is None:
+        return jsonify({"message": "The cache warm-up is not enabled"}), 404
+
+    report = cache_warmer.report()
+
+    if report is None:
+        return jsonify({"message": "The cache warm-up has not run yet"}), 404
+
+    return jsonify(report)
 
 
 ####################################################################################################
@@ -102,91 +414,229 @@ def status_json():
 ####################################################################################################
 
 
+# Prometheus metrics of the gateway, summed up over all the worker processes
+# (requests, caches, upstream calls), see metrics.py
+@app.route('/metrics', methods = ['GET'])
+def prometheus_metrics():
+    return app.response_class(exposition(), content_type=METRICS_CONTENT_TYPE)
+
+
+# Connection pool counters of the upstream hosts in the worker process handling this request
+@app.route('/upstream_pool_stats', methods = ['GET'])
+def upstream_pool_stats():
+    return jsonify(upstream_client.stats())
+
+
+# Version and load time of the active API endpoints file in the worker process handling this request
+@app.route('/api_auth/config', methods = ['GET'])
+def api_auth_config():
+    endpoints_config.start()
+    return jsonify(endpoints_config.info())
+
+
 @app.route('/cache_clear', methods = ['GET'])
 def cache_clear():
+    # Clear the shared caches and signal all the worker processes to clear their own cache
     cache.clear()
+    if entity_store is not None:
+        entity_store.clear()
+    broadcast_worker_clear()
     logger.info("All gateway API Auth function cache cleared.")
     return "All function cache cleared."
 
 
+# Evict the cached data of the given uuids, uuid-api/entity-api URL prefixes and/or categories
+# from the shared cache and the per-process caches of all the worker processes, see cache_invalidation.py
+# e.g., called by entity-api when the status or the data access level of an entity changes:
+#   POST /cache_invalidate {"uuids": ["<entity uuid>"]}
+# Only allowed with the internal token (modified version of the globus app secret) in the Authorization header
+@app.route('/cache_invalidate', methods = ['POST'])
+def cache_invalidate():
+    if not is_secrect_token(request):
+        return auth_response(401)
+
+    try:
+        invalidation = parse_invalidation(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    evicted = invalidate_shared_caches(invalidation)
+
+    if evicted is None:
+        # The keys of the uWSGI cache can't be listed, fall back to clearing everything as /cache_clear does
+        cache.clear()
+        if entity_store is not None:
+            entity_store.clear()
+        broadcast_worker_clear()
+        logger.info(f"Unable to invalidate {invalidation} selectively, all gateway cache cleared.")
+        return jsonify({"message": "All the caches cleared", "evicted": None, "workers": "cleared"})
+
+    # The per-process data of the entities behind the evicted URLs goes with them
+    uuids = tuple(dict.fromkeys(invalidation.uuids + tuple(uuids_of_urls(evicted))))
+
+    # Before the worker processes so their entity index isn't refilled from the store with the invalidated entities
+    invalidate_entity_store(invalidation, uuids)
+
+    if worker_invalidation.send(invalidation._replace(uuids=uuids)):
+        workers = "invalidated"
+    else:
+        broadcast_worker_clear()
+        workers = "cleared"
+
+    logger.info(f"Invalidated {invalidation}: {len(evicted)} shared cache entries evicted, worker caches {workers}")
+
+    return jsonify({"message": "OK: Invalidated", "evicted": len(evicted), "workers": workers})
+
+
+# Evict the invalidated entries of the gateway cache and the token cache, shared by all the workers with the uWSGI backend
+# Return the evicted keys in their string form, or None if the invalidation needs the keys of the uWSGI cache
+# but they can't be listed
+def invalidate_shared_caches(invalidation):
+    evicted = []
+
+    for uuid in invalidation.uuids:
+        for target_url in (entity_api_url(uuid), uuid_api_entity_url(uuid), uuid_api_file_url(uuid)):
+            with cache_lock:
+                if cache.pop(hashkey(target_url), None) is not None:
+                    evicted.append(target_url)
+
+    url_prefixes = list(invalidation.url_prefixes)
+    if CATEGORY_ENTITIES in invalidation.categories:
+        url_prefixes += [app.config['UUID_API_URL'], app.config['ENTITY_API_URL']]
+
+    evictions = []
+    if url_prefixes:
+        evictions.append(evict_by_prefix(cache, url_prefixes, cache_lock))
+    if CATEGORY_UMLS in invalidation.categories:
+        evictions.append(evict_by_prefix(cache, ['umls|'], cache_lock))
+    if CATEGORY_TOKENS in invalidation.categories:
+        evictions.append(token_cache.clear())
+
+    for keys in evictions:
+        if keys is None:
+            return None
+        evicted.extend(keys)
+
+    return evicted
+
+
+# Evict the invalidated entities of the entity store, shared by all the worker processes so run once
+# The store entries behind an URL prefix can't be found, they go with all the others
+def invalidate_entity_store(invalidation, uuids):
+    if entity_store is None:
+        return
+
+    if CATEGORY_ENTITIES in invalidation.categories or invalidation.url_prefixes:
+        entity_store.clear()
+    else:
+        for uuid in uuids:
+            entity_store.invalidate(uuid)
+
+
+# Evict the invalidated data of the per-process caches, run by every worker process
+def invalidate_worker_caches(invalidation):
+    categories = set(invalidation.categories)
+
+    if categories & {CATEGORY_ENTITIES, CATEGORY_FILE_ACCESS}:
+        with cache_lock:
+            file_access_decision_cache.clear()
+    elif invalidation.uuids:
+        invalidate_file_access_decisions(invalidation.uuids)
+
+    if CATEGORY_ENTITIES in categories:
+        entity_index.clear()
+    else:
+        for uuid in invalidation.uuids:
+            entity_index.invalidate(uuid)
+
+    # The uuids can't be removed from the filter one by one
+    if unknown_uuid_filter is not None and (CATEGORY_ENTITIES in categories or any(uuid in unknown_uuid_filter for uuid in invalidation.uuids)):
+        unknown_uuid_filter.clear()
+
+    if CATEGORY_ENDPOINTS in categories:
+        endpoints_config.reload(force=True)
+
+worker_invalidation.register(invalidate_worker_caches)
+
+
+# Evict the cached file_auth decisions of the given uuids and of the files of the given entity uuids
+# The files are found in the entity index, or else by their uuid-api /file-id lookup still in the gateway cache
+def invalidate_file_access_decisions(uuids):
+    uuids = set(uuids)
+    for uuid in list(uuids):
+        uuids.update(entity_index.files_of(uuid))
+
+    with cache_lock:
+        for decision_key in list(file_access_decision_cache.keys()):
+            uuid = decision_key[0]
+
+            if uuid in uuids or cached_ancestor_uuid(uuid) in uuids:
+                file_access_decision_cache.pop(decision_key, None)
+
+
+# The entity uuid of the file uuid from the cached uuid-api /file-id lookup, None if not cached
+def cached_ancestor_uuid(uuid):
+    if not uuid.startswith('ffff'):
+        return None
+
+    entry = make_api_request_get.cache_entry(uuid_api_file_url(uuid))
+    return entry.value.ancestor_uuid if entry is not None else None
+
+
 # Auth for private API services
 # All endpoints access need to be authenticated
 # Direct access will see the JSON message
 # Nginx auth_request module won't be able to display the JSON message for 401 response
 @app.route('/api_auth', methods = ['GET'])
+@metered('api_auth')
+@guarded('api_auth')
 def api_auth():
-    wildcard_delimiter = "<*>"
-    # The regular expression pattern takes any alphabetical and numerical characters,
-    # % used in URL encoding, and other characters permitted in the URI
-    regex_pattern = r"[a-zA-Z0-9_.:%#@!&=+*-]+"
+    log_sampled_request('api_auth', request.headers)
 
-    logger.info("======api_auth request.headers======")
-    logger.info(request.headers)
+    # Unknown authority, unknown request method, unknown path or missing lookup_key are all unauthorized
+    item = match_api_endpoint(request.headers)
 
-    # Nginx auth_request only cares about the response status code
-    # it ignores the response body
-    # We use body here only for direct visit to this endpoint
-    response_200 = make_response(jsonify({"message": "OK: Authorized"}), 200)
-    response_401 = make_response(jsonify({"message": "ERROR: Unauthorized"}), 401)
+    if item is None:
+        return auth_response(401, auth_decision_ttl_protected)
+
+    # The decision on a public endpoint doesn't depend on the token
+    ttl = auth_decision_ttl_public if item['auth'] == False else auth_decision_ttl_protected
+
+    # Globus unavailable (circuit breaker open) or too slow is an error, not a decision on the token
+    try:
+        with deadline_budget(auth_request_deadline):
+            allowed = api_access_allowed(item, request)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Unable to validate the token: {e}")
+        return auth_response(500)
+
+    if allowed:
+        return auth_response(200, ttl)
+    else:
+        return auth_response(401, ttl)
 
-    # In the json, we use authority as the key to differ each service section
-    authority = None
-    method = None
-    endpoint = None
 
+# Return the endpoint item of api_endpoints.json matching the original request described by the headers
+# None if unknown authority, unknown request method or unknown path, or if the headers are missing
+def match_api_endpoint(headers):
     # URI = scheme:[//authority]path[?query][#fragment] where authority = [userinfo@]host[:port]
     # This "Host" header is nginx `$http_host` which contains port number,
     # unlike `$host` which doesn't include port number
     # Here we don't parse the "X-Forwarded-Proto" header because the scheme is either HTTP or HTTPS
-    if ("X-Original-Request-Method" in request.headers) and ("Host" in request.headers) and ("X-Original-URI" in request.headers):
-        authority = request.headers.get("Host")
-        method = request.headers.get("X-Original-Request-Method")
-        endpoint = request.headers.get("X-Original-URI")
-
-    # method and endpoint are always not None as long as authority is not None
-    if authority is not None:
-        # Load endpoints from json
-        data = load_file(app.config['API_ENDPOINTS_FILE'])
-
-        if authority in data.keys():
-            # First pass, loop through the list to find exact static match
-            for item in data[authority]:
-                if (item['method'].upper() == method.upper()) and (wildcard_delimiter not in item['endpoint']):
-                    # Ignore the query string
-                    target_endpoint = endpoint.split("?")[0]
-                    # Remove trailing slash for comparison
-                    if item['endpoint'].strip('/') == target_endpoint.strip('/'):
-                        if api_access_allowed(item, request):
-                            return response_200
-                        else:
-                            return response_401
-
-            # Second pass, loop through the list to do the wildcard match
-            for item in data[authority]:
-                if (item['method'].upper() == method.upper()) and (wildcard_delimiter in item['endpoint']):
-                    # First replace all occurrences of the wildcard delimiters with regular expression
-                    endpoint_pattern = item['endpoint'].replace(wildcard_delimiter, regex_pattern)
-                    # Ignore the query string
-                    target_endpoint = endpoint.split("?")[0]
-                    # If the full url path matches the regular expression pattern, 
-                    # return a corresponding match object, otherwise return None
-                    target_endpoint = endpoint.split("?")[0]
-                    # Remove trailing slash for comparison
-                    if re.fullmatch(endpoint_pattern.strip('/'), target_endpoint.strip('/')) is not None:
-                        if api_access_allowed(item, request):
-                            return response_200
-                        else:
-                            return response_401
-
-            # After two passes and still no match found
-            # It could be either unknown request method or unknown path
-            return response_401
-
-        # Handle the cases when authority not in data.keys() 
-        return response_401
-    else:
-        # Missing lookup_key
-        return response_401
+    # In the json, we use authority as the key to differ each service section
+    if not (("X-Original-Request-Method" in headers) and ("Host" in headers) and ("X-Original-URI" in headers)):
+        return None
+
+    authority = headers.get("Host")
+    method = headers.get("X-Original-Request-Method")
+    endpoint = headers.get("X-Original-URI")
+
+    # The precompiled route index of the active version of the endpoints json
+    endpoints_config.start()
+    route_index = endpoints_config.route_index()
+
+    # Exact static match first, then the wildcard match
+    return route_index.match(authority, method, endpoint)
 
 
 ####################################################################################################
@@ -202,114 +652,150 @@ def api_auth():
 # The query string with token is optional, but will be used by the portal-ui
 # No token is required for accessing AVR files
 @app.route('/file_auth', methods = ['GET'])
+@metered('file_auth')
+@guarded('file_auth')
 def file_auth():
-    logger.info("======file_auth Original request.headers======")
-    logger.info(request.headers)
-
-    # Nginx auth_request only cares about the response status code
-    # it ignores the response body
-    # We use body here only for description purposes and direct visit to this endpoint
-    response_200 = make_response(jsonify({"message": "OK: Authorized"}), 200)
-    response_401 = make_response(jsonify({"message": "ERROR: Unauthorized"}), 401)
-    response_403 = make_response(jsonify({"message": "ERROR: Forbidden"}), 403)
-    response_500 = make_response(jsonify({"message": "ERROR: Internal Server Error"}), 500)
-
-    # Note: 400 and 404 are not supported http://nginx.org/en/docs/http/ngx_http_auth_request_module.html
-    # Any response code other than 200/401/403 returned by the subrequest is considered an error 500
-    # The end user or client will never see 404 but 500
-    response_400 = make_response(jsonify({"message": "ERROR: Bad Request"}), 400)
-    response_404 = make_response(jsonify({"message": "ERROR: Not Found"}), 404)
-
-    method = None
-    orig_uri = None
+    log_sampled_request('file_auth', request.headers)
 
-    # URI = scheme:[//authority]path[?query][#fragment] where authority = [userinfo@]host[:port]
-    # This "Host" header is nginx `$http_host` which contains port number,
-    # unlike `$host` which doesn't include port number
+    parsed_request = parse_file_auth_request(request.headers)
+
+    # Not a valid http request, wrong http method, or missing dataset UUID in path
+    if parsed_request is None:
+        return auth_response(401, auth_decision_ttl_protected)
+
+    uuid, token_from_query = parsed_request
+
+    # Check if the globus token is valid for accessing this secured file
+    code = get_file_access(uuid, token_from_query, request)
+
+    logger.debug("======get_file_access() resulting code======")
+    logger.debug(code)
+
+    # Returned 400 and 404 will be considered as 500 by nginx auth_request module
+    if code == 404:
+        logger.warning("The end user or client will never see 404 but 500")
+
+    if code in AUTH_RESPONSE_BODIES:
+        return auth_response(code, file_access_ttl(uuid, code))
+
+    return auth_response(401)
+
+
+# Return the (uuid, token_from_query) of the original file request described by the headers
+# None if not a valid http request, wrong http method, or missing dataset UUID in path
+def parse_file_auth_request(headers):
     # Here we don't parse the "X-Forwarded-Proto" header because the scheme is either HTTP or HTTPS
-    if ("X-Original-Request-Method" in request.headers) and ("X-Original-URI" in request.headers):
-        method = request.headers.get("X-Original-Request-Method")
-        orig_uri = request.headers.get("X-Original-URI")
-
-    # File access only via http GET
-    if method is not None:
-        # Supports both GET and HEAD request methods
-        if method.upper() in ['GET', 'HEAD']:
-            if orig_uri is not None:
-                parsed_uri = urlparse(orig_uri)
-
-                logger.debug("======parsed_uri======")
-                logger.debug(parsed_uri)
-
-                # Remove the leading slash before split
-                path_list = parsed_uri.path.strip("/").split("/")
-
-                # This parsed uuid could either be the entity uuid or a file uuid
-                uuid = path_list[0]
-
-                # Also get the "token" parameter from query string
-                # query is a dict, keys are the unique query variable names
-                # and the values are lists of values for each name
-                token_from_query = None
-                query = parse_qs(parsed_uri.query)
-
-                if 'token' in query:
-                    token_from_query = query['token'][0]
-
-                logger.debug("======token_from_query======")
-                logger.debug(token_from_query)
-
-                # Check if the globus token is valid for accessing this secured file
-                code = get_file_access(uuid, token_from_query, request)
-
-                logger.debug("======get_file_access() resulting code======")
-                logger.debug(code)
-
-                if code == 200:
-                    return response_200
-                # Returned 400 will be considered as 500 by nginx auth_request module
-                elif code == 400:
-                    return response_400
-                elif code == 401:
-                    return response_401
-                elif code == 403:
-                    return response_403
-                # Returned 404 will be considered as 500 by nginx auth_request module
-                elif code == 404:
-                    logger.warning("The end user or client will never see 404 but 500")
-                    return response_404
-                elif code == 500:
-                    return response_500
+    if not (("X-Original-Request-Method" in headers) and ("X-Original-URI" in headers)):
+        return None
+
+    method = headers.get("X-Original-Request-Method")
+    orig_uri = headers.get("X-Original-URI")
+
+    # File access only via http GET, supports both GET and HEAD request methods
+    if method is None or method.upper() not in ['GET', 'HEAD'] or orig_uri is None:
+        return None
+
+    parsed_uri = urlparse(orig_uri)
+
+    logger.debug("======parsed_uri======")
+    logger.debug(parsed_uri)
+
+    # Remove the leading slash before split
+    path_list = parsed_uri.path.strip("/").split("/")
+
+    # This parsed uuid could either be the entity uuid or a file uuid
+    uuid = path_list[0]
+
+    # Also get the "token" parameter from query string
+    # query is a dict, keys are the unique query variable names
+    # and the values are lists of values for each name
+    token_from_query = None
+    query = parse_qs(parsed_uri.query)
+
+    if 'token' in query:
+        token_from_query = query['token'][0]
+
+    logger.debug("======token_from_query======")
+    logger.debug(token_from_query)
+
+    return uuid, token_from_query
+
+
+# Batch access check of many files or entities with one token
+# Request body: {"items": ["<uuid>" or "<uuid>/<relative-file-path>", ...], "token": "<globus-token>"}
+# The token is optional, and the 'Authorization' header is used when it's not in the body
+# Response body: {"<item>": <code>, ...} with the same codes as file_auth for each item
+# The token is resolved once, each distinct uuid is decided once, and the uncached decisions
+# are resolved concurrently, the lookups of a parent entity shared by many files are coalesced
+# into a single uuid-api/entity-api request by the gateway cache
+@app.route('/file_auth/batch', methods = ['POST'])
+@metered('file_auth_batch')
+@guarded('file_auth_batch')
+def file_auth_batch():
+    body = request.get_json(silent=True)
+
+    if not isinstance(body, dict) or not isinstance(body.get('items'), list) or not all(isinstance(item, str) for item in body['items']):
+        return jsonify({"message": "ERROR: The request body must be a json object with a list of uuids or asset paths as 'items'"}), 400
+
+    items = body['items']
+    max_items = app.config.get('FILE_AUTH_BATCH_MAX_ITEMS', 1000)
+
+    if len(items) > max_items:
+        return jsonify({"message": f"ERROR: At most {max_items} items are allowed per batch"}), 400
+
+    token_from_body = body.get('token') if isinstance(body.get('token'), str) else None
+
+    # The uuid is the first path segment, same as the X-Original-URI of file_auth
+    item_uuids = {item: item.strip("/").split("/")[0] for item in items}
+    uuids = set(item_uuids.values())
+
+    decisions = {}
+    if 'status' in uuids:
+        decisions['status'] = 200
+        uuids.discard('status')
+
+    for uuid in [uuid for uuid in uuids if is_unknown_uuid(uuid)]:
+        decisions[uuid] = 404
+        uuids.discard(uuid)
+
+    if uuids:
+        with deadline_budget(auth_request_deadline):
+            try:
+                access_tier = get_caller_access_tier(token_from_body, request)
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Unable to validate the token: {e}")
+                access_tier = None
+
+            if access_tier is None:
+                decisions.update((uuid, 500) for uuid in uuids)
             else:
-                # Missing dataset UUID in path
-                return response_401
-        else:
-            # Wrong http method
-            return response_401
-    # Not a valid http request
-    return response_401
+                # Each decision runs in a copy of this context to share the deadline of the batch
+                contexts = [contextvars.copy_context() for _ in uuids]
+                codes = batch_executor.map(lambda uuid, context: context.run(get_file_access_decision, uuid, access_tier), uuids, contexts)
+
+                for uuid, code in zip(uuids, codes):
+                    decisions[uuid] = code
+
+    return jsonify({item: decisions[uuid] for item, uuid in item_uuids.items()})
 
 
 @app.route('/umls_auth', methods = ['GET'])
+@metered('umls_auth')
+@guarded('umls_auth')
 def umls_auth():
-    logger.info("======umls_auth Original request.headers======")
-    logger.info(request.headers)
+    log_sampled_request('umls_auth', request.headers)
 
-    # Nginx auth_request only cares about the response status code
-    # it ignores the response body
-    # We use body here only for description purposes and direct visit to this endpoint
-    response_200 = make_response(jsonify({"message": "OK: Authorized"}), 200)
-    response_401 = make_response(jsonify({"message": "ERROR: Unauthorized"}), 401)
-    response_403 = make_response(jsonify({"message": "ERROR: Forbidden"}), 403)
-    response_500 = make_response(jsonify({"message": "ERROR: Internal Server Error"}), 500)
+    umls_key = parse_umls_key(request.headers)
 
-    orig_uri = None
+    if umls_key is None:
+        return auth_response(401)
 
-    if "X-Original-URI" in request.headers:
-        orig_uri = request.headers.get("X-Original-URI")
+    return auth_response(umls_auth_code(validate_umls_key(umls_key)))
 
 
-    parsed_uri = urlparse(orig_uri)
+# The umls-key query string value of the original request described by the headers, None if missing
+def parse_umls_key(headers):
+    parsed_uri = urlparse(headers.get("X-Original-URI"))
 
     logger.debug("======parsed_uri======")
     logger.debug(parsed_uri)
@@ -317,25 +803,98 @@ def umls_auth():
     query = parse_qs(parsed_uri.query)
 
     if 'umls-key' not in query:
-        return response_401
-    is_authorized = validate_umls_key(query['umls-key'][0])
-    if not is_authorized:
-        return response_403
-    return response_200
+        return None
+    return query['umls-key'][0]
 
 
 ####################################################################################################
 ## Internal Functions Used By API Auth and File Auth
 ####################################################################################################
 
-@cached(cache)
-def load_file(file):
-    with open(file, "r") as f:
-        data = json.load(f)
-        return data
+# Upstream results already fetched for the current request by the async serving mode (asgi.py)
+# When set, the decision logic takes the upstream results from it instead of making blocking requests
+prefetched_upstream_results = contextvars.ContextVar('prefetched_upstream_results', default=None)
+
+# Raised by get_upstream_result() and request_upstream_results() when the async serving mode
+# has yet to fetch the URLs, the async caller fetches them at the same time without blocking
+# and runs the decision logic again
+class UpstreamResultNeeded(Exception):
+    def __init__(self, *urls):
+        super().__init__(*urls)
+        self.urls = urls
+
+# The UpstreamResult of the given uuid-api/entity-api URL used by the decision logic
+# Either from make_api_request_get(), or from the results prefetched by the async serving mode
+# where a prefetched exception (e.g., connection error) gets raised as if the request was just made
+def get_upstream_result(target_url):
+    prefetched = prefetched_upstream_results.get()
+
+    # Waited on until the deadline of the request at most
+    if prefetched is None:
+        return result_within_budget(request_upstream_results([target_url])[target_url])
+
+    if target_url not in prefetched:
+        raise UpstreamResultNeeded(target_url)
+
+    result = prefetched[target_url]
+    if isinstance(result, Exception):
+        raise result
+
+    return result
+
+# Request the given uuid-api/entity-api URLs at the same time, return {url: Future of its UpstreamResult}
+# The futures of the cached URLs are already done, the others run on the upstream_lookup_executor
+# with the deadline of the current request
+# In the async serving mode, all of them are fetched together before the decision logic runs again
+def request_upstream_results(target_urls):
+    prefetched = prefetched_upstream_results.get()
+
+    if prefetched is not None:
+        missing_urls = [target_url for target_url in target_urls if target_url not in prefetched]
+        if missing_urls:
+            raise UpstreamResultNeeded(*missing_urls)
+
+    futures = {}
+    for target_url in target_urls:
+        if prefetched is not None:
+            futures[target_url] = completed_future(prefetched[target_url])
+            continue
+
+        entry = make_api_request_get.cache_entry(target_url)
+
+        if entry is not None and time.time() < entry.expires_at:
+            record_cache_lookup('gateway', True)
+            futures[target_url] = completed_future(entry.value)
+        else:
+            futures[target_url] = upstream_lookup_executor.submit(contextvars.copy_context().run, make_api_request_get, target_url)
+
+    return futures
+
+def completed_future(result):
+    future = Future()
+    if isinstance(result, Exception):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+    return future
+
+# Expiry of the cached uuid-api/entity-api lookup based on its outcome: (ttl, stale_ttl) in seconds
+# Only the successful lookups can be served stale while being refreshed,
+# a not found entity or an upstream error must not outlive its own short TTL
+def upstream_cache_expiry(result):
+    if result.status_code == 200:
+        return cache_ttl_positive, cache_stale_ttl
+    if result.status_code == 404:
+        return cache_ttl_negative, 0
+    return cache_ttl_error, 0
 
 # Cache the request response for the given URL with using function cache (memoization)
-@cached(cache)
+# Only a compact UpstreamResult with the status code and the parsed fields used by the gateway
+# is returned and cached, not the whole requests.Response
+# Concurrent cache misses of the same URL within the worker process result in a single upstream request,
+# the other threads wait and share its result or exception
+# The TTL depends on the outcome, an expired successful lookup is served stale while it's refreshed in the background
+@cached_single_flight(cache, lock=cache_lock, expiry=upstream_cache_expiry, name='gateway')
 def make_api_request_get(target_url):
     now = time.ctime(int(time.time()))
 
@@ -346,9 +905,10 @@ def make_api_request_get(target_url):
     request_headers = create_request_headers_for_auth(auth_helper_instance.getProcessSecret())
 
     # Disable ssl certificate verification
-    response = requests.get(url = target_url, headers = request_headers, verify = False)
+    # Use the pooled keep-alive connection with the timeouts and retries of the upstream policy
+    response = upstream_client.get(url = target_url, headers = request_headers, verify = False)
 
-    return response
+    return compact_response(response)
 
 # Call the given target status URL, bypassing any cached data.
 # Form a dictionary describing what can be determined from calling the target status
@@ -356,7 +916,8 @@ def _get_status_info(target_url:str, connection_timeout_in_secs:int=3, read_time
     try:
         # Disable ssl certificate verification,
         # set connection timeout = 3s, read timeout = 5s
-        api_response = requests.get(url=target_url
+        # Use the pooled keep-alive connection of the target host
+        api_response = upstream_client.get(url=target_url
                                     , verify=False
                                     , timeout=( connection_timeout_in_secs
                                                 , read_timeout_in_secs))
@@ -393,7 +954,31 @@ def _get_status_info(target_url:str, connection_timeout_in_secs:int=3, read_time
         return {'error': str(re)}
     # "Never" reach here :)
 
+# Call _get_status_info() and add the time of the check and the latency in milliseconds
+def _get_timed_status_info(target_url:str)->dict:
+    checked_at = time.time()
+    status_info = _get_status_info(target_url=target_url)
+    latency_ms = round((time.time() - checked_at) * 1000, 1)
+
+    # Leave the unexpected JSON list or string returned by a service as is
+    if isinstance(status_info, dict):
+        status_info['checked_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(checked_at))
+        status_info['latency_ms'] = latency_ms
+
+    return status_info
+
+# Gateway version and build are parsed from VERSION and BUILD files directly
+# instead of making API calls. Both files don't change without a restart
+@cached(local_cache, lock=cache_lock)
+def get_gateway_version_build():
+    # Use strip() to remove leading and trailing spaces, newlines, and tabs
+    version = (Path(__file__).absolute().parent.parent / 'VERSION').read_text().strip()
+    build = (Path(__file__).absolute().parent.parent / 'BUILD').read_text().strip()
+    return version, build
+
 # Dict of API status data
+# All the services are checked at the same time, the services without a result
+# within STATUS_DEADLINE seconds are reported with an error
 def get_status_data():
     # Some constants
     GATEWAY = 'gateway'
@@ -412,59 +997,48 @@ def get_status_data():
     SCFIND_API = 'scfind_api'
     SCFIND_STATUS = 'scfind_status'
 
-    # Gateway version and build are parsed from VERSION and BUILD files directly
-    # instead of making API calls. So they alwasy present
-    status_data = {
-        GATEWAY: {
-            # Use strip() to remove leading and trailing spaces, newlines, and tabs
-            VERSION: (Path(__file__).absolute().parent.parent / 'VERSION').read_text().strip(),
-            BUILD: (Path(__file__).absolute().parent.parent / 'BUILD').read_text().strip()
-        },
-        UUID_API: {},
-        ENTITY_API: {},
-        INGEST_API: {},
-        SEARCH_API: {},
-        FILE_ASSETS: {},
-        CELLS_API: {},
-        WORKSPACES_API: {},
-        ONTOLOGY_API: {},
-        UKV_API: {},
-        DATA_PRODUCTS_API: {},
-        SCFIND_API: {}
+    # The status URL config key of each service
+    # N. B. CELLS_API_STATUS_URL does not return 'application/json' in api_response.headers.get('Content-Type')
+    #       but rather text/html.  However, the text body is JSON.
+    # File assets, no need to send headers
+    status_urls = {
+        UUID_API: app.config["UUID_API_STATUS_URL"],
+        ENTITY_API: app.config["ENTITY_API_STATUS_URL"],
+        INGEST_API: app.config["INGEST_API_STATUS_URL"],
+        SEARCH_API: app.config["SEARCH_API_STATUS_URL"],
+        FILE_ASSETS: app.config["FILE_ASSETS_STATUS_URL"],
+        CELLS_API: app.config["CELLS_API_STATUS_URL"],
+        WORKSPACES_API: app.config["WORKSPACES_API_STATUS_URL"],
+        ONTOLOGY_API: app.config["ONTOLOGY_API_STATUS_URL"],
+        UKV_API: app.config["UKV_API_STATUS_URL"],
+        DATA_PRODUCTS_API: app.config["DATA_PRODUCTS_API_STATUS_URL"],
+        SCFIND_API: app.config["SCFIND_API_STATUS_URL"]
     }
 
-    # uuid-api
-    status_data[UUID_API] = _get_status_info(target_url=app.config["UUID_API_STATUS_URL"])
-
-    # entity-api
-    status_data[ENTITY_API] = _get_status_info(target_url=app.config["ENTITY_API_STATUS_URL"])
-
-    # ingest-api
-    status_data[INGEST_API] = _get_status_info(target_url=app.config["INGEST_API_STATUS_URL"])
-
-    # search-api
-    status_data[SEARCH_API] = _get_status_info(target_url=app.config["SEARCH_API_STATUS_URL"])
+    version, build = get_gateway_version_build()
 
-    # file assets, no need to send headers
-    status_data[FILE_ASSETS] = _get_status_info(target_url=app.config["FILE_ASSETS_STATUS_URL"])
-
-    # cells api
-    # N. B. CELLS_API_STATUS_URL does not return 'application/json' in api_response.headers.get('Content-Type')
-    #       but rather text/html.  However, the text body is JSON.
-    status_data[CELLS_API] = _get_status_info(target_url=app.config["CELLS_API_STATUS_URL"])
-    # cells_api_response = status_request(app.config['CELLS_API_STATUS_URL'])
+    # Gateway version and build always present
+    status_data = {
+        GATEWAY: {
+            VERSION: version,
+            BUILD: build
+        }
+    }
 
-    # workspaces REST api
-    status_data[WORKSPACES_API] = _get_status_info(target_url=app.config["WORKSPACES_API_STATUS_URL"])
+    deadline = app.config.get('STATUS_DEADLINE', 8)
 
-    # ontology API
-    status_data[ONTOLOGY_API] = _get_status_info(target_url=app.config["ONTOLOGY_API_STATUS_URL"])
+    # Don't wait for the checks still running after the deadline, and drop the ones still queued
+    futures = {service: status_executor.submit(_get_timed_status_info, url) for service, url in status_urls.items()}
+    wait(futures.values(), timeout=deadline)
 
-    # ukv API
-    status_data[UKV_API] = _get_status_info(target_url=app.config["UKV_API_STATUS_URL"])
+    for future in futures.values():
+        future.cancel()
 
-    # data products API
-    status_data[DATA_PRODUCTS_API] = _get_status_info(target_url=app.config["DATA_PRODUCTS_API_STATUS_URL"])
+    for service, future in futures.items():
+        if future.done() and not future.cancelled() and future.exception() is None:
+            status_data[service] = future.result()
+        else:
+            status_data[service] = {'error': f"No status within the deadline of {deadline} seconds"}
 
     # N. B. SCFIND_API_STATUS_URL does not return 'application/json' in api_response.headers.get('Content-Type')
     #       but rather text/html.  The text body is not JSON, but just the string 'ok'. The dict returned by
@@ -473,25 +1047,24 @@ def get_status_data():
     #       "scfind_api": {
     #           "scfind_status": true
     #       },
-    scfind_status_info = _get_status_info(target_url=app.config["SCFIND_API_STATUS_URL"])
-    status_data[SCFIND_API][SCFIND_STATUS] = 'text' in scfind_status_info and scfind_status_info['text'] in ("ok")
+    scfind_status_info = status_data[SCFIND_API]
+    status_data[SCFIND_API] = {
+        SCFIND_STATUS: 'text' in scfind_status_info and scfind_status_info['text'] in ("ok")
+    }
+
+    for key in ('checked_at', 'latency_ms'):
+        if isinstance(scfind_status_info, dict) and key in scfind_status_info:
+            status_data[SCFIND_API][key] = scfind_status_info[key]
+
     # Final result
     return status_data
 
 
-# Get user information dict based on the http request(headers)
-# `group_required` is a boolean, when True, 'hmgroupids' is in the output
+# Get user information based on the http request(headers) via the token cache
+# `group_required` is a boolean, when True, `group_ids` is set in the output
+# Returns None if invalid header or token
 def get_user_info_for_access_check(request, group_required):
-    return auth_helper_instance.getUserInfoUsingRequest(request, group_required)
-
-
-# Due to Flask's EnvironHeaders is immutable
-# We create a new class with the headers property 
-# so AuthHelper can access it using the dot notation req.headers
-class CustomRequest:
-    # Constructor
-    def __init__(self, headers):
-        self.headers = headers
+    return token_cache.get_user_info(request, group_required)
 
 
 # Create a dict with HTTP Authorization header with Bearer token
@@ -512,7 +1085,148 @@ def create_request_headers_for_auth(token):
 # The uuid passed in could either be a real entity (Donor/Sample/Dataset/Publication) uuid or
 # a file uuid (Dataset: thumbnail image or Donor/Sample: metadata/image file)
 # AVR file uuid is handled via uuid-api only and no token is required
+# The decision only depends on the uuid and the caller access tier, so it's cached per (uuid, access tier)
+# and the repeated requests of the same file (range requests, parallel chunk downloads) need no upstream call
 def get_file_access(uuid, token_from_query, request):
+    # Special case used by file assets status only
+    if uuid == 'status':
+        return 200
+
+    # Reject the malformed and unknown uuids before validating the token
+    if is_unknown_uuid(uuid):
+        return 404
+
+    # The token validation and the chained uuid-api/entity-api lookups share the deadline of the request
+    with deadline_budget(auth_request_deadline):
+        try:
+            access_tier = get_caller_access_tier(token_from_query, request)
+        except requests.exceptions.RequestException as e:
+            # Globus unavailable (circuit breaker open) or too slow
+            logger.error(f"Unable to validate the token: {e}")
+            return 500
+
+        return get_file_access_decision(uuid, access_tier)
+
+
+# How long nginx may cache the file access code of the uuid, see auth_decision_ttl_public
+# The data anyone can access (public data, thumbnails of published datasets, AVR files) is the one allowed without token,
+# told by the decision of the anonymous callers cached along with the decision just made (see cache_anonymous_decision()),
+# without deciding anything again. When that one is already gone, the decision is taken as depending on the token
+# The assets status check is never cached so a gateway failure shows up right away
+def file_access_ttl(uuid, code):
+    if uuid == 'status' or code not in AUTH_DECISION_CODES:
+        return 0
+
+    if code == 200:
+        with cache_lock:
+            public = file_access_decision_cache.get((uuid, ACCESS_TIER_ANONYMOUS)) == 200
+
+        if public:
+            return auth_decision_ttl_public
+
+    return auth_decision_ttl_protected
+
+
+# Cache the file access code of the anonymous callers, known as soon as the data access level of the entity is,
+# whatever the access tier of the caller the decision is made for
+def cache_anonymous_decision(uuid, public):
+    with cache_lock:
+        file_access_decision_cache[(uuid, ACCESS_TIER_ANONYMOUS)] = 200 if public else 401
+
+
+# Whether the uuid is malformed or known to be unknown to uuid-api, checked without any I/O
+def is_unknown_uuid(uuid):
+    if not is_valid_uuid(uuid):
+        logger.debug(f"Invalid uuid format: {uuid}")
+        return True
+
+    if unknown_uuid_filter is None:
+        return False
+
+    unknown = uuid in unknown_uuid_filter
+    record_cache_lookup('unknown_uuid', unknown)
+
+    return unknown
+
+
+# The cached file access code of the uuid for the given caller access tier
+def get_file_access_decision(uuid, access_tier):
+    decision_key = (uuid, access_tier)
+
+    with cache_lock:
+        code = file_access_decision_cache.get(decision_key)
+
+    record_cache_lookup('file_access_decision', code is not None)
+
+    if code is None:
+        code = decide_file_access(uuid, access_tier)
+
+        # Only cache the decisions based on the entity data, not the errors
+        if code in FILE_ACCESS_CACHEABLE_CODES:
+            with cache_lock:
+                file_access_decision_cache[decision_key] = code
+
+    return code
+
+
+# Access tier of the file_auth caller based on token (optional) from HTTP header or query string:
+# ACCESS_TIER_ANONYMOUS without token, ACCESS_TIER_INVALID_TOKEN for an invalid/expired token,
+# otherwise the user's highest data access level (public, consortium, or protected)
+def get_caller_access_tier(token_from_query, request):
+    # request.headers may or may not contain the 'Authorization' header
+    final_request = request
+
+    # The globus token can be specified in the 'Authorization' header OR through a "token" query string in the URL
+    # Use the globus token from URL query string if present and set as the value of 'Authorization' header
+    # If not found, default to the 'Authorization' header
+    # Because auth_helper_instance.getUserDataAccessLevel() checks against the 'Authorization' header
+    if token_from_query is not None:
+        # NOTE: request.headers is type 'EnvironHeaders', 
+        # and it's immutable(read only version of the headers from a WSGI environment)
+        # So we can't modify the request.headers
+        # Instead, we use a custom request object and set as the 'Authorization' header 
+        logger.debug("======set Authorization header with query string token value======")
+
+        custom_headers_dict = create_request_headers_for_auth(token_from_query)
+
+        # Overwrite the default final_request
+        # CustomRequest and Flask's request are different types,
+        # but the Commons's AuthHelper only access the request.headers
+        # So as long as headers from CustomRequest instance can be accessed with the dot notation
+        final_request = CustomRequest(custom_headers_dict)
+
+    # When Authorization is not present, the access is based on the data_access_level of the given dataset only
+    # In this case we can't call auth_helper_instance.getUserDataAccessLevel() because it returns HTTPException
+    # when Authorization header is missing
+    if 'Authorization' not in final_request.headers:
+        return ACCESS_TIER_ANONYMOUS
+
+    # By now the Authorization is present and it's either provided directly from the request headers or
+    # query string (overwriting)
+    # Then we can call auth_helper_instance.getUserDataAccessLevel() to find out the user's assigned access level
+    try:
+        # The user_info contains HIGHEST access level of the user based on the token
+        # This call raises an HTTPException with a 401 if any auth issues are found
+        # The result is cached by the hash of the token
+        user_access_level = token_cache.get_user_data_access_level(final_request)
+
+        logger.debug("======user_access_level======")
+        logger.debug(user_access_level)
+    # If returns HTTPException with a 401, invalid header format or expired/invalid token
+    except HTTPException as e:
+        msg = "HTTPException from calling auth_helper_instance.getUserDataAccessLevel() HTTP code: " + str(e.get_status_code()) + " " + e.get_description() 
+
+        logger.warning(msg)
+
+        return ACCESS_TIER_INVALID_TOKEN
+
+    # Based on the logic of auth_helper_instance.getUserDataAccessLevel(), its value is always one of
+    # the ACCESS_LEVEL_PUBLIC, ACCESS_LEVEL_CONSORTIUM, or ACCESS_LEVEL_PROTECTED
+    return user_access_level.lower()
+
+
+# Determine the file access code of the uuid for the given caller access tier
+def decide_file_access(uuid, access_tier):
     # AVR and AVR files are standalone, not stored in neo4j and won't be available via entity-api
     supported_entity_types = ['Donor', 'Sample', 'Dataset', 'Publication']
 
@@ -530,28 +1244,38 @@ def get_file_access(uuid, token_from_query, request):
     ACCESS_LEVEL_PROTECTED = 'protected'
     DATASET_STATUS_PUBLISHED = 'published'
 
-    # Special case used by file assets status only
-    if uuid == 'status':
-        return allowed
-
-    # request.headers may or may not contain the 'Authorization' header
-    final_request = request
-
     # We'll get the parent entity uuid if the given uuid is indeed a file uuid
     # If the given uuid is actually an entity uuid, just return it
+    # Then resolve the entity via uuid-api and entity-api at the same time, unless already in the entity index
     try:
-        entity_uuid, entity_is_avr, given_uuid_is_file_uuid = get_entity_uuid_by_file_uuid(uuid)
+        entity_uuid, given_uuid_is_file_uuid = get_entity_uuid_by_file_uuid(uuid)
 
-        logger.debug(f"The given uuid {uuid} is a file uuid: {given_uuid_is_file_uuid}")
+        logger.debug("The given uuid %s is a file uuid: %s", uuid, given_uuid_is_file_uuid)
 
         if given_uuid_is_file_uuid:
-            logger.debug(f"The parent entity_uuid: {entity_uuid}")
-            logger.debug(f"The entity is AVR: {entity_is_avr}")
+            logger.debug("The parent entity_uuid: %s", entity_uuid)
+
+        entity_api_status_code, entity = resolve_entity(entity_uuid)
+    except UnknownUuid:
+        # Remember it so the next requests of this uuid don't reach uuid-api
+        if unknown_uuid_filter is not None:
+            unknown_uuid_filter.add(uuid)
+        return not_found
+    except (CircuitOpen, DeadlineExceeded) as e:
+        # Failing fast, no stack trace to log
+        logger.warning(f"Failed to resolve the entity of uuid {uuid}: {e}")
+        return internal_error
     except requests.exceptions.RequestException:
+        # Connection error or timeout talking to uuid-api or entity-api, or unexpected uuid-api response
         # We'll just handle 400 and all other cases all together here as 500
         # because nginx auth_request only handles 200/401/403/500
+        logger.exception(f"Failed to resolve the entity of uuid {uuid}")
         return internal_error
 
+    entity_is_avr = entity is not None and entity.is_avr
+
+    logger.debug("The entity is AVR: %s", entity_is_avr)
+
     # By now, the given uuid is either a real entity uuid
     # or we found the associated parent entity uuid of the given file uuid
     # If the given uuid is an AVR entity uuid (should not happen in normal situation), 
@@ -560,28 +1284,21 @@ def get_file_access(uuid, token_from_query, request):
     # If an AVR file uuid, we'll allow the access too and send back the file content
     # No token ever required regardless the given uuid is an AVR entity uuid or AVR file uuid
     if entity_is_avr:
+        cache_anonymous_decision(uuid, True)
         return allowed
 
     # For non-AVR entities:
-    # Next to determine the data access level of the given uuid by 
-    # making a call to entity-api to retrieve the entity first
-    entity_api_full_url = app.config['ENTITY_API_URL'] + '/entities/' + entity_uuid
-
-    # Function cache to improve performance
+    # The data access level of the given uuid is determined by the entity retrieved from entity-api
     # Possible response status codes: 200, 401, and 500 to be handled below
-    response = make_api_request_get(entity_api_full_url)
-
     # Using the globus app secret as internal token should always return 200 supposedly
     # If not, either technical issue 500 or something wrong with this internal token 401
-    if response.status_code == 200:
-        entity_dict = response.json()
-
+    if entity_api_status_code == 200:
         # Won't happen in normal situations, but nice to check
-        if 'entity_type' not in entity_dict:
+        if entity is None or entity.entity_type is None:
             logger.error(f"Missing 'entity_type' from returned result of entity uuid {entity_uuid}")
             return internal_error
 
-        entity_type = entity_dict['entity_type']
+        entity_type = entity.entity_type
 
         # The assets service only supports:
         # - Data files contained within a Dataset
@@ -594,14 +1311,14 @@ def get_file_access(uuid, token_from_query, request):
             return bad_request
 
         # Won't happen in normal situations, but nice to check
-        if 'data_access_level' not in entity_dict:
+        if entity.data_access_level is None:
             logger.error(f"Missing 'data_access_level' from returned result of entity uuid {entity_uuid}")
             return internal_error
 
         # Default
-        data_access_level = entity_dict['data_access_level']
+        data_access_level = entity.data_access_level
 
-        logger.debug(f"======data_access_level returned by entity-api for {entity_type} uuid {entity_uuid}======")
+        logger.debug("======data_access_level returned by entity-api for %s uuid %s======", entity_type, entity_uuid)
         logger.debug(data_access_level)
 
         # Donor and Sample `data_access_level` value can only be either "public" or "consortium"
@@ -610,11 +1327,11 @@ def get_file_access(uuid, token_from_query, request):
         # But the data files contained within the dataset is determined by `data_access_level`
         # A dataset with `status` "Published" (thumbnail file is public accessible) can have 
         # "protected" `data_access_level` (data files within the dataset are protected)
-        if (entity_type in ['Dataset', 'Publication']) and given_uuid_is_file_uuid and (entity_dict['status'].lower() == DATASET_STATUS_PUBLISHED):
+        if (entity_type in ['Dataset', 'Publication']) and given_uuid_is_file_uuid and ((entity.status or '').lower() == DATASET_STATUS_PUBLISHED):
             # Overwrite the default value
             data_access_level = ACCESS_LEVEL_PUBLIC
 
-            logger.debug(f"======determined data_access_level for dataset attached thumbnail file uuid {uuid}======")
+            logger.debug("======determined data_access_level for dataset attached thumbnail file uuid %s======", uuid)
             logger.debug(data_access_level)
 
         # Throw error 500 if invalid access level value assigned to the dataset
@@ -622,34 +1339,10 @@ def get_file_access(uuid, token_from_query, request):
             logger.error("The 'data_access_level' value of this dataset " + entity_uuid + " is invalid")
             return internal_error
 
-        # Get the user access level based on token (optional) from HTTP header or query string
-        # The globus token can be specified in the 'Authorization' header OR through a "token" query string in the URL
-        # Use the globus token from URL query string if present and set as the value of 'Authorization' header
-        # If not found, default to the 'Authorization' header
-        # Because auth_helper_instance.getUserDataAccessLevel() checks against the 'Authorization' header
-        if token_from_query is not None:
-            # NOTE: request.headers is type 'EnvironHeaders', 
-            # and it's immutable(read only version of the headers from a WSGI environment)
-            # So we can't modify the request.headers
-            # Instead, we use a custom request object and set as the 'Authorization' header 
-            logger.debug("======set Authorization header with query string token value======")
-
-            custom_headers_dict = create_request_headers_for_auth(token_from_query)
-
-            # Overwrite the default final_request
-            # CustomRequest and Flask's request are different types,
-            # but the Commons's AuthHelper only access the request.headers
-            # So as long as headers from CustomRequest instance can be accessed with the dot notation
-            final_request = CustomRequest(custom_headers_dict)
-
-        # By now, request.headers may or may not contain the 'Authorization' header
-        logger.debug("======file_auth final_request.headers======")
-        logger.debug(final_request.headers)
-
-        # When Authorization is not present, return value is based on the data_access_level of the given dataset
-        # In this case we can't call auth_helper_instance.getUserDataAccessLevel() because it returns HTTPException
-        # when Authorization header is missing
-        if 'Authorization' not in final_request.headers:
+        cache_anonymous_decision(uuid, data_access_level == ACCESS_LEVEL_PUBLIC)
+
+        # The caller without token can only access the public data
+        if access_tier == ACCESS_TIER_ANONYMOUS:
             # Return 401 if the data access level is consortium or protected since
             # they require token but Authorization header missing
             if data_access_level != ACCESS_LEVEL_PUBLIC:
@@ -657,32 +1350,14 @@ def get_file_access(uuid, token_from_query, request):
             # Only return 200 since public dataset doesn't require token
             return allowed
 
-        # By now the Authorization is present and it's either provided directly from the request headers or
-        # query string (overwriting)
-        # Then we can call auth_helper_instance.getUserDataAccessLevel() to find out the user's assigned access level
-        try:
-            # The user_info contains HIGHEST access level of the user based on the token
-            # Default to ACCESS_LEVEL_PUBLIC if none of the Authorization/Mauthorization header presents
-            # This call raises an HTTPException with a 401 if any auth issues are found
-            user_info = auth_helper_instance.getUserDataAccessLevel(final_request)
-
-            logger.info("======user_info======")
-            logger.info(user_info)
-        # If returns HTTPException with a 401, invalid header format or expired/invalid token
-        except HTTPException as e:
-            msg = "HTTPException from calling auth_helper_instance.getUserDataAccessLevel() HTTP code: " + str(e.get_status_code()) + " " + e.get_description() 
-
-            logger.warning(msg)
-
-            # In the case of requested dataset is public but provided globus token is invalid/expired,
-            # we'll return 401 so the end user knows something wrong with the token rather than allowing file access
+        # In the case of requested dataset is public but provided globus token is invalid/expired,
+        # we'll return 401 so the end user knows something wrong with the token rather than allowing file access
+        if access_tier == ACCESS_TIER_INVALID_TOKEN:
             return authentication_required
 
-        # By now the user_info is returned and based on the logic of auth_helper_instance.getUserDataAccessLevel(), 
-        # 'data_access_level' should always be found user_info and its value is always one of the 
-        # ACCESS_LEVEL_PUBLIC, ACCESS_LEVEL_CONSORTIUM, or ACCESS_LEVEL_PROTECTED
-        # So no need to check unknown value
-        user_access_level = user_info['data_access_level'].lower()
+        # Otherwise the access tier is the user_access_level, always one of the ACCESS_LEVEL_PUBLIC,
+        # ACCESS_LEVEL_CONSORTIUM, or ACCESS_LEVEL_PROTECTED
+        user_access_level = access_tier
 
         # By now we have both data_access_level and the user_access_level obtained with one of the valid values
         # Allow file access as long as data_access_level is public, no need to care about the
@@ -704,10 +1379,11 @@ def get_file_access(uuid, token_from_query, request):
         return authorization_required
     # Something wrong with fulfilling the request with secret as token
     # E.g., for some reason the gateway returns 401
-    elif response.status_code == 401:
-        logger.error(f"Couldn't authenticate the request made to {entity_api_full_url} with internal token")
-        return authorization_required
-    elif response.status_code == 404:
+    # A problem of the gateway rather than a decision on the caller, so an error never cached
+    elif entity_api_status_code == 401:
+        logger.error(f"Couldn't authenticate the request made to {entity_api_url(entity_uuid)} with internal token")
+        return internal_error
+    elif entity_api_status_code == 404:
         logger.error(f"Unable to find uuid {entity_uuid}")
         return not_found
     # All other cases with 500 response
@@ -716,15 +1392,75 @@ def get_file_access(uuid, token_from_query, request):
         return internal_error
 
 
+# Outcomes of the UMLS key validation
+UMLS_KEY_VALID = 'valid'
+UMLS_KEY_INVALID = 'invalid'
+UMLS_UNAVAILABLE = 'unavailable'
+
+# The valid and invalid keys are cached with their own TTL, the failed validations are not cached
+def umls_cache_expiry(key_status):
+    if key_status == UMLS_KEY_VALID:
+        return umls_cache_ttl, 0
+    if key_status == UMLS_KEY_INVALID:
+        return umls_cache_negative_ttl, 0
+    return 0, 0
+
+# Cache key of the UMLS key validation, the raw key is never stored
+def umls_cache_key(umls_key):
+    return hashkey('umls', hashlib.sha256(umls_key.encode('utf-8')).hexdigest())
+
+# Validate the UMLS key with the UMLS validation service, one of UMLS_KEY_VALID, UMLS_KEY_INVALID or UMLS_UNAVAILABLE
+# The request uses the pooled connection with the timeouts and retries of the 'umls' upstream policy,
+# concurrent validations of the same key result in a single request
+@cached_single_flight(cache, key=umls_cache_key, lock=cache_lock, expiry=umls_cache_expiry, name='umls')
 def validate_umls_key(umls_key):
+    try:
+        response = upstream_client.get(url=umls_validate_url(umls_key))
+    except requests.exceptions.RequestException as e:
+        # The exception message contains the URL with the keys, only log its type
+        logger.error(f"Failed to reach the UMLS validation service: {type(e).__name__}")
+        return UMLS_UNAVAILABLE
+
+    return umls_key_status(response)
+
+
+# The UMLS key validation outcome of the response of the UMLS validation service
+def umls_key_status(response):
+    if response.status_code != 200:
+        logger.error(f"Unexpected response status code {response.status_code} from the UMLS validation service")
+        return UMLS_UNAVAILABLE
+
+    try:
+        is_valid = response.json() == True
+    except ValueError:
+        logger.error("Invalid json response from the UMLS validation service")
+        return UMLS_UNAVAILABLE
+
+    return UMLS_KEY_VALID if is_valid else UMLS_KEY_INVALID
+
+
+# The umls_auth response status code of the validation outcome
+# When the UMLS validation service can't be reached, allow the download with UMLS_FAIL_OPEN = True,
+# otherwise (default) fail with 500
+def umls_auth_code(key_status):
+    if key_status == UMLS_KEY_VALID:
+        return 200
+
+    if key_status == UMLS_KEY_INVALID:
+        return 403
+
+    if app.config.get('UMLS_FAIL_OPEN', False):
+        logger.warning("The UMLS validation service is unavailable, allow the request with UMLS_FAIL_OPEN")
+        return 200
+
+    return 500
+
+
+# The UMLS validation URL of the given key
+def umls_validate_url(umls_key):
     validator_key = app.config['UMLS_KEY']
     base_url = app.config['UMLS_VALIDATE_URL']
-    url = base_url + '?validatorApiKey=' + validator_key + '&apiKey=' + umls_key
-    result = requests.get(url=url)
-    if result.json() == True:
-        return True
-    else:
-        return False
+    return base_url + '?validatorApiKey=' + validator_key + '&apiKey=' + umls_key
 
 
 # Always pass through the requests with using modified version of the globus app secret as internal token
@@ -745,8 +1481,8 @@ def is_secrect_token(request):
 # Check if access to the given endpoint item is allowed
 # Also check if the globus token associated user is a member of the specified group associated with the endpoint item
 def api_access_allowed(item, request):
-    logger.info("======Matched endpoint======")
-    logger.info(item)
+    logger.debug("======Matched endpoint======")
+    logger.debug(item)
 
     # Check if auth is required for this endpoint
     if item['auth'] == False:
@@ -762,80 +1498,91 @@ def api_access_allowed(item, request):
     # Get user info and do further parsing
     user_info = get_user_info_for_access_check(request, group_required)
     
-    logger.info("======user_info======")
-    logger.info(user_info)
+    logger.debug("======user_info======")
+    logger.debug(user_info)
 
-    # If returns error response, invalid header or token
-    if isinstance(user_info, Response):
+    # If returns None, invalid header or token
+    if user_info is None:
         return False
 
-    # Otherwise, user_info is a dict and we check if the group ID of target endpoint can be found
-    # in user_info['hmgroupids'] list
-    # Key 'hmgroupids' presents only when group_required is True
+    # Otherwise, we check if the group ID of target endpoint can be found in user_info.group_ids
+    # group_ids is set only when group_required is True
     if group_required:
-        for group in user_info['hmgroupids']:
+        for group in user_info.group_ids:
             if group in item['groups']:
                 return True
 
         # None of the assigned groups match the group ID specified in item['groups']
         return False
 
-    # When no group access required and user_info dict gets returned
+    # When no group access required and valid user_info gets returned
     return True
 
 
+# Raised when uuid-api doesn't know the uuid (404) or finds it invalid (400)
+# The uuid-api errors and the connection failures raise the base RequestException
+class UnknownUuid(requests.exceptions.RequestException):
+    pass
+
+
 # If the given uuid is a file uuid, get the parent entity uuid
 # If the given uuid itself is an entity uuid, just return it
-# The bool entity_is_avr is returned as a flag
 # The bool given_uuid_is_file_uuid is returned as a flag
+# The parent entity uuid of a file uuid is kept in the entity index
 def get_entity_uuid_by_file_uuid(uuid):
     entity_uuid = None
-    # Assume the target entity is NOT AVR record by default
-    entity_is_avr = False
     # Assume the given uuid is a file uuid by default
     # First determine if the given uuid is whether an entity uuid or a file uuid
     # All file uuids start with ffff
     # TODO: add a new endpoint in uuid-api for this file id check instead of hardcoding
     given_uuid_is_file_uuid = uuid.startswith("ffff")
 
-    # Make a call to the uuid-api's /file-id endpoint to get `ancestor_uuid`
+    # Make a call to the uuid-api's /file-id endpoint to get `ancestor_uuid`, unless already in the entity index
     if given_uuid_is_file_uuid:
-        uuid_api_file_url = f"{app.config['UUID_API_URL']}/file-id/{uuid}"
+        indexed = entity_index.get(uuid)
+
+        if indexed is not None and indexed.ancestor_uuid is not None:
+            return indexed.ancestor_uuid, True
 
         # Function cache to improve performance
-        response = make_api_request_get(uuid_api_file_url)
+        response = get_upstream_result(uuid_api_file_url(uuid))
 
         # 200: this given uuid is indeed a valid file uuid
         # 400: invalid file uuid format
         # 404: this given uuid does not exist in the files table
         if response.status_code == 200:
-            file_uuid_dict = response.json()
-
-            if 'ancestor_uuid' in file_uuid_dict:
-                logger.debug(f"======The given uuid {uuid} is a file uuid======")
+            if response.ancestor_uuid is not None:
+                logger.debug("======The given uuid %s is a file uuid======", uuid)
 
                 # For file uuid, its ancestor_uuid (the parent_id when generating this file uuid)
                 # is the actual entity uuid that can be used to get back the data_access_level
                 # Overwrite the default value
-                entity_uuid = file_uuid_dict['ancestor_uuid']
+                entity_uuid = response.ancestor_uuid
+
+                entity_index.put(uuid, file_metadata(entity_uuid))
             else:
-                logger.error(f"Missing 'ancestor_uuid' from resulting json for the given file_uuid {uuid}")
+                msg = f"Missing 'ancestor_uuid' from resulting json for the given file_uuid {uuid}"
+                logger.error(msg)
 
-                raise requests.exceptions.RequestException(response.text)
+                raise requests.exceptions.RequestException(msg)
         elif response.status_code == 404:
             # It could be a regular entity uuid but will return 404 by /file-id/<uuid>
             # We just log this and move forward
             # The call to entity-api will tell us if this dataset uuid exists and valid
-            logger.debug(f"======Unable to find the file uuid: {uuid}, consider it as an entity uuid======")
+            logger.debug("======Unable to find the file uuid: %s, consider it as an entity uuid======", uuid)
 
             # Treat the given uuid as an entity uuid
             entity_uuid = uuid
 
             # Overwrite the default value
             given_uuid_is_file_uuid = False
+        elif response.status_code == 400:
+            # uuid-api returns 400 if the given id is invalid, e.g., a random id starting with ffff
+            logger.info(f"Invalid file uuid sent to uuid-api: {uuid}")
+
+            raise UnknownUuid(response.text)
         else:
-            # uuid-api returns 400 if the given id is invalid
-            msg = f"Invalid file uuid sent to uuid-api: {uuid}"
+            msg = f"Unable to query the file uuid via uuid-api: {uuid}"
             # Log the full stack trace, prepend a line with our message
             logger.exception(msg)
 
@@ -851,24 +1598,115 @@ def get_entity_uuid_by_file_uuid(uuid):
         # Treat the given uuid as an entity uuid
         entity_uuid = uuid
 
-    # Further check the entity type registered with uuid-api to determine if it's AVR or not
-    uuid_api_entity_url = f"{app.config['UUID_API_URL']}/hmuuid/{entity_uuid}"
+    # Return the entity uuid string and if the given uuid is a file uuid or not (bool)
+    return entity_uuid, given_uuid_is_file_uuid
 
-    # Function cache to improve performance
-    response = make_api_request_get(uuid_api_entity_url)
 
-    if response.status_code == 200:
-        entity_uuid_dict = response.json()
+def entity_api_url(entity_uuid):
+    return f"{app.config['ENTITY_API_URL']}/entities/{entity_uuid}"
 
-        if 'type' in entity_uuid_dict:
-            if entity_uuid_dict['type'].upper() == 'AVR':
-                logger.debug(f"======The target entity_uuid {entity_uuid} is an AVR uuid======")
 
-                entity_is_avr = True
-        else:
-            logger.error(f"Missing 'type' from resulting json for the target entity_uuid {entity_uuid}")
+def uuid_api_entity_url(entity_uuid):
+    return f"{app.config['UUID_API_URL']}/hmuuid/{entity_uuid}"
 
-            raise requests.exceptions.RequestException(response.text)
+
+def uuid_api_file_url(file_uuid):
+    return f"{app.config['UUID_API_URL']}/file-id/{file_uuid}"
+
+
+# Resolve the entity into (entity-api status code, EntityMetadata or None)
+# An AVR entity resolves to 200 with is_avr set, the other entities need the entity-api 200 to have metadata
+# uuid-api /hmuuid (is it AVR?) and entity-api /entities (access level) are requested at the same time
+# and the first conclusive answer wins: an entity found by entity-api is not AVR since AVR are not
+# stored in neo4j, and an AVR found by uuid-api doesn't need entity-api
+# The other request completes in the background and its result gets cached by the gateway cache
+# Raise requests RequestException when uuid-api can't tell if the entity is AVR and entity-api didn't find it
+def resolve_entity(entity_uuid):
+    entity = entity_index.get(entity_uuid)
+
+    if entity is not None and entity.ancestor_uuid is None:
+        return 200, entity
+
+    entity_url = entity_api_url(entity_uuid)
+    uuid_url = uuid_api_entity_url(entity_uuid)
+    futures = request_upstream_results([entity_url, uuid_url])
+
+    for future in completed_within_budget(futures.values()):
+        if future.exception() is not None:
+            continue
+
+        response = future.result()
+
+        if future is futures[entity_url] and response.status_code == 200 and response.entity_type is not None:
+            entity = entity_metadata(response.entity_type, response.data_access_level, response.status)
+            entity_index.put(entity_uuid, entity)
+            return 200, entity
+
+        if future is futures[uuid_url] and response.status_code == 200 and (response.type or '').upper() == 'AVR':
+            logger.debug("======The target entity_uuid %s is an AVR uuid======", entity_uuid)
+
+            entity = avr_metadata()
+            entity_index.put(entity_uuid, entity)
+            return 200, entity
+
+    # Neither is conclusive, the entity must be known by uuid-api before looking at the entity-api response
+    check_uuid_api_entity(entity_uuid, futures[uuid_url].result())
+
+    return futures[entity_url].result().status_code, None
+
+
+# Resolve the uuid the same way as file_auth, filling the gateway cache and the entity index
+# (file-id -> ancestor, hmuuid type, entity access level) for the cache warm-up
+# The resolution runs with the cached upstream results only and the missing ones get fetched,
+# like the async serving mode does, to tell if anything was missing
+# Return True if any upstream request was needed, raise requests RequestException on failure
+def warm_up_file_access(uuid):
+    prefetched = {}
+    fetched = False
+
+    while True:
+        context_token = prefetched_upstream_results.set(prefetched)
+        try:
+            entity_uuid, given_uuid_is_file_uuid = get_entity_uuid_by_file_uuid(uuid)
+            entity_api_status_code, entity = resolve_entity(entity_uuid)
+            break
+        except UpstreamResultNeeded as e:
+            target_urls = e.urls
+        finally:
+            prefetched_upstream_results.reset(context_token)
+
+        for target_url in target_urls:
+            entry = make_api_request_get.cache_entry(target_url)
+
+            if entry is not None and time.time() < entry.expires_at:
+                prefetched[target_url] = entry.value
+            else:
+                fetched = True
+
+        for target_url, future in request_upstream_results([target_url for target_url in target_urls if target_url not in prefetched]).items():
+            try:
+                prefetched[target_url] = future.result()
+            except requests.exceptions.RequestException as e:
+                prefetched[target_url] = e
+
+    if entity is None:
+        raise requests.exceptions.RequestException(f"Unable to resolve the entity {entity_uuid}: {entity_api_status_code}")
+
+    return fetched
+
+
+# Raise requests RequestException if uuid-api didn't return the entity type of the given entity uuid
+def check_uuid_api_entity(entity_uuid, response):
+    if response.status_code == 200:
+        if response.type is None:
+            msg = f"Missing 'type' from resulting json for the target entity_uuid {entity_uuid}"
+            logger.error(msg)
+
+            raise requests.exceptions.RequestException(msg)
+    elif response.status_code in (400, 404):
+        logger.info(f"Unable to find the target entity uuid via uuid-api: {entity_uuid}")
+
+        raise UnknownUuid(response.text)
     else:
         msg = f"Unable to make a request to query the target entity uuid via uuid-api: {entity_uuid}"
         # Log the full stack trace, prepend a line with our message
@@ -882,9 +1720,3 @@ def get_entity_uuid_by_file_uuid(uuid):
 
         # Also bubble up the error message from uuid-api
         raise requests.exceptions.RequestException(response.text)
-
-    # Return the entity uuid string, if the entity is AVR, and 
-    # if the given uuid is a file uuid or not (bool)
-    return entity_uuid, entity_is_avr, given_uuid_is_file_uuid
-
-
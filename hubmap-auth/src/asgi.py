@@ -0,0 +1,413 @@
+# Optional asynchronous (ASGI) serving mode of the auth subrequest endpoints
+# Serves /api_auth, /file_auth, /umls_auth and /status.json with the same decision logic as app.py,
+# but the uuid-api/entity-api/UMLS requests are made with an async HTTP client, so a request waiting
+# on an upstream doesn't hold a thread and thousands of them share the event loop of each worker process
+#
+# The decision logic of app.py stays synchronous: it runs with the upstream results already fetched
+# for the request (app.prefetched_upstream_results), and when it needs more URLs it raises
+# app.UpstreamResultNeeded, the URLs get fetched together without blocking and the decision runs again
+# The Globus token validation (hubmap_commons AuthHelper) is blocking and runs in a thread pool,
+# its result is cached by the token cache
+#
+# Run with (from this directory):
+#   uvicorn asgi:application --host 127.0.0.1 --port 5001 --workers 4 --no-access-log
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import requests
+from werkzeug.datastructures import Headers
+
+import app as gateway
+from gateway_cache import compact_response
+from metrics import observe_request, observe_upstream, record_cache_lookup, requests_in_flight, UPSTREAM_ERROR
+from upstream import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# Max number of rounds of upstream fetches for the decision of one request
+# The file_auth decision needs at most two: uuid-api /file-id, then uuid-api /hmuuid and entity-api /entities together
+MAX_UPSTREAM_FETCHES = 8
+
+JSON_CONTENT_TYPE = 'application/json'
+
+# Same as the urllib3 Retry status_forcelist of upstream.UpstreamClient
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+# Fully read upstream response with the attributes of requests.Response used by compact_response()
+class BufferedResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+# Async counterpart of upstream.UpstreamClient and make_api_request_get()
+# One aiohttp.ClientSession (keep-alive connection pool) per upstream with the timeouts and retries
+# of its policy in UPSTREAM_POLICIES, the results are read from and stored to the same gateway cache
+# with the same expiry, and concurrent misses of the same URL share a single request
+# Must be used from a single event loop, the sessions are created on first use within that loop
+class AsyncUpstreams:
+    def __init__(self, upstream_client, max_connections):
+        self.upstream_client = upstream_client
+        self.max_connections = max_connections
+        self._sessions = {}
+        self._in_flight = {}
+
+    def _session(self, upstream_name):
+        session = self._sessions.get(upstream_name)
+
+        if session is None:
+            policy = self.upstream_client.policy(upstream_name)
+
+            # ssl=False disables the certificate verification like verify=False of the sync requests
+            connector = aiohttp.TCPConnector(limit=self.max_connections, ssl=False)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=policy['connect_timeout'], sock_read=policy['read_timeout'])
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._sessions[upstream_name] = session
+
+        return session
+
+    # GET with the session of the upstream, for the requests not cached by the gateway
+    # Same retries as the sync client: connection errors and 502/503/504 responses with exponential backoff,
+    # read timeouts are not retried
+    # Same circuit breaker as the sync client, shared with it within the worker process
+    # Raise requests ConnectionError (CircuitOpen included) or ReadTimeout so the callers handle the errors
+    # the same way in both modes
+    async def get(self, url, **kwargs):
+        upstream_name = self.upstream_client.upstream_name(url)
+        policy = self.upstream_client.policy(upstream_name)
+        session = self._session(upstream_name)
+        breaker = self.upstream_client.url_breaker(url)
+        breaker.acquire()
+        start = time.perf_counter()
+        status = UPSTREAM_ERROR
+        failed = True
+
+        try:
+            for attempt in range(policy['retries'] + 1):
+                if attempt:
+                    await asyncio.sleep(policy['backoff_factor'] * (2 ** (attempt - 1)))
+
+                try:
+                    async with session.get(url, **kwargs) as response:
+                        buffered = BufferedResponse(response.status, await response.read())
+                except asyncio.TimeoutError as e:
+                    raise requests.exceptions.ReadTimeout(f"Timed out on GET {url}: {e!r}")
+                except aiohttp.ClientError as e:
+                    if attempt == policy['retries']:
+                        raise requests.exceptions.ConnectionError(f"Failed to GET {url}: {e!r}")
+                    continue
+
+                if buffered.status_code not in RETRY_STATUS_CODES:
+                    break
+
+            status = buffered.status_code
+            failed = status >= 500
+            return buffered
+        except asyncio.CancelledError:
+            # Given up by the caller, says nothing about the upstream
+            failed = None
+            raise
+        finally:
+            breaker.release(failed)
+            observe_upstream(upstream_name, status, time.perf_counter() - start)
+
+    # The UpstreamResult of the given uuid-api/entity-api URL, same as make_api_request_get()
+    # An expired successful result is served stale while a single background request refreshes it
+    async def result(self, url):
+        entry = gateway.make_api_request_get.cache_entry(url)
+
+        if entry is not None:
+            now = time.time()
+
+            if now < entry.expires_at:
+                record_cache_lookup('gateway', True)
+                return entry.value
+
+            if now < entry.stale_until:
+                record_cache_lookup('gateway', True)
+                self._flight(url, lambda: self._fetch(url))
+                return entry.value
+
+        record_cache_lookup('gateway', False)
+
+        # Shielded so a client disconnecting doesn't cancel the request shared with the other waiters
+        return await asyncio.shield(self._flight(url, lambda: self._fetch(url)))
+
+    # The UMLS key validation outcome, same as app.validate_umls_key() and cached the same way
+    async def umls_key_status(self, umls_key):
+        entry = gateway.validate_umls_key.cache_entry(umls_key)
+
+        if entry is not None and time.time() < entry.expires_at:
+            record_cache_lookup('umls', True)
+            return entry.value
+
+        record_cache_lookup('umls', False)
+
+        # Keyed by the hash, the raw key doesn't show up in the logs
+        flight_key = gateway.umls_cache_key(umls_key)
+        return await asyncio.shield(self._flight(flight_key, lambda: self._validate_umls_key(umls_key)))
+
+    # The task of the in-flight call of the key, started with the given coroutine function if none
+    def _flight(self, key, fetch):
+        task = self._in_flight.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._landed(key, done))
+
+        return task
+
+    def _landed(self, key, task):
+        self._in_flight.pop(key, None)
+
+        # Retrieve the exception so a failed background refresh without waiter doesn't get reported as never retrieved
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Failed to GET {key}: {task.exception()}")
+
+    async def _fetch(self, url):
+        logger.info(f"Making a fresh non-cache async HTTP request to GET {url}")
+
+        request_headers = gateway.create_request_headers_for_auth(gateway.auth_helper_instance.getProcessSecret())
+
+        result = compact_response(await self.get(url, headers=request_headers))
+        gateway.make_api_request_get.cache_store(result, url)
+
+        return result
+
+    async def _validate_umls_key(self, umls_key):
+        try:
+            response = await self.get(gateway.umls_validate_url(umls_key))
+        except requests.exceptions.RequestException as e:
+            # The exception message contains the URL with the keys, only log its type
+            logger.error(f"Failed to reach the UMLS validation service: {type(e).__name__}")
+            return gateway.UMLS_UNAVAILABLE
+
+        key_status = gateway.umls_key_status(response)
+        gateway.validate_umls_key.cache_store(key_status, umls_key)
+
+        return key_status
+
+    # Run the synchronous decision function of app.py, fetching the upstream URLs it asks for
+    async def decide(self, func, *args):
+        prefetched = {}
+
+        for _ in range(MAX_UPSTREAM_FETCHES + 1):
+            context_token = gateway.prefetched_upstream_results.set(prefetched)
+            try:
+                return func(*args)
+            except gateway.UpstreamResultNeeded as e:
+                urls = e.urls
+            finally:
+                gateway.prefetched_upstream_results.reset(context_token)
+
+            results = await asyncio.gather(*[self._prefetch(url) for url in urls])
+            prefetched.update(zip(urls, results))
+
+        raise RuntimeError(f"More than {MAX_UPSTREAM_FETCHES} rounds of upstream requests needed by {func.__name__}{args}")
+
+    # The result of the URL or its request error, which the decision logic gets raised
+    async def _prefetch(self, url):
+        try:
+            return await self.result(url)
+        except requests.exceptions.RequestException as e:
+            return e
+
+    async def aclose(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+upstreams = AsyncUpstreams(gateway.upstream_client, gateway.app.config.get('ASGI_UPSTREAM_MAX_CONNECTIONS', 1000))
+
+# Threads of each worker process for the blocking calls (Globus token validation, /status.json)
+blocking_executor = ThreadPoolExecutor(max_workers=gateway.app.config.get('ASGI_BLOCKING_THREADS', 24),
+                                       thread_name_prefix='asgi-blocking')
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, func, *args)
+
+
+# The result of the awaitable within the deadline of the auth requests (app.AUTH_REQUEST_DEADLINE)
+# Raise DeadlineExceeded when it's not done by then, the shared upstream requests it waits on keep going
+async def within_deadline(awaitable):
+    if not gateway.auth_request_deadline:
+        return await awaitable
+
+    try:
+        return await asyncio.wait_for(awaitable, gateway.auth_request_deadline)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"No decision within the deadline of {gateway.auth_request_deadline} seconds")
+
+
+####################################################################################################
+## Endpoints, each returns (status code, content type, body, cache control)
+####################################################################################################
+
+# Same response as gateway.auth_response(), cacheable by nginx for `ttl` seconds
+def auth_result(status_code, ttl=0):
+    return status_code, JSON_CONTENT_TYPE, gateway.AUTH_RESPONSE_BODIES[status_code], gateway.auth_cache_control(status_code, ttl)
+
+
+async def api_auth(headers):
+    gateway.log_sampled_request('api_auth', headers)
+
+    item = gateway.match_api_endpoint(headers)
+
+    if item is None:
+        return auth_result(401, gateway.auth_decision_ttl_protected)
+
+    # The public endpoints don't need the token validation
+    if item['auth'] == False:
+        return auth_result(200, gateway.auth_decision_ttl_public)
+
+    # Globus unavailable (circuit breaker open) or too slow is an error, not a decision on the token
+    try:
+        allowed = await within_deadline(run_blocking(gateway.api_access_allowed, item, gateway.CustomRequest(headers)))
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Unable to validate the token: {e}")
+        return auth_result(500)
+
+    if allowed:
+        return auth_result(200, gateway.auth_decision_ttl_protected)
+
+    return auth_result(401, gateway.auth_decision_ttl_protected)
+
+
+async def file_auth(headers):
+    gateway.log_sampled_request('file_auth', headers)
+
+    parsed_request = gateway.parse_file_auth_request(headers)
+
+    if parsed_request is None:
+        return auth_result(401, gateway.auth_decision_ttl_protected)
+
+    uuid, token_from_query = parsed_request
+
+    # Special case used by file assets status only
+    if uuid == 'status':
+        return auth_result(200)
+
+    # Reject the malformed and unknown uuids before validating the token
+    if gateway.is_unknown_uuid(uuid):
+        return auth_result(404)
+
+    # The token validation and the chained uuid-api/entity-api lookups share the deadline of the request
+    try:
+        code = await within_deadline(file_access_code(uuid, token_from_query, headers))
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Unable to decide the file access of uuid {uuid}: {e}")
+        code = 500
+
+    # Returned 400 and 404 will be considered as 500 by nginx auth_request module
+    if code == 404:
+        logger.warning("The end user or client will never see 404 but 500")
+
+    if code in gateway.AUTH_RESPONSE_BODIES:
+        return auth_result(code, gateway.file_access_ttl(uuid, code))
+
+    return auth_result(401)
+
+
+# Same as the decision of gateway.get_file_access() for the uuid
+async def file_access_code(uuid, token_from_query, headers):
+    access_tier = await run_blocking(gateway.get_caller_access_tier, token_from_query, gateway.CustomRequest(headers))
+    return await upstreams.decide(gateway.get_file_access_decision, uuid, access_tier)
+
+
+async def umls_auth(headers):
+    gateway.log_sampled_request('umls_auth', headers)
+
+    umls_key = gateway.parse_umls_key(headers)
+
+    if umls_key is None:
+        return auth_result(401)
+
+    return auth_result(gateway.umls_auth_code(await upstreams.umls_key_status(umls_key)))
+
+
+async def status_json(headers):
+    return 200, JSON_CONTENT_TYPE, json.dumps(await run_blocking(gateway.current_status_data)), 'no-store'
+
+
+ROUTES = {
+    '/api_auth': api_auth,
+    '/file_auth': file_auth,
+    '/umls_auth': umls_auth,
+    '/status.json': status_json
+}
+
+
+####################################################################################################
+## ASGI application
+####################################################################################################
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get(scope['path'])
+
+    if handler is None:
+        status_code, content_type, body, cache_control = auth_result(404)
+    elif scope['method'] not in ('GET', 'HEAD'):
+        status_code, content_type, body, cache_control = 405, 'text/plain', 'Method Not Allowed', 'no-store'
+    else:
+        # Case-insensitive like the Flask request.headers used by the decision logic
+        headers = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']])
+        # Same route names as the metered() endpoints of app.py
+        route = scope['path'].lstrip('/')
+        in_flight = requests_in_flight.labels(route)
+        in_flight.inc()
+        start = time.perf_counter()
+
+        try:
+            status_code, content_type, body, cache_control = await handler(headers)
+        except Exception:
+            logger.exception(f"Failed to handle {scope['path']}")
+            status_code, content_type, body, cache_control = auth_result(500)
+        finally:
+            in_flight.dec()
+
+        observe_request(route, gateway.metric_authority(headers.get('Host')), status_code, time.perf_counter() - start)
+
+    body = body.encode('utf-8')
+
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', content_type.encode('latin-1')), (b'content-length', str(len(body)).encode('latin-1')),
+                    (b'cache-control', cache_control.encode('latin-1'))]
+    })
+    await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await upstreams.aclose()
+            blocking_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
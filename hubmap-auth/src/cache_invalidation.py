@@ -0,0 +1,80 @@
+import re
+from collections import namedtuple
+
+from uuid_filter import is_valid_uuid
+
+# Categories of the cached data that can be invalidated as a whole
+# 'entities': the uuid-api/entity-api lookups, the entity index and the file_auth decisions
+# 'file_access': the file_auth decisions only
+# 'tokens': the Globus token introspection and group lookups
+# 'umls': the UMLS key validations
+# 'endpoints': the API endpoints file, reloaded by every worker
+CATEGORY_ENTITIES = 'entities'
+CATEGORY_FILE_ACCESS = 'file_access'
+CATEGORY_TOKENS = 'tokens'
+CATEGORY_UMLS = 'umls'
+CATEGORY_ENDPOINTS = 'endpoints'
+
+CATEGORIES = (CATEGORY_ENTITIES, CATEGORY_FILE_ACCESS, CATEGORY_TOKENS, CATEGORY_UMLS, CATEGORY_ENDPOINTS)
+
+# The uuid at the end of a uuid-api/entity-api lookup URL, e.g., /entities/<uuid>, /hmuuid/<uuid> or /file-id/<uuid>
+URL_UUID_PATTERN = re.compile(r'/([0-9a-fA-F]{32})$')
+
+# What to evict from the caches
+# `uuids`: entity or file uuids, the file_auth decisions of the indexed files of an entity are evicted with it
+# `url_prefixes`: the cached uuid-api/entity-api lookups of the URLs starting with any of them
+# `categories`: see CATEGORIES
+Invalidation = namedtuple('Invalidation', ['uuids', 'url_prefixes', 'categories'])
+
+
+# Parse the JSON body of POST /cache_invalidate into an Invalidation
+# e.g., {"uuids": ["<uuid>"], "url_prefixes": ["https://entity.api.hubmapconsortium.org/entities/"], "categories": ["umls"]}
+# Raise ValueError with the reason when the body is invalid or has nothing to invalidate
+def parse_invalidation(body):
+    if not isinstance(body, dict):
+        raise ValueError("The request body must be a JSON object")
+
+    uuids = _string_list(body, 'uuids')
+    url_prefixes = _string_list(body, 'url_prefixes')
+    categories = _string_list(body, 'categories')
+
+    invalid_uuids = [uuid for uuid in uuids if not is_valid_uuid(uuid)]
+    if invalid_uuids:
+        raise ValueError(f"Invalid uuids: {', '.join(invalid_uuids)}")
+
+    # A short prefix would evict about everything, use the categories for that
+    invalid_prefixes = [prefix for prefix in url_prefixes if not re.match(r'^https?://[^/]+/', prefix)]
+    if invalid_prefixes:
+        raise ValueError(f"The url_prefixes must start with the scheme, host and a path: {', '.join(invalid_prefixes)}")
+
+    unknown_categories = [category for category in categories if category not in CATEGORIES]
+    if unknown_categories:
+        raise ValueError(f"Unknown categories: {', '.join(unknown_categories)}, the categories are {', '.join(CATEGORIES)}")
+
+    if not (uuids or url_prefixes or categories):
+        raise ValueError("Nothing to invalidate, specify the uuids, url_prefixes and/or categories")
+
+    return Invalidation(uuids=tuple(dict.fromkeys(uuid.lower() for uuid in uuids)),
+                        url_prefixes=tuple(url_prefixes),
+                        categories=tuple(dict.fromkeys(categories)))
+
+
+# The uuids of the given uuid-api/entity-api lookup URLs
+def uuids_of_urls(urls):
+    uuids = []
+
+    for url in urls:
+        match = URL_UUID_PATTERN.search(url)
+        if match:
+            uuids.append(match.group(1).lower())
+
+    return uuids
+
+
+def _string_list(body, name):
+    values = body.get(name, [])
+
+    if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+        raise ValueError(f"'{name}' must be a list of strings")
+
+    return values
@@ -0,0 +1,166 @@
+import glob
+import gzip
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from metrics import cache_warmup_duration, cache_warmup_uuids
+from uuid_filter import is_valid_uuid
+
+logger = logging.getLogger(__name__)
+
+# The uuid of an assets request line in the nginx access log, the first segment of the request path
+# e.g., "GET /<uuid>/<relative-file-path>?token=<globus-token> HTTP/1.1"
+ACCESS_LOG_UUID_PATTERN = re.compile(r'"(?:GET|HEAD) /([0-9a-fA-F]{32})[/?" ]')
+
+
+# The uuids listed in the file, one per line, the empty lines and the lines starting with # are skipped
+def read_uuids_file(path):
+    uuids = []
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+
+            if not line or line.startswith('#'):
+                continue
+
+            if is_valid_uuid(line):
+                uuids.append(line.lower())
+            else:
+                logger.warning(f"Skip the invalid uuid {line} of the cache warm-up file {path}")
+
+    return uuids
+
+
+# The most requested uuids of the given nginx access logs of the assets server, most requested first
+# Each pattern can be a glob, e.g., to include the rotated logs, the .gz files are read as gzip
+def hot_uuids_from_access_logs(patterns, limit):
+    counts = Counter()
+
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            opener = gzip.open if path.endswith('.gz') else open
+
+            with opener(path, 'rt', errors='replace') as f:
+                for line in f:
+                    match = ACCESS_LOG_UUID_PATTERN.search(line)
+                    if match:
+                        counts[match.group(1).lower()] += 1
+
+    return [uuid for uuid, count in counts.most_common(limit)]
+
+
+# Resolves the hot uuids ahead of the requests so the first requests after a restart hit the cache
+# `resolve(uuid)` resolves one uuid into the caches, returns True if it needed upstream requests,
+# False if everything was already cached, and raises on failure
+# The uuids come from the `uuids_file` and/or the `access_logs` patterns, at most `max_uuids` of them,
+# and are resolved by `concurrency` threads, at start and then every `interval` seconds (0 for only once)
+# The report of the last run is also stored in the given cache so any worker can return it,
+# `cache_lock` guards the cache shared with the request threads (cachetools caches aren't thread-safe)
+class CacheWarmer:
+    def __init__(self, resolve, cache, cache_lock=None, uuids_file=None, access_logs=(), max_uuids=5000, concurrency=8,
+                 interval=0, cache_key='cache_warmup_report'):
+        self.resolve = resolve
+        self.cache = cache
+        self.cache_lock = cache_lock if cache_lock is not None else threading.RLock()
+        self.uuids_file = uuids_file
+        self.access_logs = access_logs
+        self.max_uuids = max_uuids
+        self.concurrency = concurrency
+        self.interval = interval
+        self.cache_key = cache_key
+        self._report = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Start the warm-up thread if not started yet
+    # Must be called in the uWSGI worker process, threads started before the fork don't survive
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='cache-warmer', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # The hot uuids from the file first, then from the access logs, without duplicates
+    def hot_uuids(self):
+        uuids = []
+
+        if self.uuids_file:
+            uuids.extend(read_uuids_file(self.uuids_file))
+
+        if self.access_logs:
+            uuids.extend(hot_uuids_from_access_logs(self.access_logs, self.max_uuids))
+
+        return list(dict.fromkeys(uuids))[:self.max_uuids]
+
+    # Resolve all the hot uuids once and return the report
+    # The hit rate is the fraction of the uuids already fully cached before this run
+    def run(self):
+        started_at = time.time()
+        start = time.perf_counter()
+        uuids = self.hot_uuids()
+        counts = Counter()
+
+        def warm(uuid):
+            try:
+                return 'fetched' if self.resolve(uuid) else 'cached'
+            except Exception as e:
+                logger.debug(f"Failed to warm up the cache for uuid {uuid}: {e}")
+                return 'failed'
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='cache-warmer') as executor:
+            counts.update(executor.map(warm, uuids))
+
+        duration = time.perf_counter() - start
+
+        report = {
+            'started_at': datetime.fromtimestamp(started_at, timezone.utc).isoformat(),
+            'duration': round(duration, 3),
+            'uuids': len(uuids),
+            'cached': counts['cached'],
+            'fetched': counts['fetched'],
+            'failed': counts['failed'],
+            'hit_rate': round(counts['cached'] / len(uuids), 4) if uuids else None
+        }
+
+        cache_warmup_duration.set(duration)
+        for result in ('cached', 'fetched', 'failed'):
+            cache_warmup_uuids.labels(result).set(counts[result])
+
+        self._report = report
+        try:
+            with self.cache_lock:
+                self.cache[self.cache_key] = report
+        except ValueError:
+            # Too big for the cache, just keep the local report
+            pass
+
+        logger.info(f"Warmed up the cache in {duration:.1f}s: {len(uuids)} uuids, {counts['cached']} already cached, "
+                    f"{counts['fetched']} fetched, {counts['failed']} failed")
+
+        return report
+
+    # The report of the last run of any worker, None if not run yet
+    def report(self):
+        with self.cache_lock:
+            report = self.cache.get(self.cache_key)
+        return report if report is not None else self._report
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run()
+            except Exception:
+                logger.exception("Failed to warm up the cache")
+
+            if not self.interval or self._stop.wait(self.interval):
+                return
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+
+import requests
+
+from metrics import record_circuit_rejection, set_circuit_state
+
+logger = logging.getLogger(__name__)
+
+# States of a circuit breaker, also the values of the hubmap_auth_circuit_breaker_state gauge
+# so the max over the worker processes is the worst state
+CIRCUIT_CLOSED = 0
+CIRCUIT_HALF_OPEN = 1
+CIRCUIT_OPEN = 2
+
+CIRCUIT_STATE_NAMES = {
+    CIRCUIT_CLOSED: 'closed',
+    CIRCUIT_HALF_OPEN: 'half_open',
+    CIRCUIT_OPEN: 'open'
+}
+
+
+# Raised instead of calling an upstream whose circuit breaker is open
+# A requests ConnectionError so the callers handle it like the upstream being unreachable
+class CircuitOpen(requests.exceptions.ConnectionError):
+    pass
+
+
+# Per-process circuit breaker of one upstream
+# closed:    the calls go through, `failure_threshold` consecutive failures open the circuit (0 never opens it)
+# open:      the calls fail at once with CircuitOpen, for `open_timeout` seconds
+# half-open: up to `half_open_requests` probe calls go through at the same time, the others still fail at once,
+#            a successful probe closes the circuit and a failed one opens it again
+# Each call is acquire() then release(failed) with failed True/False, or None when the outcome
+# says nothing about the upstream, e.g., the call was abandoned because the request ran out of time
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, open_timeout, half_open_requests):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_timeout = open_timeout
+        self.half_open_requests = max(1, half_open_requests)
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._probes = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+        set_circuit_state(name, CIRCUIT_CLOSED)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._half_open_when_due()
+            return self._state
+
+    # Raise CircuitOpen if the call must not go through
+    def acquire(self):
+        with self._lock:
+            self._half_open_when_due()
+
+            if self._state == CIRCUIT_CLOSED:
+                return
+
+            if self._state == CIRCUIT_HALF_OPEN and self._probes < self.half_open_requests:
+                self._probes += 1
+                return
+
+        record_circuit_rejection(self.name)
+        raise CircuitOpen(f"Circuit breaker of upstream {self.name} is open")
+
+    def release(self, failed):
+        with self._lock:
+            if self._state == CIRCUIT_HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+            if failed is None:
+                return
+
+            if not failed:
+                self._failures = 0
+                if self._state != CIRCUIT_CLOSED:
+                    logger.warning(f"Circuit breaker of upstream {self.name} closed")
+                    self._set_state(CIRCUIT_CLOSED)
+                return
+
+            self._failures += 1
+
+            if self._state == CIRCUIT_HALF_OPEN or (self._state == CIRCUIT_CLOSED and 0 < self.failure_threshold <= self._failures):
+                logger.warning(f"Circuit breaker of upstream {self.name} opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+                self._set_state(CIRCUIT_OPEN)
+
+    def _half_open_when_due(self):
+        if self._state == CIRCUIT_OPEN and time.monotonic() - self._opened_at >= self.open_timeout:
+            self._probes = 0
+            self._set_state(CIRCUIT_HALF_OPEN)
+
+    def _set_state(self, state):
+        self._state = state
+        set_circuit_state(self.name, state)
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from route_index import RouteIndex
+
+logger = logging.getLogger(__name__)
+
+HTTP_METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+
+
+# Raised when the API endpoints file can't be parsed or doesn't have the expected structure
+class EndpointsFileError(Exception):
+    pass
+
+
+# The route index compiled from one version of the API endpoints file
+# `version` is the SHA-256 hex digest of the file content, `loaded_at` the unix time of the load
+LoadedEndpoints = namedtuple('LoadedEndpoints', ['route_index', 'version', 'loaded_at', 'endpoint_count'])
+
+
+# Check the structure used by api_auth, e.g.
+# {"<authority>": [{"method": "GET", "endpoint": "/datasets/<*>", "auth": true, "groups": ["<group uuid>"]}]}
+# Return the number of endpoints, raise EndpointsFileError on the first problem found
+def validate_endpoints(data):
+    if not isinstance(data, dict) or not data:
+        raise EndpointsFileError("The top level must be a non-empty object keyed by the authority")
+
+    count = 0
+    for authority, items in data.items():
+        if not isinstance(items, list):
+            raise EndpointsFileError(f"The endpoints of {authority} must be a list")
+
+        for index, item in enumerate(items):
+            where = f"{authority}[{index}]"
+
+            if not isinstance(item, dict):
+                raise EndpointsFileError(f"{where} must be an object")
+            if not isinstance(item.get('method'), str) or item['method'].upper() not in HTTP_METHODS:
+                raise EndpointsFileError(f"{where} has an invalid method: {item.get('method')}")
+            if not isinstance(item.get('endpoint'), str) or not item['endpoint'].startswith('/'):
+                raise EndpointsFileError(f"{where} has an invalid endpoint: {item.get('endpoint')}")
+            if not isinstance(item.get('auth'), bool):
+                raise EndpointsFileError(f"{where} must have a boolean auth")
+            if 'groups' in item and (not isinstance(item['groups'], list) or not all(isinstance(group, str) for group in item['groups'])):
+                raise EndpointsFileError(f"{where} must have a list of group uuids")
+
+            count += 1
+
+    return count
+
+
+# The API endpoints file watched for changes and compiled into a RouteIndex off the request path
+# A background thread polls the file mtime and size every `poll_interval` seconds, a change gets
+# parsed, validated and compiled, then swapped in with a single reference assignment so the
+# request threads see either the old or the new index, never a partial one
+# A bad file is rejected and the last good version keeps being served
+# Each uWSGI worker process watches the file on its own, so all of them pick up the change within the interval
+class EndpointsConfig:
+    def __init__(self, path, poll_interval):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.last_error = None
+        self._loaded = None
+        # (st_mtime_ns, st_size) of the last file checked, good or bad, to only reload on change
+        self._file_stat = None
+        self._reload_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Start the watching thread if not started yet and if enabled
+    # Must be called in the uWSGI worker process, threads started before the fork don't survive
+    def start(self):
+        if not self.poll_interval or self._thread is not None:
+            return
+
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='endpoints-watcher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # The active route index, loaded synchronously if nothing was loaded yet
+    def route_index(self):
+        loaded = self._loaded
+
+        if loaded is None:
+            loaded = self.reload()
+
+        return loaded.route_index
+
+    # Authorities of the active version, without loading the file if nothing was loaded yet
+    def authorities(self):
+        loaded = self._loaded
+        return loaded.route_index.authorities if loaded is not None else frozenset()
+
+    # Load the file if it changed since the last check, or anyway with force=True
+    # Raise the error only when there is no good version to fall back to
+    def reload(self, force=False):
+        with self._reload_lock:
+            try:
+                stat = os.stat(self.path)
+                file_stat = (stat.st_mtime_ns, stat.st_size)
+
+                if not force and self._loaded is not None and file_stat == self._file_stat:
+                    return self._loaded
+
+                self._file_stat = file_stat
+
+                with open(self.path, 'rb') as f:
+                    content = f.read()
+
+                version = hashlib.sha256(content).hexdigest()
+
+                if self._loaded is not None and version == self._loaded.version:
+                    return self._loaded
+
+                try:
+                    data = json.loads(content)
+                except ValueError as e:
+                    raise EndpointsFileError(f"Invalid json: {e}")
+
+                endpoint_count = validate_endpoints(data)
+                loaded = LoadedEndpoints(RouteIndex(data), version, time.time(), endpoint_count)
+            except Exception as e:
+                self.last_error = {'error': str(e), 'at': time.time()}
+
+                if self._loaded is None:
+                    raise
+
+                logger.error(f"Rejected the API endpoints file {self.path}, keep serving version {self._loaded.version}: {e}")
+                return self._loaded
+
+            self._loaded = loaded
+            self.last_error = None
+
+            logger.info(f"Loaded the API endpoints file {self.path} version {version} with {endpoint_count} endpoints")
+
+            return loaded
+
+    # Description of the active version for the introspection endpoint
+    def info(self):
+        loaded = self._loaded
+
+        if loaded is None:
+            loaded = self.reload()
+
+        info = {
+            'file': self.path,
+            'version': loaded.version,
+            'loaded_at': datetime.fromtimestamp(loaded.loaded_at, timezone.utc).isoformat(),
+            'endpoint_count': loaded.endpoint_count,
+            'poll_interval': self.poll_interval
+        }
+
+        if self.last_error is not None:
+            info['last_error'] = {
+                'error': self.last_error['error'],
+                'at': datetime.fromtimestamp(self.last_error['at'], timezone.utc).isoformat()
+            }
+
+        return info
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.reload()
+            except Exception:
+                logger.exception(f"Failed to load the API endpoints file {self.path}")
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import namedtuple
+
+from gateway_cache import MeteredTTLCache
+from metrics import record_cache_lookup
+
+# What the file_auth decision needs to know about a uuid, merged from whichever of uuid-api and entity-api answered
+# For a file uuid only `ancestor_uuid` is set, the uuid of the entity the file belongs to (uuid-api /file-id)
+# For an AVR entity only `is_avr` is set (uuid-api /hmuuid), AVR are not stored in neo4j
+# For the other entities `entity_type`, `data_access_level` and `status` come from entity-api /entities
+EntityMetadata = namedtuple('EntityMetadata', ['entity_type', 'is_avr', 'data_access_level', 'status', 'ancestor_uuid'])
+
+
+def file_metadata(ancestor_uuid):
+    return EntityMetadata(entity_type=None, is_avr=False, data_access_level=None, status=None, ancestor_uuid=ancestor_uuid)
+
+
+def avr_metadata():
+    return EntityMetadata(entity_type=None, is_avr=True, data_access_level=None, status=None, ancestor_uuid=None)
+
+
+def entity_metadata(entity_type, data_access_level, status):
+    return EntityMetadata(entity_type=entity_type, is_avr=False, data_access_level=data_access_level, status=status, ancestor_uuid=None)
+
+
+# Per-process index of the EntityMetadata by uuid
+# Unlike the gateway cache keyed by upstream URL, one entry answers for every file of the same
+# entity and every caller access tier without looking at any upstream result again
+# Only the successful resolutions are indexed, the not found and errors are left to the gateway cache TTLs
+# With a `store` (see entity_store.py) shared by all the worker processes, the entries missing from the index
+# are looked up in the store, and the indexed entries are written to it too
+# The entries found in the store are indexed until the expiry of the stored entry, not for a full ttl again
+# invalidate() and clear() only apply to this process, the store is invalidated once for all of them
+class EntityIndex:
+    def __init__(self, maxsize, ttl, name='entity_index', store=None):
+        self.name = name
+        self.store = store
+        self.ttl = ttl
+        # uuid -> (EntityMetadata, expires_at)
+        self._entries = MeteredTTLCache(maxsize=maxsize, ttl=ttl, name=name)
+        self._lock = threading.Lock()
+
+    def get(self, uuid):
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(uuid)
+
+            if entry is not None and entry[1] <= now:
+                del self._entries[uuid]
+                entry = None
+
+        metadata = entry[0] if entry is not None else None
+        record_cache_lookup(self.name, metadata is not None)
+
+        if metadata is None and self.store is not None:
+            entry = self.store.get_entry(uuid)
+
+            if entry is not None:
+                metadata = entry[0]
+                with self._lock:
+                    self._entries[uuid] = (metadata, min(entry[1], now + self.ttl))
+
+        return metadata
+
+    def put(self, uuid, metadata):
+        with self._lock:
+            self._entries[uuid] = (metadata, time.time() + self.ttl)
+
+        if self.store is not None:
+            self.store.put(uuid, metadata)
+
+    def invalidate(self, uuid):
+        with self._lock:
+            return self._entries.pop(uuid, None) is not None
+
+    # The indexed file uuids of the given entity, without counting any lookup
+    def files_of(self, entity_uuid):
+        with self._lock:
+            return [uuid for uuid, (metadata, _) in self._entries.items() if metadata.ancestor_uuid == entity_uuid]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
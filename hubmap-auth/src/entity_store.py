@@ -0,0 +1,348 @@
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from entity_index import EntityMetadata
+from metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'HMES'
+FORMAT_VERSION = 1
+
+# magic, format version, slots, record size, generation, padded to HEADER_SIZE bytes
+HEADER = struct.Struct('<4sIQII')
+HEADER_SIZE = 64
+GENERATION_OFFSET = 20
+
+# One fixed-width record per slot (48 bytes):
+# seq, expires_at (epoch seconds), generation, flags, entity type, data access level, status, uuid, ancestor uuid
+# `seq` is odd while the record is being written, see _read()
+RECORD = struct.Struct('<IIIBBBB16s16s')
+SEQ = struct.Struct('<I')
+# generation, flags and uuid of the record, enough to walk a probe sequence
+PROBE = struct.Struct('<IB3x16s')
+PROBE_OFFSET = 8
+
+FLAG_OCCUPIED = 1
+FLAG_DELETED = 2
+FLAG_AVR = 4
+
+NO_ANCESTOR = bytes(16)
+
+# Slots per entry of the capacity, the linear probing stays short up to this load
+MAX_LOAD_FACTOR = 0.5
+# Slots probed by a lookup at most, so a lookup is O(1) even in a full store
+MAX_PROBES = 32
+# Reads of a record retried while it's being written by another process
+SEQLOCK_RETRIES = 8
+
+# The strings of the EntityMetadata fields stored as one byte, 0 is None
+# A value not listed here can't be stored, that entity stays in the per-process entity index only
+ENTITY_TYPES = [None, 'Donor', 'Sample', 'Dataset', 'Publication', 'Upload', 'Collection', 'Epicollection']
+DATA_ACCESS_LEVELS = [None, 'public', 'consortium', 'protected']
+STATUSES = [None, 'New', 'Processing', 'QA', 'Published', 'Error', 'Hold', 'Invalid', 'Submitted', 'Incomplete',
+            'Reorganized', 'Unpublished', 'Valid', 'Approved']
+
+ENTITY_TYPE_CODES = {value: code for code, value in enumerate(ENTITY_TYPES)}
+DATA_ACCESS_LEVEL_CODES = {value: code for code, value in enumerate(DATA_ACCESS_LEVELS)}
+STATUS_CODES = {value: code for code, value in enumerate(STATUSES)}
+
+
+# Entity metadata store shared by all the worker processes, kept in a memory-mapped file that survives the restarts
+# An open addressing hash table of fixed-width records keyed by the 16 bytes of the uuid, with linear probing:
+# a lookup reads at most MAX_PROBES records of the mapped file without any lock or syscall, and the memory is the
+# page cache of the file shared by all the processes, bounded by the file size (capacity / MAX_LOAD_FACTOR * 48 bytes)
+# The writes are serialized by a lock of the file (lockf) across the processes, and each record has a sequence
+# number so a reader never sees a record half written
+# clear() bumps the generation of the store in O(1), the records of an older generation count as empty slots
+# The file is created if missing when opened. A file of another format or size is never changed in place, the other
+# processes may still have it mapped (a mapping past the end of a truncated file faults with SIGBUS): a new file is
+# built under a temporary name and atomically replaces it, the processes that mapped the old one keep reading it
+class EntityStore:
+    def __init__(self, path, capacity, ttl, name='entity_store'):
+        self.path = path
+        self.ttl = ttl
+        self.name = name
+        self.slots = max(1, int(capacity / MAX_LOAD_FACTOR))
+        self.size = HEADER_SIZE + (self.slots + MAX_PROBES) * RECORD.size
+        self._lock = threading.Lock()
+
+        self._fd = self._open()
+        try:
+            self._map = mmap.mmap(self._fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    # The descriptor of the store file matching this store, created or replaced if needed
+    def _open(self):
+        while True:
+            try:
+                fd = os.open(self.path, os.O_RDWR)
+            except FileNotFoundError:
+                self._create(replace=False)
+                continue
+
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+                try:
+                    # Otherwise replaced by another process while waiting for the lock, open the new file
+                    if self._is_current(fd):
+                        if self._matches(fd):
+                            logger.info(f"Opened the entity store {self.path} of {self.slots} slots")
+                            return fd
+
+                        # Replaced under the lock of the old file so the other processes opening it wait for the new one
+                        self._create(replace=True)
+                finally:
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+            except Exception:
+                os.close(fd)
+                raise
+
+            os.close(fd)
+
+    # Whether the descriptor is still the file at the path
+    def _is_current(self, fd):
+        try:
+            return os.stat(self.path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _matches(self, fd):
+        header = os.pread(fd, HEADER.size, 0)
+
+        if len(header) != HEADER.size or os.fstat(fd).st_size != self.size:
+            return False
+
+        magic, version, slots, record_size, _ = HEADER.unpack(header)
+        return (magic, version, slots, record_size) == (MAGIC, FORMAT_VERSION, self.slots, RECORD.size)
+
+    # Build an empty store file under a temporary name in the same directory, then move it to the path
+    # Without `replace`, a file created at the path by another process meanwhile is kept
+    def _create(self, replace):
+        directory, filename = os.path.split(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix=f"{filename}.", suffix='.tmp', dir=directory)
+
+        try:
+            # Sparse file, the disk blocks are only allocated as the records get written
+            os.ftruncate(fd, self.size)
+            os.pwrite(fd, HEADER.pack(MAGIC, FORMAT_VERSION, self.slots, RECORD.size, 1), 0)
+        finally:
+            os.close(fd)
+
+        try:
+            if replace:
+                os.replace(temp_path, self.path)
+            else:
+                os.link(temp_path, self.path)
+                os.remove(temp_path)
+        except FileExistsError:
+            os.remove(temp_path)
+            return
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+        logger.info(f"Created the entity store {self.path} of {self.slots} slots ({self.size} bytes)")
+
+    # Exclusive lock of the file against the other processes, lockf locks are owned by the process
+    # so the threads of the process are serialized by self._lock first
+    @contextmanager
+    def _file_lock(self):
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _generation(self):
+        return struct.unpack_from('<I', self._map, GENERATION_OFFSET)[0]
+
+    # Offsets of the records of the probe sequence of the key, the file has MAX_PROBES more records than slots
+    # so the probe sequence of the last slot doesn't wrap around
+    # The uuid is random enough to be its own hash, read big-endian as the file uuids all start with ffff
+    def _offsets(self, key):
+        offset = HEADER_SIZE + (int.from_bytes(key, 'big') % self.slots) * RECORD.size
+        return range(offset, offset + MAX_PROBES * RECORD.size, RECORD.size)
+
+    # The record at the offset, None if it keeps being rewritten by another process
+    def _read(self, offset):
+        for _ in range(SEQLOCK_RETRIES):
+            record = RECORD.unpack_from(self._map, offset)
+
+            if record[0] & 1 == 0 and SEQ.unpack_from(self._map, offset)[0] == record[0]:
+                return record
+
+        return None
+
+    def _write(self, offset, expires_at, generation, flags, entity_type, data_access_level, status, key, ancestor):
+        seq = SEQ.unpack_from(self._map, offset)[0]
+
+        SEQ.pack_into(self._map, offset, seq + 1)
+        RECORD.pack_into(self._map, offset, seq + 1, expires_at, generation, flags, entity_type, data_access_level, status, key, ancestor)
+        SEQ.pack_into(self._map, offset, seq + 2)
+
+    # The uuid as the 16 bytes key, None if it's not 32 hex characters
+    @staticmethod
+    def _key(uuid):
+        try:
+            key = bytes.fromhex(uuid)
+        except (TypeError, ValueError):
+            return None
+
+        return key if len(key) == 16 else None
+
+    # Offset of the live record of the key (None if not found), and the first free slot on its probe sequence
+    # Only called by the writers, under the locks
+    def _find(self, key, generation, now):
+        free = None
+
+        for offset in self._offsets(key):
+            _, expires_at, record_generation, flags, _, _, _, record_key, _ = RECORD.unpack_from(self._map, offset)
+
+            if record_generation != generation or flags == 0:
+                return None, free if free is not None else offset
+
+            if flags & FLAG_OCCUPIED and record_key == key:
+                return offset, free
+
+            if free is None and (flags & FLAG_DELETED or expires_at <= now):
+                free = offset
+
+        return None, free
+
+    def get(self, uuid):
+        entry = self.get_entry(uuid)
+        return entry[0] if entry is not None else None
+
+    # The (EntityMetadata, expires_at epoch seconds) of the uuid, None if not stored or expired
+    def get_entry(self, uuid):
+        key = self._key(uuid)
+        entry = None
+
+        if key is not None:
+            entry = self._get(key)
+
+        record_cache_lookup(self.name, entry is not None)
+        return entry
+
+    def _get(self, key):
+        generation = self._generation()
+
+        for offset in self._offsets(key):
+            record_generation, flags, record_key = PROBE.unpack_from(self._map, offset + PROBE_OFFSET)
+
+            # End of the probe sequence
+            if record_generation != generation or flags == 0:
+                return None
+
+            if record_key != key:
+                continue
+
+            # The whole record, consistent this time
+            record = self._read(offset)
+            if record is None:
+                return None
+
+            _, expires_at, record_generation, flags, entity_type, data_access_level, status, record_key, ancestor = record
+
+            if record_generation != generation or not flags & FLAG_OCCUPIED or record_key != key:
+                continue
+
+            if expires_at <= time.time():
+                return None
+
+            # EntityMetadata(entity_type, is_avr, data_access_level, status, ancestor_uuid)
+            return EntityMetadata(ENTITY_TYPES[entity_type], bool(flags & FLAG_AVR), DATA_ACCESS_LEVELS[data_access_level],
+                                  STATUSES[status], ancestor.hex() if ancestor != NO_ANCESTOR else None), expires_at
+
+        return None
+
+    # Store the EntityMetadata of the uuid for ttl seconds
+    # Return False if it can't be stored: a value not in the code tables, or no free slot within MAX_PROBES
+    def put(self, uuid, metadata):
+        return self.put_many([(uuid, metadata)]) == 1
+
+    # Store the (uuid, EntityMetadata) items under a single lock, return the number of items stored
+    def put_many(self, items):
+        stored = 0
+
+        with self._lock, self._file_lock():
+            generation = self._generation()
+            now = time.time()
+            expires_at = int(now + self.ttl)
+
+            for uuid, metadata in items:
+                key = self._key(uuid)
+                record = self._encode(metadata)
+
+                if key is None or record is None:
+                    continue
+
+                offset, free = self._find(key, generation, now)
+                offset = offset if offset is not None else free
+
+                if offset is None:
+                    continue
+
+                self._write(offset, expires_at, generation, *record[:4], key, record[4])
+                stored += 1
+
+        return stored
+
+    # (flags, entity type, data access level, status, ancestor) of the EntityMetadata, None if it can't be stored
+    @staticmethod
+    def _encode(metadata):
+        if (metadata.entity_type not in ENTITY_TYPE_CODES or metadata.data_access_level not in DATA_ACCESS_LEVEL_CODES
+                or metadata.status not in STATUS_CODES):
+            return None
+
+        ancestor = NO_ANCESTOR
+        if metadata.ancestor_uuid is not None:
+            ancestor = EntityStore._key(metadata.ancestor_uuid)
+            if ancestor is None:
+                return None
+
+        flags = FLAG_OCCUPIED | (FLAG_AVR if metadata.is_avr else 0)
+
+        return (flags, ENTITY_TYPE_CODES[metadata.entity_type], DATA_ACCESS_LEVEL_CODES[metadata.data_access_level],
+                STATUS_CODES[metadata.status], ancestor)
+
+    # Return True if the uuid was stored
+    def invalidate(self, uuid):
+        key = self._key(uuid)
+
+        if key is None:
+            return False
+
+        with self._lock, self._file_lock():
+            generation = self._generation()
+            offset, _ = self._find(key, generation, time.time())
+
+            if offset is None:
+                return False
+
+            # Left as a tombstone so the probe sequences going through it still reach their records
+            self._write(offset, 0, generation, FLAG_DELETED, 0, 0, 0, bytes(16), NO_ANCESTOR)
+
+        return True
+
+    def clear(self):
+        with self._lock, self._file_lock():
+            struct.pack_into('<I', self._map, GENERATION_OFFSET, self._generation() + 1)
+
+    # Write the dirty pages to the file, the kernel does it anyway, e.g., before the container stops
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
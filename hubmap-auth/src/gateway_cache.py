@@ -0,0 +1,494 @@
+import functools
+import logging
+import math
+import pickle
+import sys
+import threading
+import time
+from collections import namedtuple
+from collections.abc import MutableMapping
+
+from cachetools import TTLCache
+from cachetools.keys import hashkey
+
+from metrics import record_cache_eviction, record_cache_lookup
+
+# The `uwsgi` module is only importable when running under the uWSGI server
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+logger = logging.getLogger(__name__)
+
+# Supported values of CACHE_BACKEND in app.cfg
+CACHE_BACKEND_LOCAL = 'local'
+CACHE_BACKEND_UWSGI = 'uwsgi'
+
+# uWSGI signal number used to run the registered clear handlers in every worker
+WORKER_CLEAR_SIGNAL = 17
+
+# uWSGI signal number used to deliver the WorkerBroadcast messages to every worker
+WORKER_BROADCAST_SIGNAL = 18
+
+# Handlers to run in every worker when broadcast_worker_clear() is called
+_worker_clear_handlers = []
+
+# Handlers to run in the uWSGI worker processes once forked, see register_post_fork()
+_post_fork_handlers = []
+
+# Keep at most this many characters of the error response text for logging and error messages
+MAX_ERROR_TEXT_LENGTH = 1024
+
+# Compact record of a uuid-api/entity-api GET response stored in the cache instead of the requests.Response
+# Only the status code and the parsed fields used by the gateway are kept, None if not present
+# `text` is only kept for non-200 or unparsable responses
+UpstreamResult = namedtuple('UpstreamResult', ['status_code', 'ancestor_uuid', 'type', 'entity_type', 'data_access_level', 'status', 'text'])
+
+
+# TTLCache counting the entries evicted to make room when full as hubmap_auth_cache_evictions_total{cache=name}
+# The expired entries and clear() are not counted as evictions
+class MeteredTTLCache(TTLCache):
+    def __init__(self, maxsize, ttl, name):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.name = name
+        self._clearing = False
+
+    def popitem(self):
+        item = super().popitem()
+        if not self._clearing:
+            record_cache_eviction(self.name)
+        return item
+
+    # MutableMapping.clear() pops the items one by one
+    def clear(self):
+        self._clearing = True
+        try:
+            super().clear()
+        finally:
+            self._clearing = False
+
+
+# Dict-like cache backed by a uWSGI cache (the `cache2` option in uwsgi.ini)
+# The cache lives in the uWSGI master process shared memory, so all the worker processes see the same
+# entries and the entries survive the worker recycling caused by `max-requests`
+# Values are pickled, and expired entries are purged by the uWSGI cache sweeper
+# Works with cachetools.cached() since it only relies on __getitem__ and __setitem__
+class UwsgiCache(MutableMapping):
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+
+    @staticmethod
+    def _cache_key(key):
+        return cache_key_string(key)
+
+    def __getitem__(self, key):
+        value = uwsgi.cache_get(self._cache_key(key), self.name)
+        if value is None:
+            raise KeyError(key)
+        return pickle.loads(value)
+
+    def __setitem__(self, key, value):
+        # cache_update() overwrites the existing item while cache_set() won't
+        if not uwsgi.cache_update(self._cache_key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.ttl, self.name):
+            # Item too big for the configured blocks or cache full without purge_lru
+            # Raise ValueError so cachetools.cached() just skips caching this value
+            raise ValueError(f"Unable to store the item {key} in uWSGI cache {self.name}")
+
+    def __delitem__(self, key):
+        if not uwsgi.cache_del(self._cache_key(key), self.name):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return bool(uwsgi.cache_exists(self._cache_key(key), self.name))
+
+    # The uWSGI cache API doesn't expose the keys for iteration, see cache_keys()
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+    def clear(self):
+        uwsgi.cache_clear(self.name)
+
+    # The keys of all the entries, in their string form
+    # None if this uWSGI version can't list them (uwsgi.cache_keys() is missing)
+    def cache_keys(self):
+        if not hasattr(uwsgi, 'cache_keys'):
+            return None
+
+        return [key.decode('utf-8') if isinstance(key, bytes) else key for key in uwsgi.cache_keys(self.name)]
+
+
+# cachetools keys are tuples of the function arguments, uWSGI cache keys are strings
+# e.g., ('https://entity.api.hubmapconsortium.org/entities/<uuid>',) and ('token', 'user', <hash>)
+# become 'https://entity.api.hubmapconsortium.org/entities/<uuid>' and 'token|user|<hash>'
+def cache_key_string(key):
+    if isinstance(key, tuple):
+        return '|'.join(str(part) for part in key)
+    return str(key)
+
+
+# Delete the entries of the cache whose key in its string form (see cache_key_string()) starts with any of the prefixes
+# The optional lock guards the access to the non-thread-safe cachetools caches
+# Return the deleted keys in their string form, or None if the keys of the uWSGI cache
+# can't be listed, the caller has to clear the whole cache instead
+def evict_by_prefix(cache, prefixes, lock=None):
+    lock = lock or threading.RLock()
+    prefixes = tuple(prefixes)
+
+    if isinstance(cache, UwsgiCache):
+        keys = cache.cache_keys()
+        if keys is None:
+            return None
+    else:
+        with lock:
+            keys = list(cache.keys())
+
+    evicted = []
+    for key in keys:
+        key_string = cache_key_string(key)
+
+        if key_string.startswith(prefixes):
+            with lock:
+                if cache.pop(key, None) is not None:
+                    evicted.append(key_string)
+
+    return evicted
+
+
+# Convert a requests.Response of uuid-api or entity-api into an UpstreamResult
+# The JSON parsing happens once here, the cache hits don't parse anything
+def compact_response(response):
+    if response.status_code == 200:
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+
+        if isinstance(body, dict):
+            return UpstreamResult(status_code=response.status_code,
+                                  ancestor_uuid=body.get('ancestor_uuid'),
+                                  type=_intern(body.get('type')),
+                                  entity_type=_intern(body.get('entity_type')),
+                                  data_access_level=_intern(body.get('data_access_level')),
+                                  status=_intern(body.get('status')),
+                                  text=None)
+
+    return UpstreamResult(status_code=response.status_code,
+                          ancestor_uuid=None,
+                          type=None,
+                          entity_type=None,
+                          data_access_level=None,
+                          status=None,
+                          text=response.text[:MAX_ERROR_TEXT_LENGTH])
+
+
+# The type, access level, and status values come from a handful of strings
+# Interning makes all the cached records share the same string objects
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# An in-flight call of SingleFlight, the waiters block on `done` and share the result or the error
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Request coalescing: at most one in-flight call per key within the process
+# The concurrent callers of the same key wait for that call and share its result or exception
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    # Return the flight of the key and whether the caller is the leader who has to run the call
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+
+            flight = _Flight()
+            self._flights[key] = flight
+            return flight, True
+
+    def _run(self, key, flight, func):
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def do(self, key, func):
+        flight, leader = self._join(key)
+
+        if leader:
+            return self._run(key, flight, func)
+
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    # Run the call in a background thread unless a call of the same key is already in flight
+    def do_in_background(self, key, func):
+        flight, leader = self._join(key)
+
+        if leader:
+            threading.Thread(target=self._run_quietly, args=(key, flight, func), daemon=True).start()
+
+    def _run_quietly(self, key, flight, func):
+        try:
+            self._run(key, flight, func)
+        except Exception:
+            logger.exception(f"Failed to refresh the cache entry {key} in the background")
+
+
+# Cached value with its own expiry
+# The value is fresh until `expires_at`, then can be served stale until `stale_until`
+# while it's being refreshed in the background
+CacheEntry = namedtuple('CacheEntry', ['value', 'expires_at', 'stale_until'])
+
+
+# Same as cachetools.cached() but the cache misses are coalesced with SingleFlight
+# so concurrent threads missing the same key result in a single call of the function
+# The optional lock guards the cache access, required for the non-thread-safe cachetools caches
+# The optional `expiry(value)` returns (ttl, stale_ttl) in seconds for the value returned by the function:
+#   - ttl 0 means not to cache the value, None means to leave the expiry to the cache backend
+#   - stale_ttl is how long after the ttl the value is still served (stale-while-revalidate)
+#     while a single background call refreshes it
+# With a name, the lookups are counted as hubmap_auth_cache_hits_total/misses_total{cache=name},
+# a stale value served counts as a hit
+def cached_single_flight(cache, key=hashkey, lock=None, expiry=None, name=None):
+    lock = lock or threading.RLock()
+
+    def decorator(func):
+        flights = SingleFlight()
+
+        def cache_get(k):
+            with lock:
+                return cache.get(k)
+
+        def store(k, value):
+            ttl, stale_ttl = expiry(value) if expiry is not None else (None, 0)
+
+            if ttl != 0:
+                expires_at = time.time() + ttl if ttl is not None else math.inf
+
+                with lock:
+                    try:
+                        cache[k] = CacheEntry(value, expires_at, expires_at + stale_ttl)
+                    except ValueError:
+                        # Value too large
+                        pass
+
+        def fill(k, args, kwargs):
+            # Another flight may have refreshed the cache right before this one started
+            entry = cache_get(k)
+            if entry is not None and entry.expires_at > time.time():
+                return entry.value
+
+            value = func(*args, **kwargs)
+            store(k, value)
+
+            return value
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            k = key(*args, **kwargs)
+            entry = cache_get(k)
+
+            if entry is not None:
+                now = time.time()
+
+                if now < entry.expires_at:
+                    if name is not None:
+                        record_cache_lookup(name, True)
+                    return entry.value
+
+                # Serve the stale value at once and refresh it in the background
+                # If the refresh fails, the stale value keeps being served until stale_until
+                if now < entry.stale_until:
+                    if name is not None:
+                        record_cache_lookup(name, True)
+                    flights.do_in_background(k, lambda: fill(k, args, kwargs))
+                    return entry.value
+
+            if name is not None:
+                record_cache_lookup(name, False)
+
+            return flights.do(k, lambda: fill(k, args, kwargs))
+
+        # Access to the cache without calling the function, for the callers computing the value
+        # in another way, e.g., with an async HTTP client
+        # cache_entry() returns the CacheEntry of the arguments or None, cache_store() caches the value with its expiry
+        wrapper.cache_entry = lambda *args, **kwargs: cache_get(key(*args, **kwargs))
+        wrapper.cache_store = lambda value, *args, **kwargs: store(key(*args, **kwargs), value)
+        wrapper.flights = flights
+        return wrapper
+
+    return decorator
+
+
+# Create the gateway cache based on the configured backend
+# Fall back to the per-process TTLCache when the uWSGI cache is not available,
+# e.g., running the Flask development server or the tests
+# The name is the `cache` label of its metrics, the evictions of the shared uWSGI cache
+# happen in the master process and are not counted
+def create_cache(backend, maxsize, ttl, uwsgi_cache_name=None, name='gateway'):
+    if backend == CACHE_BACKEND_UWSGI:
+        if uwsgi is not None and uwsgi_cache_name:
+            logger.info(f"Using the shared uWSGI cache '{uwsgi_cache_name}' as the gateway cache")
+            return UwsgiCache(uwsgi_cache_name, ttl)
+
+        logger.warning("The uWSGI cache is not available, fall back to the per-process cache")
+    elif backend != CACHE_BACKEND_LOCAL:
+        logger.warning(f"Unknown CACHE_BACKEND '{backend}', fall back to the per-process cache")
+
+    return MeteredTTLCache(maxsize=maxsize, ttl=ttl, name=name)
+
+
+# Register a handler to be run in every worker process by broadcast_worker_clear()
+# Used to clear the per-process state derived from the shared cache
+def register_worker_clear(handler):
+    _worker_clear_handlers.append(handler)
+
+    if uwsgi is not None and len(_worker_clear_handlers) == 1:
+        uwsgi.register_signal(WORKER_CLEAR_SIGNAL, 'workers', _run_worker_clear_handlers)
+
+
+# Run the registered clear handlers in all the worker processes
+# Without uWSGI there is only the current process to clear
+def broadcast_worker_clear():
+    if uwsgi is not None:
+        uwsgi.signal(WORKER_CLEAR_SIGNAL)
+    else:
+        _run_worker_clear_handlers()
+
+
+def _run_worker_clear_handlers(signum=None):
+    # One failing handler must not prevent the others from running
+    for handler in _worker_clear_handlers:
+        try:
+            handler()
+        except Exception:
+            logger.exception(f"Failed to run the worker clear handler {handler}")
+
+
+# Deliver a message to the registered handlers of every worker process, e.g., a targeted cache invalidation
+# The uWSGI signals carry no payload, so the last `log_size` messages are kept in the shared uWSGI cache under `key`
+# and each signaled worker runs the handlers with the messages it has not seen yet
+# A worker that missed some messages (pushed out of the log) runs the worker clear handlers instead
+# Without uWSGI there is only the current process, the handlers run at once
+class WorkerBroadcast:
+    def __init__(self, cache, key, signum=WORKER_BROADCAST_SIGNAL, log_size=64):
+        self.cache = cache
+        self.key = key
+        self.signum = signum
+        self.log_size = log_size
+        self._handlers = []
+        # Time (ns) of the last message seen by this worker, None before the first signal
+        self._seen = None
+        self._lock = threading.Lock()
+
+        if uwsgi is not None:
+            uwsgi.register_signal(signum, 'workers', self._receive)
+
+    def register(self, handler):
+        self._handlers.append(handler)
+
+    # Return False if the message can't reach the other workers: with the per-process cache backend
+    # or a message too big for the uWSGI cache, the caller has to fall back to broadcast_worker_clear()
+    def send(self, message):
+        if uwsgi is None:
+            self._run(message)
+            return True
+
+        if not isinstance(self.cache, UwsgiCache):
+            return False
+
+        # The log is shared by all the workers, serialize the read-modify-write
+        uwsgi.lock()
+        try:
+            log = self.cache.get(self.key) or []
+            self.cache[self.key] = (log + [(time.time_ns(), message)])[-self.log_size:]
+        except ValueError:
+            logger.warning(f"Unable to store the message in the uWSGI cache {self.cache.name}")
+            return False
+        finally:
+            uwsgi.unlock()
+
+        uwsgi.signal(self.signum)
+        return True
+
+    def _receive(self, signum=None):
+        with self._lock:
+            log = self.cache.get(self.key) or []
+            seen = self._seen
+
+            if log:
+                self._seen = max(seen or 0, log[-1][0])
+
+        # The messages older than the first one of a full log are gone
+        if seen is not None and len(log) == self.log_size and log[0][0] > seen:
+            logger.warning("Missed some worker broadcast messages, clear the worker caches instead")
+            _run_worker_clear_handlers()
+            return
+
+        for sent_at, message in log:
+            if seen is None or sent_at > seen:
+                self._run(message)
+
+    def _run(self, message):
+        # One failing handler must not prevent the others from running
+        for handler in self._handlers:
+            try:
+                handler(message)
+            except Exception:
+                logger.exception(f"Failed to run the worker broadcast handler {handler}")
+
+
+# Run the handler in the uWSGI worker processes once forked, e.g., to start a background thread
+# since the threads started in the master process before the fork don't survive
+# With first_worker_only=True, only the worker 1 runs it (and again when it's respawned),
+# e.g., a job filling the shared uWSGI cache for all the workers
+# Without uWSGI (development server, tests) the handler is not run, the caller starts it if needed
+def register_post_fork(handler, first_worker_only=False):
+    if uwsgi is None:
+        return
+
+    _post_fork_handlers.append((handler, first_worker_only))
+
+    # With lazy-apps the app is loaded in each worker after the fork
+    if uwsgi.worker_id() > 0:
+        _run_post_fork_handler(handler, first_worker_only)
+    else:
+        uwsgi.post_fork_hook = _run_post_fork_handlers
+
+
+def _run_post_fork_handlers():
+    for handler, first_worker_only in _post_fork_handlers:
+        _run_post_fork_handler(handler, first_worker_only)
+
+
+def _run_post_fork_handler(handler, first_worker_only):
+    if first_worker_only and uwsgi.worker_id() != 1:
+        return
+
+    try:
+        handler()
+    except Exception:
+        logger.exception(f"Failed to run the post-fork handler {handler}")
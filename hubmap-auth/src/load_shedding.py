@@ -0,0 +1,69 @@
+import threading
+import time
+
+# Reasons of the rejections, the `reason` label of hubmap_auth_requests_rejected_total
+REJECTED_CONCURRENCY = 'concurrency'
+REJECTED_IN_FLIGHT = 'in_flight'
+REJECTED_QUEUE_TIME = 'queue_time'
+
+
+# Seconds the request waited between nginx and the gateway app, from the X-Request-Start header
+# set by nginx as "t=${msec}" (epoch seconds with milliseconds), None if missing or malformed
+def queue_time(header, now=None):
+    if not header:
+        return None
+
+    try:
+        started_at = float(header[2:] if header.startswith('t=') else header)
+    except ValueError:
+        return None
+
+    return max(0.0, (now if now is not None else time.time()) - started_at)
+
+
+# Per-process admission of the requests by route, so the slow or low-priority routes can't take all the threads
+# of the worker process from the latency-critical ones
+# `limits` maps the route to its max requests in flight at the same time (bulkhead)
+# `shedding` maps the route to its load shedding thresholds:
+#   - in_flight: reject when this many requests of any route are already in flight in the worker process
+#   - queue_time: reject when the request waited this many seconds before reaching the gateway app
+# A low-priority route gets lower thresholds than a high-priority one so it's shed first,
+# the routes not listed are never rejected
+class RouteGuard:
+    def __init__(self, limits, shedding):
+        self.limits = limits
+        self.shedding = shedding
+        self._in_flight = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    # Admit the request of the route, return None if admitted (leave() must then be called once done),
+    # otherwise the reason of the rejection
+    def enter(self, route, waited=None):
+        thresholds = self.shedding.get(route, {})
+
+        if waited is not None and thresholds.get('queue_time') and waited >= thresholds['queue_time']:
+            return REJECTED_QUEUE_TIME
+
+        with self._lock:
+            limit = self.limits.get(route)
+            if limit and self._in_flight.get(route, 0) >= limit:
+                return REJECTED_CONCURRENCY
+
+            if thresholds.get('in_flight') and self._total >= thresholds['in_flight']:
+                return REJECTED_IN_FLIGHT
+
+            self._in_flight[route] = self._in_flight.get(route, 0) + 1
+            self._total += 1
+
+        return None
+
+    def leave(self, route):
+        with self._lock:
+            self._in_flight[route] -= 1
+            self._total -= 1
+
+    # Requests in flight by route
+    def in_flight(self):
+        with self._lock:
+            return {route: count for route, count in self._in_flight.items() if count}
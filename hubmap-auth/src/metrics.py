@@ -0,0 +1,117 @@
+import atexit
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# The `uwsgi` module is only importable when running under the uWSGI server
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+# Prometheus metrics of the gateway exposed by /metrics
+# With PROMETHEUS_MULTIPROC_DIR set in the environment (see start.sh), each uWSGI worker process writes
+# its values into memory-mapped files of that directory and /metrics sums up the files of all the processes,
+# so the values are the same whichever worker serves the scrape and survive the worker recycling
+# Without it, e.g., the Flask development server or the tests, the values are the ones of the current process
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Label value of the authorities not known by the gateway, keeps the label cardinality bounded
+OTHER_AUTHORITY = 'other'
+
+# Label value of the upstream calls raising an exception (connection error, timeout) instead of returning a response
+UPSTREAM_ERROR = 'error'
+
+# In seconds, from the cached decisions (well under a millisecond) up to the upstream timeouts
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# The _count of the histogram is the number of requests
+request_duration = Histogram('hubmap_auth_request_duration_seconds',
+                             "Duration of the gateway requests by route, authority and decision (response status code)",
+                             ['route', 'authority', 'decision'], buckets=LATENCY_BUCKETS)
+
+# Only the live processes are summed up, a recycled worker doesn't leave its last value behind
+requests_in_flight = Gauge('hubmap_auth_requests_in_flight', "Requests being handled by route",
+                           ['route'], multiprocess_mode='livesum')
+
+cache_hits = Counter('hubmap_auth_cache_hits_total', "Cache lookups finding a usable entry", ['cache'])
+cache_misses = Counter('hubmap_auth_cache_misses_total', "Cache lookups finding no usable entry", ['cache'])
+cache_evictions = Counter('hubmap_auth_cache_evictions_total', "Entries evicted to make room in a full per-process cache", ['cache'])
+
+# Requests answered 503 at once by the route concurrency limits (bulkheads) and the load shedding, see load_shedding.py
+requests_rejected = Counter('hubmap_auth_requests_rejected_total', "Requests rejected by route and reason (concurrency, in_flight, queue_time)",
+                            ['route', 'reason'])
+
+# The _count of the histogram is the number of upstream calls
+upstream_duration = Histogram('hubmap_auth_upstream_request_duration_seconds',
+                              "Duration of the upstream calls by upstream and status code ('error' for no response)",
+                              ['upstream', 'status'], buckets=LATENCY_BUCKETS)
+
+# 0 closed, 1 half-open, 2 open, the worst state among the live worker processes, see circuit_breaker.py
+circuit_breaker_state = Gauge('hubmap_auth_circuit_breaker_state', "State of the upstream circuit breaker (0 closed, 1 half-open, 2 open)",
+                              ['upstream'], multiprocess_mode='livemax')
+circuit_breaker_rejections = Counter('hubmap_auth_circuit_breaker_rejections_total',
+                                     "Upstream calls failed at once by an open circuit breaker", ['upstream'])
+
+
+# Values of the last cache warm-up run, see cache_warmer.py
+cache_warmup_duration = Gauge('hubmap_auth_cache_warmup_duration_seconds', "Duration of the last cache warm-up",
+                              multiprocess_mode='mostrecent')
+cache_warmup_uuids = Gauge('hubmap_auth_cache_warmup_uuids', "Uuids of the last cache warm-up by result (cached, fetched, failed)",
+                           ['result'], multiprocess_mode='mostrecent')
+
+
+def observe_request(route, authority, decision, seconds):
+    request_duration.labels(route, authority, str(decision)).observe(seconds)
+
+
+def observe_upstream(upstream, status, seconds):
+    upstream_duration.labels(upstream, str(status)).observe(seconds)
+
+
+def record_rejection(route, reason):
+    requests_rejected.labels(route, reason).inc()
+
+
+def set_circuit_state(upstream, state):
+    circuit_breaker_state.labels(upstream).set(state)
+
+
+def record_circuit_rejection(upstream):
+    circuit_breaker_rejections.labels(upstream).inc()
+
+
+def record_cache_lookup(cache, hit):
+    if hit:
+        cache_hits.labels(cache).inc()
+    else:
+        cache_misses.labels(cache).inc()
+
+
+def record_cache_eviction(cache):
+    cache_evictions.labels(cache).inc()
+
+
+# The metrics in the Prometheus text format, of all the processes in the multiprocess mode
+def exposition():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+
+    return generate_latest(REGISTRY)
+
+
+# Remove the live gauge values (requests in flight) of the process when it exits, e.g., a uWSGI worker
+# recycled by max-requests, the counters and histograms of the dead processes keep being summed up
+def _mark_process_dead():
+    multiprocess.mark_process_dead(os.getpid())
+
+
+if MULTIPROCESS:
+    atexit.register(_mark_process_dead)
+
+    if uwsgi is not None:
+        uwsgi.atexit = _mark_process_dead
@@ -0,0 +1,188 @@
+# Compile api_endpoints.json into nginx map rules answering the /api_auth subrequests of the public endpoints
+# in nginx, so only the endpoints requiring auth (and the unknown ones) reach the uWSGI gateway app,
+# and naming the matched endpoint of each request for the key of the nginx cache of the decisions (auth_cache.conf)
+#
+# The rules are evaluated on the same request headers api_auth() reads (Host, X-Original-Request-Method and
+# X-Original-URI) and with the same precedence as the route index (see route_index.py):
+# nginx checks the map regexes in the order they appear and the first match wins, so the endpoints of each
+# (authority, method) are written as the static ones first, then the wildcard ones, in the json order.
+# The endpoints requiring auth are written too (value 0) where they take precedence over a later public one
+#
+# Usage (from the repository root), e.g., after any change of api_endpoints.prod.json:
+#   python hubmap-auth/src/nginx_rules.py api_endpoints.prod.json nginx/conf.d-prod/api_auth_public.conf
+# With --check, exit with 1 if the existing output file isn't up to date instead of writing it
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+
+from route_index import WILDCARD_DELIMITER, WILDCARD_REGEX_PATTERN
+
+# Variable of the X-Original-URI path without the query string and the leading and trailing slashes
+PATH_VARIABLE = 'hubmap_auth_api_path'
+# Variable set to 1 when the original request targets a public endpoint, 0 otherwise
+PUBLIC_VARIABLE = 'hubmap_auth_public_api'
+# Variable set to "<METHOD> <endpoint>" of the matched endpoint, empty for an unknown one
+ROUTE_VARIABLE = 'hubmap_auth_api_route'
+
+# The characters allowed in the authorities and endpoints written into the double-quoted nginx strings:
+# printable ASCII without whitespaces, double quotes, dollar signs and backslashes which nginx would interpret
+SAFE_PATTERN = re.compile(r'^[!#%-\[\]-~]*$')
+
+
+# The regex of the endpoint path without the leading and trailing slashes, same as RouteIndex.match()
+# One wildcard only matches within one path segment
+def path_regex(endpoint):
+    segments = []
+    for segment in endpoint.strip('/').split('/'):
+        segments.append(WILDCARD_REGEX_PATTERN.join(re.escape(part) for part in segment.split(WILDCARD_DELIMITER)))
+
+    return '/'.join(segments)
+
+
+# The regex of the map key "<authority> <METHOD> <path>" matching the given endpoint
+def endpoint_regex(authority, method, endpoint):
+    for value in (authority, endpoint):
+        if SAFE_PATTERN.match(value) is None:
+            raise ValueError(f"Unsupported character in {value} for the nginx rules")
+
+    return f"^{re.escape(authority)} {method.upper()} {path_regex(endpoint)}$"
+
+
+# The endpoints of one authority in the order nginx must check them: (method, static items, wildcard items)
+# The static endpoints first, then the wildcard ones, in the json order, and the first definition of a duplicated
+# static endpoint only as the route index does
+def ordered_endpoints(items):
+    static = {}
+    wildcard = {}
+
+    for item in items:
+        method = item['method'].upper()
+
+        if WILDCARD_DELIMITER in item['endpoint']:
+            wildcard.setdefault(method, []).append(item)
+        else:
+            static.setdefault(method, {}).setdefault(item['endpoint'].strip('/'), item)
+
+    return [(method, list(static.get(method, {}).values()), wildcard.get(method, [])) for method in dict.fromkeys(list(static) + list(wildcard))]
+
+
+# The (regex, public) rules of one authority in the order to write them
+def authority_rules(authority, items):
+    rules = []
+
+    for method, method_static, method_wildcard in ordered_endpoints(items):
+        public_wildcard = [re.compile(path_regex(item['endpoint'])) for item in method_wildcard if not item['auth']]
+
+        for item in method_static:
+            # A static endpoint requiring auth only matters when it hides a public wildcard one
+            if not item['auth'] or any(regex.fullmatch(item['endpoint'].strip('/')) for regex in public_wildcard):
+                rules.append((endpoint_regex(authority, method, item['endpoint']), not item['auth']))
+
+        # The wildcard endpoints requiring auth after the last public one fall to the default anyway
+        last_public = max((index for index, item in enumerate(method_wildcard) if not item['auth']), default=-1)
+        for item in method_wildcard[:last_public + 1]:
+            rules.append((endpoint_regex(authority, method, item['endpoint']), not item['auth']))
+
+    return rules
+
+
+# The (regex, route) rules of one authority in the order to write them, the route is "<METHOD> <endpoint>"
+def authority_routes(authority, items):
+    routes = []
+
+    for method, method_static, method_wildcard in ordered_endpoints(items):
+        for item in method_static + method_wildcard:
+            routes.append((endpoint_regex(authority, method, item['endpoint']), f"{method} {item['endpoint']}"))
+
+    return routes
+
+
+# The nginx configuration (http context) of the public endpoints of the parsed api_endpoints.json
+# `source` is the name of the endpoints file and `version` the SHA-256 of its content, written in the header
+def generate_nginx_rules(endpoints_data, source, version):
+    lines = [
+        f"# Generated from {source} (sha256 {version}) by hubmap-auth/src/nginx_rules.py, do not edit",
+        "# Regenerate and reload nginx whenever the endpoints file changes, see hubmap-auth/README.md",
+        "",
+        "# X-Original-URI path without the query string and the leading and trailing slashes",
+        "# Without X-Original-URI, \"?\" never matches any endpoint",
+        f"map $http_x_original_uri ${PATH_VARIABLE} {{",
+        "    \"\" \"?\";",
+        f"    \"~^/*(?<{PATH_VARIABLE}_match>[^?]*?)/*(?:\\?.*)?$\" ${PATH_VARIABLE}_match;",
+        "}",
+        "",
+        "# 1 for the public endpoints, answered with 200 by the /api_auth locations without calling the gateway app",
+        f"map \"$http_host $http_x_original_request_method ${PATH_VARIABLE}\" ${PUBLIC_VARIABLE} {{",
+        "    default 0;",
+    ]
+
+    for authority, items in endpoints_data.items():
+        rules = authority_rules(authority, items)
+
+        if not rules:
+            continue
+
+        lines.append("")
+        lines.append(f"    # {authority}")
+        for regex, public in rules:
+            lines.append(f"    \"~{regex}\" {int(public)};")
+
+    lines += [
+        "}",
+        "",
+        "# The endpoint matched by /api_auth, the decision only depends on it and the token",
+        "# Only evaluated for the cache key of the requests not answered by the public endpoint rules",
+        f"map \"$http_host $http_x_original_request_method ${PATH_VARIABLE}\" ${ROUTE_VARIABLE} {{",
+        "    default \"\";",
+    ]
+
+    for authority, items in endpoints_data.items():
+        lines.append("")
+        lines.append(f"    # {authority}")
+        for regex, route in authority_routes(authority, items):
+            lines.append(f"    \"~{regex}\" \"{route}\";")
+
+    lines.append("}")
+    lines.append("")
+
+    return "\n".join(lines)
+
+
+# The nginx rules of the given endpoints file
+def generate_nginx_rules_file(endpoints_file):
+    with open(endpoints_file, 'rb') as f:
+        content = f.read()
+
+    return generate_nginx_rules(json.loads(content), os.path.basename(endpoints_file), hashlib.sha256(content).hexdigest())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the nginx rules of the public endpoints of api_endpoints.json")
+    parser.add_argument('endpoints_file')
+    parser.add_argument('output_file')
+    parser.add_argument('--check', action='store_true', help="Exit with 1 if the output file isn't up to date")
+    args = parser.parse_args()
+
+    rules = generate_nginx_rules_file(args.endpoints_file)
+
+    if args.check:
+        try:
+            with open(args.output_file) as f:
+                up_to_date = f.read() == rules
+        except FileNotFoundError:
+            up_to_date = False
+
+        if not up_to_date:
+            print(f"{args.output_file} is not up to date with {args.endpoints_file}")
+            sys.exit(1)
+        return
+
+    with open(args.output_file, 'w') as f:
+        f.write(rules)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import re
+
+
+# The wildcard delimiter used in the api_endpoints.json
+WILDCARD_DELIMITER = "<*>"
+
+# The regular expression pattern takes any alphabetical and numerical characters,
+# % used in URL encoding, and other characters permitted in the URI
+# Note: "/" is not part of the pattern so one wildcard only matches one path segment
+WILDCARD_REGEX_PATTERN = r"[a-zA-Z0-9_.:%#@!&=+*-]+"
+
+
+# A node of the segment trie used for the wildcard endpoints
+# `static` maps a literal path segment to the child node
+# `dynamic` is a list of (compiled segment regex, child node) for segments containing the wildcard
+# `item` and `order` are set only when an endpoint ends at this node, `order` is the position
+# of the endpoint within the authority section of the json so the first defined one wins
+class _TrieNode:
+    __slots__ = ('static', 'dynamic', 'item', 'order')
+
+    def __init__(self):
+        self.static = {}
+        self.dynamic = []
+        self.item = None
+        self.order = None
+
+
+# Precompiled lookup structure built once from the parsed api_endpoints.json
+# The lookup key is (authority, HTTP method in upper case), and each key has
+#   - an exact match hash table for the endpoints without wildcard
+#   - a segment trie for the endpoints with wildcard
+# The precedence stays the same as the original two-pass linear scan:
+# first the static endpoints, then the wildcard ones, and within each group
+# the endpoint defined first in the json file wins
+class RouteIndex:
+    def __init__(self, endpoints_data):
+        self.authorities = frozenset(endpoints_data)
+        self._static = {}
+        self._wildcard = {}
+        # Cache the compiled segment regex so the same segment pattern only gets compiled once
+        segment_regexes = {}
+
+        for authority, items in endpoints_data.items():
+            for order, item in enumerate(items):
+                key = (authority, item['method'].upper())
+                endpoint = item['endpoint']
+
+                # Remove leading and trailing slash for comparison
+                if WILDCARD_DELIMITER not in endpoint:
+                    # Keep the first definition in case of duplicates
+                    self._static.setdefault(key, {}).setdefault(endpoint.strip('/'), item)
+                    continue
+
+                node = self._wildcard.setdefault(key, _TrieNode())
+
+                for segment in endpoint.strip('/').split('/'):
+                    if WILDCARD_DELIMITER in segment:
+                        if segment not in segment_regexes:
+                            segment_regexes[segment] = re.compile(segment.replace(WILDCARD_DELIMITER, WILDCARD_REGEX_PATTERN))
+
+                        segment_regex = segment_regexes[segment]
+                        child = None
+
+                        for existing_regex, existing_child in node.dynamic:
+                            if existing_regex is segment_regex:
+                                child = existing_child
+                                break
+
+                        if child is None:
+                            child = _TrieNode()
+                            node.dynamic.append((segment_regex, child))
+
+                        node = child
+                    else:
+                        node = node.static.setdefault(segment, _TrieNode())
+
+                if node.item is None:
+                    node.item = item
+                    node.order = order
+
+    # Return the matched endpoint item dict of the given authority, method, and endpoint (may contain query string)
+    # Return None if no match found
+    def match(self, authority, method, endpoint):
+        key = (authority, method.upper())
+        # Ignore the query string and remove leading and trailing slash for comparison
+        target_endpoint = endpoint.split("?")[0].strip('/')
+
+        static_table = self._static.get(key)
+        if static_table is not None:
+            item = static_table.get(target_endpoint)
+            if item is not None:
+                return item
+
+        root = self._wildcard.get(key)
+        if root is None:
+            return None
+
+        return self._match_wildcard(root, target_endpoint.split('/'))
+
+    # Walk the trie and return the matched item with the lowest order
+    # Both the static and the dynamic children need to be explored since the wildcard endpoint
+    # defined first in the json has the precedence over a more specific one defined later
+    @staticmethod
+    def _match_wildcard(root, segments):
+        best = None
+        last_index = len(segments)
+        stack = [(root, 0)]
+
+        while stack:
+            node, index = stack.pop()
+
+            if index == last_index:
+                if node.item is not None and (best is None or node.order < best.order):
+                    best = node
+                continue
+
+            segment = segments[index]
+
+            child = node.static.get(segment)
+            if child is not None:
+                stack.append((child, index + 1))
+
+            for segment_regex, child in node.dynamic:
+                if segment_regex.fullmatch(segment) is not None:
+                    stack.append((child, index + 1))
+
+        return best.item if best is not None else None
@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Background poller that refreshes a snapshot of the status data on an interval
+# so the status endpoint can return the last snapshot instantly
+# The snapshot is also stored in the given cache, with the shared uWSGI cache backend
+# a worker reuses the fresh snapshot polled by another worker instead of probing all the services again
+# `cache_lock` guards the cache shared with the request threads (cachetools caches aren't thread-safe)
+class StatusPoller:
+    def __init__(self, collect, interval, cache, cache_lock=None, cache_key='status_snapshot'):
+        # Callable returning the status data dict
+        self.collect = collect
+        self.interval = interval
+        self.cache = cache
+        self.cache_lock = cache_lock if cache_lock is not None else threading.RLock()
+        self.cache_key = cache_key
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Start the polling thread if not started yet
+    # Must be called in the uWSGI worker process, threads started before the fork don't survive
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='status-poller', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # Return the last snapshot, poll synchronously if there is no snapshot yet
+    def snapshot(self):
+        polled_at, status_data = self._latest()
+
+        if status_data is None:
+            polled_at, status_data = self.refresh()
+
+        return status_data
+
+    # Poll the services unless another worker has polled within the interval
+    def refresh(self):
+        polled_at, status_data = self._latest()
+
+        if status_data is None or time.time() - polled_at >= self.interval:
+            polled_at = time.time()
+            status_data = self.collect()
+            self._snapshot = (polled_at, status_data)
+
+            try:
+                with self.cache_lock:
+                    self.cache[self.cache_key] = self._snapshot
+            except ValueError:
+                # Too big for the cache, just keep the local snapshot
+                pass
+
+        return polled_at, status_data
+
+    # The more recent snapshot between the local one and the cached one
+    def _latest(self):
+        latest = self._snapshot or (0, None)
+        with self.cache_lock:
+            cached = self.cache.get(self.cache_key)
+
+        if cached is not None and cached[0] > latest[0]:
+            latest = cached
+            self._snapshot = cached
+
+        return latest
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the status snapshot")
+
+            self._stop.wait(self.interval)
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from flask import Response
+from hubmap_commons.exceptions import HTTPException
+
+from gateway_cache import evict_by_prefix
+from metrics import observe_upstream, record_cache_lookup, UPSTREAM_ERROR
+from upstream import remaining_budget, result_within_budget
+
+logger = logging.getLogger(__name__)
+
+# Kinds of cached token lookups, each AuthHelper call has its own entry so the cached
+# result is exactly what the corresponding AuthHelper call would return
+LOOKUP_USER = 'user'
+LOOKUP_USER_WITH_GROUPS = 'user_with_groups'
+LOOKUP_DATA_ACCESS_LEVEL = 'data_access_level'
+
+# Upstream name of the AuthHelper calls (Globus token introspection and group lookup) in the metrics
+UPSTREAM_GLOBUS = 'globus'
+
+# Cached result of a token lookup
+# `valid` is False for the negative entries of failed validations
+# `group_ids` is a tuple of the user's group uuids, None when the groups were not requested
+# `data_access_level` is the highest data access level of the user, None when not requested
+# `expires_at` is the epoch time this entry expires, capped by the token expiry
+TokenInfo = namedtuple('TokenInfo', ['valid', 'group_ids', 'data_access_level', 'expires_at'])
+
+
+# Raised when Globus fails to validate the token (a 5xx response of AuthHelper), an error rather than
+# a decision on the token, so it's never cached and the auth requests answer 500 as for the other upstream errors
+class GlobusError(requests.exceptions.RequestException):
+    pass
+
+
+# Due to Flask's EnvironHeaders is immutable
+# We create a new class with the headers property 
+# so AuthHelper can access it using the dot notation req.headers
+class CustomRequest:
+    # Constructor
+    def __init__(self, headers):
+        self.headers = headers
+
+
+# Gateway level cache of the Globus token introspection and group lookup done by AuthHelper
+# The key is the SHA-256 hash of the token(s) found in the Authorization/Mauthorization header,
+# the raw token is never stored
+# The positive entries live up to `ttl` seconds but no longer than the token expiry,
+# the invalid tokens (401) are cached for `negative_ttl` seconds, the Globus errors are never cached
+# The AuthHelper calls go through the optional circuit breaker of Globus, and within the deadline of the
+# current request (see upstream.deadline_budget()) they run on the optional executor so the request stops
+# waiting at the deadline, AuthHelper has no timeout of its own
+class TokenCache:
+    def __init__(self, auth_helper, cache, ttl, negative_ttl, breaker=None, executor=None):
+        self.auth_helper = auth_helper
+        self.cache = cache
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.breaker = breaker
+        self.executor = executor
+        # cachetools caches are not thread-safe
+        self._lock = threading.Lock()
+
+    # Hash of the token(s) parsed from the request headers, None if no valid Authorization header
+    def _token_hash(self, headers):
+        tokens = self.auth_helper.getAuthorizationTokens(headers)
+
+        if isinstance(tokens, Response):
+            return None
+
+        # Mauthorization header contains a dict of multiple tokens
+        if isinstance(tokens, dict):
+            tokens = json.dumps(tokens, sort_keys=True)
+
+        return hashlib.sha256(tokens.encode('utf-8')).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            token_info = self.cache.get(key)
+
+        if token_info is not None and token_info.expires_at > time.time():
+            record_cache_lookup('token', True)
+            return token_info
+
+        record_cache_lookup('token', False)
+        return None
+
+    def _set(self, key, token_info):
+        with self._lock:
+            try:
+                self.cache[key] = token_info
+            except ValueError:
+                # Too big for the cache, just skip
+                pass
+
+    # Positive entry expiring at the token expiry (the `exp` of the introspection) or after ttl
+    def _positive(self, user_info, group_ids=None, data_access_level=None):
+        expires_at = time.time() + self.ttl
+
+        if isinstance(user_info.get('exp'), (int, float)):
+            expires_at = min(expires_at, user_info['exp'])
+
+        return TokenInfo(valid=True, group_ids=group_ids, data_access_level=data_access_level, expires_at=expires_at)
+
+    def _negative(self):
+        return TokenInfo(valid=False, group_ids=None, data_access_level=None, expires_at=time.time() + self.negative_ttl)
+
+    # Call the AuthHelper method with the request, raise CircuitOpen when the Globus circuit breaker is open
+    # or DeadlineExceeded when the current request runs out of time
+    # An exception other than the HTTPException of an invalid token, or a 5xx Response, counts as a Globus failure
+    def _call_auth_helper(self, method, request, *args):
+        if self.breaker is not None:
+            self.breaker.acquire()
+
+        failed = True
+
+        try:
+            if self.executor is not None and remaining_budget() is not None:
+                # The Flask request proxy isn't bound on the executor thread, AuthHelper only reads the headers
+                result = result_within_budget(self.executor.submit(method, CustomRequest(dict(request.headers)), *args))
+            else:
+                result = method(request, *args)
+
+            failed = isinstance(result, Response) and result.status_code >= 500
+            return result
+        except HTTPException:
+            failed = False
+            raise
+        finally:
+            if self.breaker is not None:
+                self.breaker.release(failed)
+
+    # Evict all the token lookups, the cache may be shared with other data
+    # Return the evicted keys, or None if the keys of the uWSGI cache can't be listed, see evict_by_prefix()
+    def clear(self):
+        return evict_by_prefix(self.cache, ['token|'], self._lock)
+
+    # Cached version of AuthHelper.getUserInfoUsingRequest()
+    # Return a TokenInfo with group_ids set when group_required is True, or None if the token is invalid
+    def get_user_info(self, request, group_required):
+        token_hash = self._token_hash(request.headers)
+
+        # Invalid or missing Authorization header, nothing to introspect
+        if token_hash is None:
+            return None
+
+        key = ('token', LOOKUP_USER_WITH_GROUPS if group_required else LOOKUP_USER, token_hash)
+        token_info = self._get(key)
+
+        if token_info is None:
+            start = time.perf_counter()
+            status = UPSTREAM_ERROR
+
+            try:
+                user_info = self._call_auth_helper(self.auth_helper.getUserInfoUsingRequest, request, group_required)
+                status = user_info.status_code if isinstance(user_info, Response) else 200
+            finally:
+                observe_upstream(UPSTREAM_GLOBUS, status, time.perf_counter() - start)
+
+            if isinstance(user_info, Response):
+                if user_info.status_code >= 500:
+                    raise GlobusError(f"Unable to validate the token: {user_info.status_code} {user_info.get_data(as_text=True)}")
+
+                # e.g., a Mauthorization header without the groups token, nothing Globus said about the token
+                if user_info.status_code != 401:
+                    return None
+
+                token_info = self._negative()
+            else:
+                group_ids = tuple(user_info['hmgroupids']) if group_required else None
+                token_info = self._positive(user_info, group_ids=group_ids)
+
+            self._set(key, token_info)
+
+        return token_info if token_info.valid else None
+
+    # AuthHelper.getUserDataAccessLevel() returning the 5xx response of a Globus error instead of its HTTPException 401
+    # The introspection result of the token is cached by AuthHelper, so telling them apart doesn't call Globus again
+    def _user_data_access_level(self, request):
+        try:
+            return self.auth_helper.getUserDataAccessLevel(request)
+        except HTTPException:
+            user_info = self.auth_helper.getUserInfoUsingRequest(request, False)
+
+            if isinstance(user_info, Response) and user_info.status_code >= 500:
+                return user_info
+
+            raise
+
+    # Cached version of AuthHelper.getUserDataAccessLevel()
+    # Return the user's highest data access level
+    # Raise HTTPException with 401 if the token is invalid, same as AuthHelper.getUserDataAccessLevel(),
+    # or GlobusError if Globus fails
+    def get_user_data_access_level(self, request):
+        token_hash = self._token_hash(request.headers)
+
+        # No token to cache, AuthHelper handles the missing or invalid header
+        if token_hash is None:
+            return self.auth_helper.getUserDataAccessLevel(request)['data_access_level']
+
+        key = ('token', LOOKUP_DATA_ACCESS_LEVEL, token_hash)
+        token_info = self._get(key)
+
+        if token_info is None:
+            start = time.perf_counter()
+            status = UPSTREAM_ERROR
+
+            try:
+                user_info = self._call_auth_helper(self._user_data_access_level, request)
+
+                if isinstance(user_info, Response):
+                    status = user_info.status_code
+                    raise GlobusError(f"Unable to validate the token: {user_info.status_code} {user_info.get_data(as_text=True)}")
+
+                status = 200
+                token_info = self._positive(user_info, data_access_level=user_info['data_access_level'])
+            except HTTPException as e:
+                status = e.get_status_code()
+                if status == 401:
+                    self._set(key, self._negative())
+                raise
+            finally:
+                observe_upstream(UPSTREAM_GLOBUS, status, time.perf_counter() - start)
+
+            self._set(key, token_info)
+
+        if not token_info.valid:
+            raise HTTPException("No valid authorization token found.", 401)
+
+        return token_info.data_access_level
@@ -0,0 +1,253 @@
+import concurrent.futures
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from circuit_breaker import CircuitBreaker, CIRCUIT_STATE_NAMES
+from metrics import observe_upstream, UPSTREAM_ERROR
+
+logger = logging.getLogger(__name__)
+
+# Name of the policy used for the upstream hosts without their own policy
+DEFAULT_POLICY = 'default'
+
+# Used when no policy is configured at all
+DEFAULT_POLICY_SETTINGS = {
+    'connect_timeout': 3,
+    'read_timeout': 10,
+    'retries': 0,
+    'backoff_factor': 0,
+    'failure_threshold': 5,
+    'open_timeout': 30,
+    'half_open_requests': 1
+}
+
+# time.monotonic() deadline of the upstream calls made for the current request, None for no deadline
+# Set by deadline_budget() and shared by all the chained lookups of the request
+request_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+# Raised when the current request has no time left for an upstream call or for waiting on its result
+# A requests Timeout so the callers handle it like an upstream timeout
+class DeadlineExceeded(requests.exceptions.Timeout):
+    pass
+
+
+# Give the upstream calls made within the block `seconds` in total, None or 0 for no deadline
+# A nested budget can't extend the deadline already set
+@contextmanager
+def deadline_budget(seconds):
+    deadline = request_deadline.get()
+
+    if seconds:
+        deadline = min(deadline, time.monotonic() + seconds) if deadline is not None else time.monotonic() + seconds
+
+    context_token = request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        request_deadline.reset(context_token)
+
+
+# Seconds left before the deadline of the current request (0 when passed), None without deadline
+def remaining_budget():
+    deadline = request_deadline.get()
+
+    if deadline is None:
+        return None
+
+    return max(0, deadline - time.monotonic())
+
+
+# The result of the future waited on until the deadline of the current request at most
+# The future keeps running in its thread, only the caller stops waiting
+def result_within_budget(future):
+    try:
+        return future.result(timeout=remaining_budget())
+    except concurrent.futures.TimeoutError:
+        raise DeadlineExceeded("No upstream result within the deadline of the request")
+
+
+# Same as concurrent.futures.as_completed() of the futures until the deadline of the current request at most
+def completed_within_budget(futures):
+    try:
+        yield from concurrent.futures.as_completed(futures, timeout=remaining_budget())
+    except concurrent.futures.TimeoutError:
+        raise DeadlineExceeded("No upstream result within the deadline of the request")
+
+
+# The (connect, read) timeout capped by the time left for the current request
+# Raise DeadlineExceeded if there's no time left at all
+def timeout_within_budget(timeout):
+    remaining = remaining_budget()
+
+    if remaining is None:
+        return timeout
+
+    if remaining <= 0:
+        raise DeadlineExceeded("No time left for an upstream call within the deadline of the request")
+
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return min(connect_timeout, remaining), min(read_timeout, remaining)
+
+
+# Thread-safe HTTP client with one keep-alive connection pool per upstream host
+# Each upstream host gets its own requests.Session so the connections are reused across requests
+# and the pool size, timeouts and retries can be set per upstream
+# `policies` maps the upstream names to the dict of connect_timeout, read_timeout (seconds),
+# retries and backoff_factor (exponential backoff between retries), and the failure_threshold,
+# open_timeout (seconds) and half_open_requests of the circuit breaker (see circuit_breaker.py)
+# `upstream_names` maps the upstream host (netloc) to the upstream name, the hosts not listed use the default policy
+# Each named upstream has its own circuit breaker, the hosts using the default policy get one per host
+class UpstreamClient:
+    def __init__(self, pool_size, policies, upstream_names=None):
+        self.pool_size = pool_size
+        self.policies = policies
+        self.upstream_names = upstream_names or {}
+        self._sessions = {}
+        self._request_counts = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    # Name of the upstream of the given URL used to pick the policy
+    def upstream_name(self, url):
+        return self.upstream_names.get(urlsplit(url).netloc, DEFAULT_POLICY)
+
+    def policy(self, name):
+        return {**DEFAULT_POLICY_SETTINGS, **self.policies.get(DEFAULT_POLICY, {}), **self.policies.get(name, {})}
+
+    # The circuit breaker of the named upstream (or host of the default policy) with the settings of its policy
+    # Also used for the upstreams called by other clients, e.g., 'globus' by the token cache
+    def breaker(self, name):
+        breaker = self._breakers.get(name)
+        if breaker is not None:
+            return breaker
+
+        with self._lock:
+            if name not in self._breakers:
+                policy = self.policy(name)
+                self._breakers[name] = CircuitBreaker(name, policy['failure_threshold'], policy['open_timeout'], policy['half_open_requests'])
+
+            return self._breakers[name]
+
+    # The circuit breaker of the upstream of the given URL
+    def url_breaker(self, url):
+        netloc = urlsplit(url).netloc
+        return self.breaker(self.upstream_names.get(netloc, netloc))
+
+    def _session(self, url):
+        parts = urlsplit(url)
+        pool_key = (parts.scheme, parts.netloc)
+
+        session = self._sessions.get(pool_key)
+        if session is not None:
+            return pool_key, session
+
+        with self._lock:
+            if pool_key not in self._sessions:
+                policy = self.policy(self.upstream_names.get(parts.netloc, DEFAULT_POLICY))
+
+                # Only retry the idempotent GET on connection errors and gateway errors
+                # Read timeouts are not retried (read=False) and get raised as requests ReadTimeout,
+                # retrying a slow upstream only multiplies the wait
+                retry = Retry(total=policy['retries'],
+                              read=False,
+                              backoff_factor=policy['backoff_factor'],
+                              status_forcelist=(502, 503, 504),
+                              allowed_methods=frozenset(['GET', 'HEAD']),
+                              raise_on_status=False)
+
+                # pool_block=False opens extra connections instead of blocking when all are busy,
+                # only pool_maxsize of them are kept alive
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=False, max_retries=retry)
+
+                session = requests.Session()
+                session.mount(f"{parts.scheme}://", adapter)
+                self._sessions[pool_key] = session
+                self._request_counts[pool_key] = 0
+
+                logger.info(f"Created the connection pool for upstream {parts.scheme}://{parts.netloc}")
+
+            return pool_key, self._sessions[pool_key]
+
+    # Same as requests.get() but with the pooled session of the upstream host
+    # The timeout defaults to (connect_timeout, read_timeout) of the upstream policy, capped by the deadline
+    # of the current request if any (see deadline_budget())
+    # Raise CircuitOpen without calling the upstream when its circuit breaker is open, the connection errors,
+    # timeouts and 5xx responses count as failures of the upstream, except the timeouts shortened by the deadline
+    # The call is recorded in the upstream metrics by upstream name and status code, retries included
+    def get(self, url, timeout=None, **kwargs):
+        pool_key, session = self._session(url)
+        upstream_name = self.upstream_name(url)
+        breaker = self.url_breaker(url)
+
+        if timeout is None:
+            policy = self.policy(upstream_name)
+            timeout = (policy['connect_timeout'], policy['read_timeout'])
+
+        budget_timeout = timeout_within_budget(timeout)
+        # A timeout shortened by the deadline of the request says nothing about the upstream
+        capped = budget_timeout is not timeout and budget_timeout != (timeout if isinstance(timeout, tuple) else (timeout, timeout))
+        timeout = budget_timeout
+        breaker.acquire()
+
+        with self._lock:
+            self._request_counts[pool_key] += 1
+
+        start = time.perf_counter()
+        status = UPSTREAM_ERROR
+        failed = None
+
+        try:
+            response = session.get(url, timeout=timeout, **kwargs)
+            status = response.status_code
+            failed = status >= 500
+            return response
+        except requests.exceptions.Timeout:
+            failed = None if capped else True
+            raise
+        except requests.exceptions.RequestException:
+            failed = True
+            raise
+        finally:
+            breaker.release(failed)
+            observe_upstream(upstream_name, status, time.perf_counter() - start)
+
+    # Counters of each upstream connection pool
+    # `requests`: requests sent via this client
+    # `new_connections`: connections opened (pool misses)
+    # `reused_connections`: requests sent on an already open keep-alive connection (pool hits)
+    # `circuit`: state of the circuit breaker of the upstream (closed, half_open or open)
+    def stats(self):
+        stats = {}
+
+        with self._lock:
+            sessions = list(self._sessions.items())
+
+        for (scheme, netloc), session in sessions:
+            new_connections = 0
+            pool_requests = 0
+            pool_manager = session.get_adapter(f"{scheme}://").poolmanager
+
+            for key in pool_manager.pools.keys():
+                pool = pool_manager.pools.get(key)
+                if pool is not None:
+                    new_connections += pool.num_connections
+                    pool_requests += pool.num_requests
+
+            stats[f"{scheme}://{netloc}"] = {
+                'upstream': self.upstream_names.get(netloc, DEFAULT_POLICY),
+                'requests': self._request_counts[(scheme, netloc)],
+                'new_connections': new_connections,
+                'reused_connections': max(pool_requests - new_connections, 0),
+                'circuit': CIRCUIT_STATE_NAMES[self.url_breaker(f"{scheme}://{netloc}").state]
+            }
+
+        return stats
@@ -0,0 +1,83 @@
+import hashlib
+import math
+import re
+import threading
+import time
+
+# HuBMAP uuids (entities, files and AVR) are 32 hex characters, the file uuids start with ffff
+UUID_PATTERN = re.compile(r'^[0-9a-fA-F]{32}$')
+
+
+# Check the uuid format before any upstream request, e.g., to reject the scanners and broken links
+def is_valid_uuid(uuid):
+    return UUID_PATTERN.match(uuid) is not None
+
+
+# Bloom filter forgetting its items over time, e.g., the uuids known not to exist
+# `capacity` items are remembered with about `false_positive_rate` of the other items reported as present
+# The items are added to the current bit array, and every `ttl` seconds (or once `capacity` items were added)
+# the current one becomes the previous one and a new current one starts, the previous one is dropped
+# So an added item is remembered between `ttl` and 2 * `ttl` seconds, and a lookup checks both arrays
+# which doubles the false positive rate, the items can't be removed one by one, only all at once
+class DecayingBloomFilter:
+    def __init__(self, capacity, false_positive_rate, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._current = bytearray((self.size + 7) // 8)
+        self._previous = bytearray((self.size + 7) // 8)
+        self._count = 0
+        self._rotated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Bit positions of the item, by double hashing of one 128-bit digest
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+
+        with self._lock:
+            self._decay()
+
+            if self._count >= self.capacity:
+                self._rotate()
+
+            for position in positions:
+                self._current[position >> 3] |= 1 << (position & 7)
+            self._count += 1
+
+    def __contains__(self, item):
+        positions = self._positions(item)
+
+        with self._lock:
+            self._decay()
+
+            return (all(self._current[position >> 3] & (1 << (position & 7)) for position in positions) or
+                    all(self._previous[position >> 3] & (1 << (position & 7)) for position in positions))
+
+    def clear(self):
+        with self._lock:
+            self._current = bytearray(len(self._current))
+            self._previous = bytearray(len(self._previous))
+            self._count = 0
+            self._rotated_at = time.monotonic()
+
+    def _decay(self):
+        elapsed = time.monotonic() - self._rotated_at
+
+        if elapsed >= 2 * self.ttl:
+            self._current = bytearray(len(self._current))
+            self._rotate()
+        elif elapsed >= self.ttl:
+            self._rotate()
+
+    def _rotate(self):
+        self._previous = self._current
+        self._current = bytearray(len(self._current))
+        self._count = 0
+        self._rotated_at = time.monotonic()
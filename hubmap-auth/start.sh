@@ -4,5 +4,16 @@
 # 'daemon off;' is nginx configuration directive
 nginx -g 'daemon off;' &
 
+# Directory of the Prometheus metrics files written by all the worker processes and summed up by /metrics
+# Emptied at each start so the values of the previous run don't add up
+export PROMETHEUS_MULTIPROC_DIR=/tmp/hubmap-auth-metrics
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Optional async serving mode of the auth endpoints, see README
+# uvicorn listens on port 5001 and nginx passes the auth subrequests to it
+if [ "$SERVING_MODE" = "asgi" ]; then
+    cd /usr/src/app/src && /usr/local/python3.13/bin/uvicorn asgi:application --host 127.0.0.1 --port 5001 --workers ${ASGI_WORKERS:-4} --no-access-log &
+fi
+
 # Start uwsgi and keep it running in foreground
 /usr/local/python3.13/bin/uwsgi --ini /usr/src/app/src/uwsgi.ini
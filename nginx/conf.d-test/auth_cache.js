@@ -0,0 +1,47 @@
+// Keys of the nginx cache of the /api_auth and /file_auth decisions, imported by auth_cache.conf
+// nginx writes the cache keys as is into the cache files, so the tokens only go into them as a SHA-256 digest
+var crypto = require('crypto');
+
+function sha256(values) {
+    return crypto.createHash('sha256').update(JSON.stringify(values)).digest('hex');
+}
+
+function header(r, name) {
+    return r.headersIn[name] || '';
+}
+
+// The query parameters of $hubmap_auth_file_query, split as the gateway app does (on `&`)
+// A parameter is taken as a token when its decoded name contains "token" (the gateway app only uses "token",
+// but e.g. "b?token" may still carry one), or when it can't be decoded
+function isToken(param) {
+    var name = param.split('=')[0].replace(/\+/g, ' ');
+
+    try {
+        return /token/i.test(decodeURIComponent(name));
+    } catch (e) {
+        return true;
+    }
+}
+
+function queryParams(r) {
+    var query = r.variables.hubmap_auth_file_query;
+    return query ? query.split('&') : [];
+}
+
+// $hubmap_auth_token_hash: digest of the Authorization and Mauthorization headers
+function tokenHash(r) {
+    return sha256([header(r, 'Authorization'), header(r, 'Mauthorization')]);
+}
+
+// $hubmap_auth_file_token_hash: digest of the headers and of the token parameters of the query in their order,
+// the gateway app uses the first one
+function fileTokenHash(r) {
+    return sha256([header(r, 'Authorization'), header(r, 'Mauthorization'), queryParams(r).filter(isToken)]);
+}
+
+// $hubmap_auth_file_params: $hubmap_auth_file_query without the token parameters
+function fileParams(r) {
+    return queryParams(r).filter(function (param) { return !isToken(param); }).join('&');
+}
+
+export default {tokenHash: tokenHash, fileTokenHash: fileTokenHash, fileParams: fileParams};
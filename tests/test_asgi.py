@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import app
+import asgi
+from gateway_cache import UpstreamResult
+
+FILE_UUID = 'ffff1b2c3d4e5f6a7b8c9d0e1f2a3b4c'
+DATASET_UUID = 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6'
+
+
+class EntityHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    calls = []
+
+    def do_GET(self):
+        self.calls.append(self.path)
+        time.sleep(0.2)
+        body = b'{"entity_type": "Dataset", "data_access_level": "public", "status": "Published"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def entity_api():
+    EntityHandler.calls = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EntityHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    app.cache.clear()
+    app.file_access_decision_cache.clear()
+    app.entity_index.clear()
+    app.unknown_uuid_filter.clear()
+    yield
+    app.cache.clear()
+    app.file_access_decision_cache.clear()
+    app.entity_index.clear()
+    app.unknown_uuid_filter.clear()
+
+
+# Call the ASGI application and return (status code, body)
+async def call(path, headers):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+    }
+    await asgi.application(scope, receive, send)
+
+    return messages[0]['status'], messages[1]['body']
+
+
+def test_file_auth_fetches_what_the_decision_needs():
+    upstream_results = {
+        f"{app.app.config['UUID_API_URL']}/file-id/{FILE_UUID}": UpstreamResult(200, DATASET_UUID, None, None, None, None, None),
+        f"{app.app.config['UUID_API_URL']}/hmuuid/{DATASET_UUID}": UpstreamResult(200, None, 'DATASET', None, None, None, None),
+        f"{app.app.config['ENTITY_API_URL']}/entities/{DATASET_UUID}": UpstreamResult(200, None, None, 'Dataset', 'protected', 'Published', None)
+    }
+    fetched = []
+
+    async def result(url):
+        fetched.append(url)
+        return upstream_results[url]
+
+    headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{FILE_UUID}/thumbnail.jpg"}
+
+    with patch.object(asgi.upstreams, 'result', side_effect=result):
+        status_code, body = asyncio.run(call('/file_auth', headers))
+
+    # Thumbnail of a published dataset is public
+    # The parent dataset is looked up in uuid-api and entity-api together, after the file
+    assert status_code == 200
+    assert fetched[0] == f"{app.app.config['UUID_API_URL']}/file-id/{FILE_UUID}"
+    assert sorted(fetched[1:]) == sorted(list(upstream_results)[1:])
+    assert app.file_access_decision_cache[(FILE_UUID, app.ACCESS_TIER_ANONYMOUS)] == 200
+
+
+def test_file_auth_upstream_error():
+    async def result(url):
+        raise app.requests.exceptions.ConnectionError("uuid-api is down")
+
+    headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{DATASET_UUID}/data.tsv"}
+
+    with patch.object(asgi.upstreams, 'result', side_effect=result):
+        status_code, body = asyncio.run(call('/file_auth', headers))
+
+    assert status_code == 500
+
+
+def test_file_auth_deadline():
+    async def result(url):
+        await asyncio.sleep(1)
+
+    headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{DATASET_UUID}/data.tsv"}
+
+    start = time.perf_counter()
+    with patch.object(asgi.upstreams, 'result', side_effect=result), patch.object(app, 'auth_request_deadline', 0.2):
+        status_code, body = asyncio.run(call('/file_auth', headers))
+
+    assert status_code == 500
+    assert time.perf_counter() - start < 0.8
+
+
+def test_file_auth_unknown_uuid():
+    fetched = []
+
+    async def result(url):
+        fetched.append(url)
+        return UpstreamResult(404, None, None, None, None, None, 'Not found')
+
+    async def file_auth(uuid):
+        headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{uuid}/data.tsv"}
+        return (await call('/file_auth', headers))[0]
+
+    with patch.object(asgi.upstreams, 'result', side_effect=result):
+        assert asyncio.run(file_auth('.env')) == 404
+        assert fetched == []
+
+        assert asyncio.run(file_auth(DATASET_UUID)) == 404
+        fetched.clear()
+        assert asyncio.run(file_auth(DATASET_UUID)) == 404
+        assert fetched == []
+
+
+def test_concurrent_misses_share_one_request(entity_api):
+    url = f"{entity_api}/entities/{DATASET_UUID}"
+    auth_helper = MagicMock()
+    auth_helper.getProcessSecret.return_value = 'secret'
+
+    async def lookups():
+        upstreams = asgi.AsyncUpstreams(app.upstream_client, max_connections=100)
+        try:
+            return await asyncio.gather(*[upstreams.result(url) for _ in range(50)])
+        finally:
+            await upstreams.aclose()
+
+    with patch.object(app, 'auth_helper_instance', auth_helper, create=True):
+        results = asyncio.run(lookups())
+
+    assert len(EntityHandler.calls) == 1
+    assert all(result.entity_type == 'Dataset' for result in results)
+    assert app.make_api_request_get.cache_entry(url).value.data_access_level == 'public'
+
+
+def test_unknown_path():
+    status_code, body = asyncio.run(call('/cache_clear', {}))
+    assert status_code == 404
@@ -0,0 +1,195 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import app
+from cache_invalidation import parse_invalidation, uuids_of_urls, Invalidation
+from entity_store import EntityStore
+
+DATASET_UUID = 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6'
+FILE_UUID = 'ffff1b2c3d4e5f6a7b8c9d0e1f2a3b4c'
+OTHER_UUID = 'b1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6'
+OTHER_FILE_UUID = 'ffff2b2c3d4e5f6a7b8c9d0e1f2a3b4c'
+
+INTERNAL_TOKEN = 'internal-token'
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.body = body
+        self.text = ''
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def upstream_bodies():
+    bodies = {
+        f"/file-id/{FILE_UUID}": {'ancestor_uuid': DATASET_UUID},
+        f"/file-id/{OTHER_FILE_UUID}": {'ancestor_uuid': OTHER_UUID},
+        f"/hmuuid/{DATASET_UUID}": {'type': 'DATASET'},
+        f"/hmuuid/{OTHER_UUID}": {'type': 'DATASET'},
+        f"/entities/{DATASET_UUID}": {'entity_type': 'Dataset', 'data_access_level': 'consortium', 'status': 'New'},
+        f"/entities/{OTHER_UUID}": {'entity_type': 'Dataset', 'data_access_level': 'consortium', 'status': 'New'}
+    }
+
+    def get(url, **kwargs):
+        for path, body in bodies.items():
+            if url.endswith(path):
+                return FakeResponse(body)
+        raise AssertionError(f"Unexpected request {url}")
+
+    auth_helper = MagicMock()
+    auth_helper.getProcessSecret.return_value = INTERNAL_TOKEN
+
+    clear_caches()
+    with patch.object(app.upstream_client, 'get', side_effect=get) as get_mock, \
+         patch.object(app, 'auth_helper_instance', auth_helper, create=True):
+        yield bodies, get_mock
+    clear_caches()
+
+
+def clear_caches():
+    app.cache.clear()
+    app.entity_index.clear()
+    app.file_access_decision_cache.clear()
+    app.unknown_uuid_filter.clear()
+
+
+def publish(bodies, uuid):
+    bodies[f"/entities/{uuid}"] = {'entity_type': 'Dataset', 'data_access_level': 'public', 'status': 'Published'}
+
+
+def invalidate(body, token=INTERNAL_TOKEN):
+    headers = {'Authorization': f"Bearer {token}"} if token else {}
+
+    with app.app.test_client() as client:
+        return client.post('/cache_invalidate', json=body, headers=headers)
+
+
+def test_parse_invalidation():
+    assert parse_invalidation({'uuids': [DATASET_UUID.upper(), DATASET_UUID], 'categories': ['umls']}) == \
+        Invalidation(uuids=(DATASET_UUID,), url_prefixes=(), categories=('umls',))
+
+    for body in [None, [], {}, {'uuids': DATASET_UUID}, {'uuids': ['not-a-uuid']},
+                 {'url_prefixes': ['https://']}, {'categories': ['everything']}]:
+        with pytest.raises(ValueError):
+            parse_invalidation(body)
+
+
+def test_uuids_of_urls():
+    assert uuids_of_urls([f"https://entity.api/entities/{DATASET_UUID}", f"https://uuid.api/file-id/{FILE_UUID}",
+                          'umls|abc']) == [DATASET_UUID, FILE_UUID]
+
+
+def test_requires_internal_token(upstream_bodies):
+    assert invalidate({'uuids': [DATASET_UUID]}, token=None).status_code == 401
+    assert invalidate({'uuids': [DATASET_UUID]}, token='user-token').status_code == 401
+    assert invalidate({'uuids': ['not-a-uuid']}).status_code == 400
+
+
+def test_invalidate_entity_with_its_files(upstream_bodies):
+    bodies, get_mock = upstream_bodies
+
+    for uuid in (FILE_UUID, OTHER_FILE_UUID):
+        assert app.get_file_access_decision(uuid, app.ACCESS_TIER_ANONYMOUS) == 401
+        publish(bodies, app.entity_index.get(uuid).ancestor_uuid)
+
+    # Still the cached decisions
+    assert app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 401
+    calls = get_mock.call_count
+
+    response = invalidate({'uuids': [DATASET_UUID]})
+    assert response.status_code == 200
+    assert response.json['workers'] == 'invalidated'
+    assert response.json['evicted'] == 2
+
+    # Only the entity lookups are made again, the file still belongs to the same dataset
+    assert app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 200
+    assert get_mock.call_count == calls + 2
+    # The other dataset is left alone
+    assert app.get_file_access_decision(OTHER_FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 401
+
+
+def test_invalidate_file_of_unindexed_entity(upstream_bodies):
+    bodies, get_mock = upstream_bodies
+
+    assert app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 401
+    publish(bodies, DATASET_UUID)
+
+    # E.g., this worker recycled its entity index but still has the decision
+    app.entity_index.clear()
+
+    assert invalidate({'uuids': [DATASET_UUID]}).status_code == 200
+    assert app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 200
+
+
+def test_invalidate_url_prefix(upstream_bodies):
+    bodies, get_mock = upstream_bodies
+
+    assert app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 401
+    publish(bodies, DATASET_UUID)
+
+    response = invalidate({'url_prefixes': [f"{app.app.config['ENTITY_API_URL']}/entities/"]})
+    assert response.json['evicted'] == 1
+    assert app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 200
+
+
+def test_invalidate_categories(upstream_bodies):
+    app.cache[app.umls_cache_key('my-umls-key')] = 'valid'
+    app.token_cache.cache[('token', 'user', 'abc')] = 'token info'
+    app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS)
+
+    assert invalidate({'categories': ['umls', 'tokens']}).json['evicted'] == 2
+    assert app.umls_cache_key('my-umls-key') not in app.cache
+    assert ('token', 'user', 'abc') not in app.token_cache.cache
+    assert len(app.file_access_decision_cache) == 1
+
+    assert invalidate({'categories': ['file_access']}).status_code == 200
+    assert len(app.file_access_decision_cache) == 0
+    assert len(app.entity_index) == 2
+
+    assert invalidate({'categories': ['entities']}).json['evicted'] == 3
+    assert len(app.entity_index) == 0
+
+
+def test_invalidate_unknown_uuid(upstream_bodies):
+    bodies, get_mock = upstream_bodies
+    app.unknown_uuid_filter.add(OTHER_UUID)
+    app.unknown_uuid_filter.add(FILE_UUID)
+
+    # Unrelated uuids keep the filter
+    assert invalidate({'uuids': [DATASET_UUID]}).status_code == 200
+    assert OTHER_UUID in app.unknown_uuid_filter
+
+    assert invalidate({'uuids': [OTHER_UUID]}).status_code == 200
+    assert OTHER_UUID not in app.unknown_uuid_filter
+
+
+def test_invalidate_entity_store(upstream_bodies, tmp_path):
+    bodies, get_mock = upstream_bodies
+    store = EntityStore(str(tmp_path / 'entity_store.bin'), capacity=100, ttl=3600)
+
+    with patch.object(app, 'entity_store', store), patch.object(app.entity_index, 'store', store):
+        assert app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 401
+        assert app.get_file_access_decision(OTHER_FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 401
+        publish(bodies, DATASET_UUID)
+
+        assert invalidate({'uuids': [DATASET_UUID]}).status_code == 200
+        # Not refilled from the store shared with the other worker processes
+        assert store.get(DATASET_UUID) is None
+        assert app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS) == 200
+        assert store.get(DATASET_UUID).data_access_level == 'public'
+        assert store.get(OTHER_FILE_UUID) is not None
+
+        assert invalidate({'categories': ['entities']}).status_code == 200
+        assert store.get(FILE_UUID) is None
+
+        app.get_file_access_decision(FILE_UUID, app.ACCESS_TIER_ANONYMOUS)
+        with app.app.test_client() as client:
+            client.get('/cache_clear')
+        assert store.get(FILE_UUID) is None
+
+    store.close()
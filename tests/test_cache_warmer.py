@@ -0,0 +1,129 @@
+import gzip
+from unittest.mock import patch, MagicMock
+
+import pytest
+from cachetools import TTLCache
+
+import app
+from cache_warmer import CacheWarmer, hot_uuids_from_access_logs, read_uuids_file
+
+DATASET_UUID = 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6'
+FILE_UUID = 'ffff1b2c3d4e5f6a7b8c9d0e1f2a3b4c'
+OTHER_UUID = 'b1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6'
+
+
+def access_log_line(path):
+    return f'10.0.0.1 - - [01/Oct/2026:10:00:00 +0000] "GET {path} HTTP/1.1" 200 1024 "-" "Mozilla/5.0"\n'
+
+
+def test_read_uuids_file(tmp_path):
+    uuids_file = tmp_path / 'hot_uuids.txt'
+    uuids_file.write_text(f"# Hot datasets\n{DATASET_UUID.upper()}\n\nnot-a-uuid\n{FILE_UUID}\n")
+
+    assert read_uuids_file(str(uuids_file)) == [DATASET_UUID, FILE_UUID]
+
+
+def test_hot_uuids_from_access_logs(tmp_path):
+    (tmp_path / 'access.log').write_text(access_log_line(f"/{DATASET_UUID}/data.tsv") +
+                                         access_log_line(f"/{FILE_UUID}/image.png?token=abc") +
+                                         access_log_line("/status/file_assets_status.json"))
+
+    with gzip.open(tmp_path / 'access.log.1.gz', 'wt') as f:
+        f.write(access_log_line(f"/{FILE_UUID}/image.png") * 2 + access_log_line(f"/{OTHER_UUID}/data.tsv"))
+
+    assert hot_uuids_from_access_logs([str(tmp_path / 'access.log*')], limit=10) == [FILE_UUID, DATASET_UUID, OTHER_UUID]
+    assert hot_uuids_from_access_logs([str(tmp_path / 'access.log*')], limit=1) == [FILE_UUID]
+
+
+def test_warmer_report(tmp_path):
+    uuids_file = tmp_path / 'hot_uuids.txt'
+    uuids_file.write_text(f"{DATASET_UUID}\n{FILE_UUID}\n{OTHER_UUID}\n{DATASET_UUID}\n")
+
+    def resolve(uuid):
+        if uuid == OTHER_UUID:
+            raise app.requests.exceptions.RequestException("Not found")
+        return uuid == FILE_UUID
+
+    cache = TTLCache(maxsize=10, ttl=60)
+    warmer = CacheWarmer(resolve, cache, uuids_file=str(uuids_file), concurrency=2)
+    report = warmer.run()
+
+    assert (report['uuids'], report['cached'], report['fetched'], report['failed']) == (3, 1, 1, 1)
+    assert report['hit_rate'] == 0.3333
+    assert warmer.report() == report
+    assert cache['cache_warmup_report'] == report
+
+
+def test_warmer_holds_cache_lock(tmp_path):
+    uuids_file = tmp_path / 'hot_uuids.txt'
+    uuids_file.write_text(f"{DATASET_UUID}\n")
+    lock = MagicMock()
+    held = []
+
+    class Cache(dict):
+        def get(self, key, default=None):
+            held.append(lock.__enter__.call_count > lock.__exit__.call_count)
+            return super().get(key, default)
+
+        def __setitem__(self, key, value):
+            held.append(lock.__enter__.call_count > lock.__exit__.call_count)
+            super().__setitem__(key, value)
+
+    warmer = CacheWarmer(lambda uuid: False, Cache(), lock, uuids_file=str(uuids_file))
+    warmer.run()
+    warmer.report()
+
+    assert held == [True, True]
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.body = body
+        self.text = ''
+
+    def json(self):
+        return self.body
+
+
+UPSTREAM_BODIES = {
+    f"/file-id/{FILE_UUID}": {'ancestor_uuid': DATASET_UUID},
+    f"/hmuuid/{DATASET_UUID}": {'type': 'DATASET'},
+    f"/entities/{DATASET_UUID}": {'entity_type': 'Dataset', 'data_access_level': 'consortium', 'status': 'Published'}
+}
+
+
+@pytest.fixture
+def upstream_get():
+    app.cache.clear()
+    app.entity_index.clear()
+
+    def get(url, **kwargs):
+        for path, body in UPSTREAM_BODIES.items():
+            if url.endswith(path):
+                return FakeResponse(body)
+        raise AssertionError(f"Unexpected request {url}")
+
+    auth_helper = MagicMock()
+    auth_helper.getProcessSecret.return_value = 'secret'
+
+    with patch.object(app.upstream_client, 'get', side_effect=get) as get_mock, \
+         patch.object(app, 'auth_helper_instance', auth_helper, create=True):
+        yield get_mock
+
+    app.cache.clear()
+    app.entity_index.clear()
+
+
+def test_warm_up_file_access(upstream_get):
+    # Cold: the three lookups are made
+    assert app.warm_up_file_access(FILE_UUID) is True
+    assert upstream_get.call_count == 3
+    assert app.entity_index.get(FILE_UUID).ancestor_uuid == DATASET_UUID
+    assert app.entity_index.get(DATASET_UUID).data_access_level == 'consortium'
+
+    # Warm: nothing to fetch, also after a worker restart with only the shared cache left
+    assert app.warm_up_file_access(FILE_UUID) is False
+    app.entity_index.clear()
+    assert app.warm_up_file_access(FILE_UUID) is False
+    assert upstream_get.call_count == 3
@@ -0,0 +1,83 @@
+from unittest.mock import patch
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpen, CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN
+
+
+def call(breaker, failed):
+    breaker.acquire()
+    breaker.release(failed)
+
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    with patch('circuit_breaker.time.monotonic', side_effect=lambda: now[0]):
+        yield now
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('uuid_api', failure_threshold=3, open_timeout=30, half_open_requests=1)
+
+    call(breaker, True)
+    call(breaker, True)
+    # A success resets the count
+    call(breaker, False)
+    call(breaker, True)
+    call(breaker, True)
+    assert breaker.state == CIRCUIT_CLOSED
+
+    call(breaker, True)
+    assert breaker.state == CIRCUIT_OPEN
+
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+
+def test_half_open_probe(clock):
+    breaker = CircuitBreaker('entity_api', failure_threshold=1, open_timeout=30, half_open_requests=1)
+    call(breaker, True)
+
+    clock[0] += 29
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+    clock[0] += 1
+    assert breaker.state == CIRCUIT_HALF_OPEN
+
+    # Only one probe at a time
+    breaker.acquire()
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+    # The failed probe opens it again for open_timeout
+    breaker.release(True)
+    assert breaker.state == CIRCUIT_OPEN
+
+    clock[0] += 30
+    call(breaker, False)
+    assert breaker.state == CIRCUIT_CLOSED
+    call(breaker, False)
+
+
+def test_abandoned_call_frees_the_probe(clock):
+    breaker = CircuitBreaker('globus', failure_threshold=1, open_timeout=10, half_open_requests=1)
+    call(breaker, True)
+    clock[0] += 10
+
+    call(breaker, None)
+    assert breaker.state == CIRCUIT_HALF_OPEN
+
+    breaker.acquire()
+    breaker.release(False)
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_zero_threshold_never_opens():
+    breaker = CircuitBreaker('umls', failure_threshold=0, open_timeout=30, half_open_requests=1)
+
+    for _ in range(100):
+        call(breaker, True)
+
+    assert breaker.state == CIRCUIT_CLOSED
@@ -0,0 +1,95 @@
+import json
+import os
+import time
+
+import pytest
+
+from endpoints_config import EndpointsConfig, EndpointsFileError, validate_endpoints
+
+ENDPOINTS = {
+    "ingest.api.hubmapconsortium.org": [
+        {"method": "GET", "endpoint": "/", "auth": False},
+        {"method": "GET", "endpoint": "/datasets/<*>", "auth": True, "groups": ["g1"]}
+    ]
+}
+
+
+def write_endpoints(path, data, mtime=None):
+    path.write_text(data if isinstance(data, str) else json.dumps(data))
+    # Bump the mtime so the change is seen even within the filesystem timestamp resolution
+    mtime = mtime or time.time()
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def endpoints_file(tmp_path):
+    path = tmp_path / 'api_endpoints.json'
+    write_endpoints(path, ENDPOINTS, mtime=time.time() - 10)
+    return path
+
+
+def test_validate_endpoints():
+    assert validate_endpoints(ENDPOINTS) == 2
+
+    with pytest.raises(EndpointsFileError):
+        validate_endpoints([])
+    with pytest.raises(EndpointsFileError):
+        validate_endpoints({"a": [{"method": "FETCH", "endpoint": "/", "auth": False}]})
+    with pytest.raises(EndpointsFileError):
+        validate_endpoints({"a": [{"method": "GET", "endpoint": "/", "auth": "no"}]})
+    with pytest.raises(EndpointsFileError):
+        validate_endpoints({"a": [{"method": "GET", "endpoint": "/", "auth": True, "groups": "g1"}]})
+
+
+def test_reload_on_change(endpoints_file):
+    config = EndpointsConfig(str(endpoints_file), poll_interval=0)
+
+    route_index = config.route_index()
+    version = config.info()['version']
+    assert route_index.match("ingest.api.hubmapconsortium.org", "GET", "/datasets/abc")['auth'] is True
+
+    # Unchanged file, same index object
+    assert config.reload() is config.reload()
+    assert config.route_index() is route_index
+
+    write_endpoints(endpoints_file, {"ingest.api.hubmapconsortium.org": [{"method": "GET", "endpoint": "/datasets/<*>", "auth": False}]})
+    config.reload()
+
+    assert config.route_index() is not route_index
+    assert config.route_index().match("ingest.api.hubmapconsortium.org", "GET", "/datasets/abc")['auth'] is False
+    assert config.info()['version'] != version
+    assert config.info()['endpoint_count'] == 1
+
+
+def test_bad_file_keeps_last_good_version(endpoints_file):
+    config = EndpointsConfig(str(endpoints_file), poll_interval=0)
+    version = config.info()['version']
+
+    write_endpoints(endpoints_file, '{"ingest.api.hubmapconsortium.org": [')
+    config.reload()
+
+    info = config.info()
+    assert info['version'] == version
+    assert 'Invalid json' in info['last_error']['error']
+    assert config.route_index().match("ingest.api.hubmapconsortium.org", "GET", "/") is not None
+
+
+def test_bad_file_without_good_version(tmp_path):
+    path = tmp_path / 'api_endpoints.json'
+    write_endpoints(path, {"ingest.api.hubmapconsortium.org": {}})
+
+    with pytest.raises(EndpointsFileError):
+        EndpointsConfig(str(path), poll_interval=0).route_index()
+
+
+def test_watcher_thread_picks_up_change(endpoints_file):
+    config = EndpointsConfig(str(endpoints_file), poll_interval=0.05)
+    version = config.info()['version']
+
+    config.start()
+    write_endpoints(endpoints_file, {"ingest.api.hubmapconsortium.org": [{"method": "GET", "endpoint": "/", "auth": True}]})
+    time.sleep(0.3)
+    config.stop()
+
+    assert config.info()['version'] != version
+    assert config.route_index().match("ingest.api.hubmapconsortium.org", "GET", "/")['auth'] is True
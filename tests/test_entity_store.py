@@ -0,0 +1,216 @@
+import multiprocessing
+import os
+from unittest.mock import patch
+
+import pytest
+
+import entity_store
+from entity_index import EntityIndex, avr_metadata, entity_metadata, file_metadata
+from entity_store import EntityStore, MAX_PROBES
+
+DATASET_UUID = 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6'
+FILE_UUID = 'ffff1b2c3d4e5f6a7b8c9d0e1f2a3b4c'
+AVR_UUID = 'b1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6'
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = EntityStore(str(tmp_path / 'entity_store.bin'), capacity=1000, ttl=3600)
+    yield store
+    store.close()
+
+
+# Uuids of the same probe sequence in the store
+def colliding_uuids(store, count):
+    return [f"{store.slots * i + 7:032x}" for i in range(1, count + 1)]
+
+
+def test_put_get(store):
+    metadata = {
+        DATASET_UUID: entity_metadata('Dataset', 'consortium', 'Published'),
+        FILE_UUID: file_metadata(DATASET_UUID),
+        AVR_UUID: avr_metadata()
+    }
+
+    for uuid, value in metadata.items():
+        assert store.get(uuid) is None
+        assert store.put(uuid, value)
+
+    for uuid, value in metadata.items():
+        assert store.get(uuid) == value
+
+    # Replaced in place
+    assert store.put(DATASET_UUID, entity_metadata('Dataset', 'public', 'Published'))
+    assert store.get(DATASET_UUID).data_access_level == 'public'
+
+
+def test_not_stored(store):
+    # Values the store can't encode are left to the per-process entity index
+    assert not store.put(DATASET_UUID, entity_metadata('Dataset', 'consortium', 'Unknown status'))
+    assert not store.put(DATASET_UUID, entity_metadata('Unknown type', 'consortium', 'Published'))
+    assert not store.put(FILE_UUID, file_metadata('HBM123.ABCD.456'))
+    assert not store.put('HBM123.ABCD.456', entity_metadata('Dataset', 'consortium', 'Published'))
+
+    assert store.get(DATASET_UUID) is None
+    assert store.get(FILE_UUID) is None
+    assert store.get('HBM123.ABCD.456') is None
+    assert store.get(None) is None
+
+
+def test_invalidate_keeps_probe_sequence(store):
+    uuids = colliding_uuids(store, 3)
+    for uuid in uuids:
+        assert store.put(uuid, file_metadata(DATASET_UUID))
+
+    assert store.invalidate(uuids[1])
+    assert not store.invalidate(uuids[1])
+    assert store.get(uuids[1]) is None
+    # Found past the invalidated record
+    assert store.get(uuids[2]) == file_metadata(DATASET_UUID)
+
+    # Its slot is reused
+    assert store.put(uuids[1], file_metadata(AVR_UUID))
+    assert store.get(uuids[1]) == file_metadata(AVR_UUID)
+    assert store.get(uuids[2]) == file_metadata(DATASET_UUID)
+
+
+def test_probe_limit(store):
+    uuids = colliding_uuids(store, MAX_PROBES + 1)
+
+    assert store.put_many([(uuid, file_metadata(DATASET_UUID)) for uuid in uuids]) == MAX_PROBES
+    assert store.get(uuids[-1]) is None
+
+    # Expired records are reused
+    with patch.object(entity_store.time, 'time', return_value=entity_store.time.time() + 7200):
+        assert store.get(uuids[0]) is None
+        assert store.put(uuids[-1], file_metadata(DATASET_UUID))
+        assert store.get(uuids[-1]) == file_metadata(DATASET_UUID)
+
+
+def test_clear(store):
+    store.put(DATASET_UUID, entity_metadata('Dataset', 'consortium', 'Published'))
+    store.clear()
+
+    assert store.get(DATASET_UUID) is None
+    assert store.put(FILE_UUID, file_metadata(DATASET_UUID))
+    assert store.get(FILE_UUID) == file_metadata(DATASET_UUID)
+
+
+def test_reopen(tmp_path):
+    path = str(tmp_path / 'entity_store.bin')
+
+    store = EntityStore(path, capacity=1000, ttl=3600)
+    store.put(FILE_UUID, file_metadata(DATASET_UUID))
+    store.close()
+
+    # e.g., the container restarted
+    store = EntityStore(path, capacity=1000, ttl=3600)
+    assert store.get(FILE_UUID) == file_metadata(DATASET_UUID)
+    store.close()
+
+    # Another capacity recreates the file
+    store = EntityStore(path, capacity=2000, ttl=3600)
+    assert store.get(FILE_UUID) is None
+    store.close()
+
+
+def test_recreated_file_replaced(tmp_path):
+    path = str(tmp_path / 'entity_store.bin')
+
+    old_store = EntityStore(path, capacity=1000, ttl=3600)
+    old_store.put(FILE_UUID, file_metadata(DATASET_UUID))
+    inode = os.stat(path).st_ino
+
+    # Same file as long as it matches
+    EntityStore(path, capacity=1000, ttl=3600).close()
+    assert os.stat(path).st_ino == inode
+
+    # e.g., a worker process started with another capacity while the old ones still run
+    new_store = EntityStore(path, capacity=4000, ttl=3600)
+    assert os.stat(path).st_ino != inode
+    assert os.path.getsize(path) == new_store.size
+    assert new_store.get(FILE_UUID) is None
+
+    # The old file isn't truncated under the processes still mapping it
+    assert old_store.get(FILE_UUID) == file_metadata(DATASET_UUID)
+    assert old_store.put(DATASET_UUID, entity_metadata('Dataset', 'consortium', 'Published'))
+
+    old_store.close()
+    new_store.close()
+
+    # No temporary file left
+    assert os.listdir(tmp_path) == ['entity_store.bin']
+
+
+def open_in_child(path, queue):
+    store = EntityStore(path, capacity=1000, ttl=3600)
+    store.put(FILE_UUID, file_metadata(DATASET_UUID))
+    queue.put(os.fstat(store._fd).st_ino)
+    store.close()
+
+
+def test_created_once_by_concurrent_processes(tmp_path):
+    path = str(tmp_path / 'entity_store.bin')
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+
+    processes = [context.Process(target=open_in_child, args=(path, queue)) for _ in range(8)]
+    for process in processes:
+        process.start()
+    inodes = {queue.get(timeout=10) for _ in processes}
+    for process in processes:
+        process.join()
+
+    # All the processes opened the same file
+    assert inodes == {os.stat(path).st_ino}
+    assert all(process.exitcode == 0 for process in processes)
+
+
+def put_in_child(store):
+    store.put(FILE_UUID, file_metadata(DATASET_UUID))
+    store.invalidate(DATASET_UUID)
+
+
+def test_shared_by_processes(store):
+    store.put(DATASET_UUID, entity_metadata('Dataset', 'consortium', 'Published'))
+
+    # A worker process forked from the uWSGI master
+    process = multiprocessing.get_context('fork').Process(target=put_in_child, args=(store,))
+    process.start()
+    process.join()
+
+    assert process.exitcode == 0
+    assert store.get(FILE_UUID) == file_metadata(DATASET_UUID)
+    assert store.get(DATASET_UUID) is None
+
+
+def test_entity_index_with_store(store):
+    index = EntityIndex(maxsize=10, ttl=3600, store=store)
+    other_index = EntityIndex(maxsize=10, ttl=3600, store=store)
+
+    index.put(FILE_UUID, file_metadata(DATASET_UUID))
+
+    # Found by the entity index of another worker process, and indexed by it
+    assert other_index.get(FILE_UUID) == file_metadata(DATASET_UUID)
+    assert len(other_index) == 1
+
+    # The invalidation of the entity index is per process
+    other_index.invalidate(FILE_UUID)
+    assert store.get(FILE_UUID) == file_metadata(DATASET_UUID)
+
+
+def test_entity_index_keeps_store_expiry(tmp_path):
+    store = EntityStore(str(tmp_path / 'entity_store.bin'), capacity=1000, ttl=60)
+    index = EntityIndex(maxsize=10, ttl=3600, store=store)
+
+    # Stored by another worker process
+    store.put(DATASET_UUID, entity_metadata('Dataset', 'consortium', 'Published'))
+    assert index.get(DATASET_UUID).data_access_level == 'consortium'
+
+    # Not kept by the entity index past the expiry of the stored entry
+    later = entity_store.time.time() + 120
+    with patch.object(entity_store.time, 'time', return_value=later):
+        assert index.get(DATASET_UUID) is None
+        assert len(index) == 0
+
+    store.close()
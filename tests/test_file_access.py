@@ -0,0 +1,376 @@
+import threading
+import time
+from collections import Counter
+from unittest.mock import patch, MagicMock
+
+import pytest
+from hubmap_commons.exceptions import HTTPException
+
+import app
+from app import get_file_access
+from circuit_breaker import CircuitOpen
+from gateway_cache import UpstreamResult
+
+DATASET_UUID = 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6'
+FILE_UUID = 'ffff1b2c3d4e5f6a7b8c9d0e1f2a3b4c'
+
+
+def entity(data_access_level, status='New', entity_type='Dataset'):
+    return UpstreamResult(200, None, None, entity_type, data_access_level, status, None)
+
+
+def uuid_api_entity(entity_type='DATASET'):
+    return UpstreamResult(200, None, entity_type, None, None, None, None)
+
+
+def not_found():
+    return UpstreamResult(404, None, None, None, None, None, 'Not found')
+
+
+def make_request(headers):
+    request = MagicMock()
+    request.headers = headers
+    return request
+
+
+@pytest.fixture(autouse=True)
+def clear_decisions():
+    app.file_access_decision_cache.clear()
+    app.entity_index.clear()
+    app.unknown_uuid_filter.clear()
+    yield
+    app.file_access_decision_cache.clear()
+    app.entity_index.clear()
+    app.unknown_uuid_filter.clear()
+
+
+# Mocked make_api_request_get() serving the given {url part: result or callable}, nothing cached
+@pytest.fixture
+def upstream():
+    results = {}
+
+    def get(url):
+        for part, result in results.items():
+            if part in url:
+                return result() if callable(result) else result
+        return not_found()
+
+    with patch('app.make_api_request_get', side_effect=get) as make_api_request_get:
+        make_api_request_get.cache_entry.return_value = None
+        yield results, make_api_request_get
+
+
+@pytest.fixture
+def lookups():
+    get_entity = MagicMock(return_value=entity('consortium'))
+
+    with patch('app.get_entity_uuid_by_file_uuid', return_value=(DATASET_UUID, False)) as get_entity_uuid, \
+         patch('app.make_api_request_get', side_effect=lambda url: uuid_api_entity() if '/hmuuid/' in url else get_entity(url)) as make_api_request_get, \
+         patch.object(app.token_cache, 'get_user_data_access_level', return_value='Consortium') as get_level:
+        make_api_request_get.cache_entry.return_value = None
+        yield get_entity_uuid, get_entity, get_level
+
+
+def test_decision_cached_per_access_tier(lookups):
+    get_entity_uuid, get_entity, get_level = lookups
+    with_token = make_request({'Authorization': 'Bearer token'})
+
+    for _ in range(5):
+        assert get_file_access(DATASET_UUID, None, with_token) == 200
+        assert get_file_access(DATASET_UUID, None, make_request({})) == 401
+
+    # One decision, the one of the anonymous callers is cached along with it, the entity itself is only resolved
+    # once thanks to the entity index and the token lookup is cached by the token cache
+    assert get_entity_uuid.call_count == 1
+    assert get_entity.call_count == 1
+    assert app.file_access_decision_cache[(DATASET_UUID, 'consortium')] == 200
+    assert app.file_access_decision_cache[(DATASET_UUID, app.ACCESS_TIER_ANONYMOUS)] == 401
+
+
+def test_invalid_token(lookups):
+    get_entity_uuid, get_entity, get_level = lookups
+    get_level.side_effect = HTTPException("Invalid token", 401)
+    get_entity.return_value = entity('public')
+
+    assert get_file_access(DATASET_UUID, 'expired', make_request({})) == 401
+    assert app.file_access_decision_cache[(DATASET_UUID, app.ACCESS_TIER_INVALID_TOKEN)] == 401
+
+
+def test_protected_dataset(lookups):
+    get_entity_uuid, get_entity, get_level = lookups
+    get_entity.return_value = entity('protected')
+
+    assert get_file_access(DATASET_UUID, 'token', make_request({})) == 403
+
+    get_level.return_value = 'Protected'
+    assert get_file_access(DATASET_UUID, 'token', make_request({})) == 200
+
+
+def test_errors_not_cached(lookups):
+    get_entity_uuid, get_entity, get_level = lookups
+    get_entity.return_value = UpstreamResult(500, None, None, None, None, None, 'error')
+
+    assert get_file_access(DATASET_UUID, None, make_request({})) == 500
+    assert get_file_access(DATASET_UUID, None, make_request({})) == 500
+    assert get_entity.call_count == 2
+    assert len(app.file_access_decision_cache) == 0
+
+
+def test_internal_token_rejected_not_cached(lookups):
+    get_entity_uuid, get_entity, get_level = lookups
+    get_entity.return_value = UpstreamResult(401, None, None, None, None, None, 'Unauthorized')
+
+    # Not a decision on the caller, whatever the access tier
+    assert get_file_access(DATASET_UUID, None, make_request({})) == 500
+    assert get_file_access(DATASET_UUID, 'token', make_request({})) == 500
+    assert len(app.file_access_decision_cache) == 0
+    assert app.file_access_ttl(DATASET_UUID, 500) == 0
+
+
+def test_decision_ttl(lookups):
+    get_entity_uuid, get_entity, get_level = lookups
+
+    def cache_control(headers):
+        with app.app.test_client() as client:
+            headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{DATASET_UUID}/data.tsv", **headers}
+            return client.get('/file_auth', headers=headers).headers['Cache-Control']
+
+    # Consortium dataset, the decisions depend on the token
+    assert cache_control({'Authorization': 'Bearer token'}) == f"max-age={app.auth_decision_ttl_protected}"
+    assert cache_control({}) == f"max-age={app.auth_decision_ttl_protected}"
+
+    # Public dataset, allowed with or without token
+    app.file_access_decision_cache.clear()
+    app.entity_index.clear()
+    get_entity.return_value = entity('public')
+    assert cache_control({'Authorization': 'Bearer token'}) == f"max-age={app.auth_decision_ttl_public}"
+
+    # Errors never cached
+    app.file_access_decision_cache.clear()
+    app.entity_index.clear()
+    get_entity.return_value = UpstreamResult(500, None, None, None, None, None, 'error')
+    assert cache_control({}) == 'no-store'
+
+
+def test_decision_ttl_from_the_decision_made(lookups):
+    get_entity_uuid, get_entity, get_level = lookups
+    get_entity.return_value = entity('public')
+    headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/{DATASET_UUID}/data.tsv", 'Authorization': 'Bearer token'}
+
+    with patch.object(app, 'decide_file_access', wraps=app.decide_file_access) as decide_file_access, \
+         patch.object(app, 'record_cache_lookup') as record_cache_lookup, \
+         app.app.test_client() as client:
+        assert client.get('/file_auth', headers=headers).headers['Cache-Control'] == f"max-age={app.auth_decision_ttl_public}"
+
+    # No other decision for the anonymous callers, each cache looked up once
+    assert decide_file_access.call_count == 1
+    assert [call.args[0] for call in record_cache_lookup.call_args_list].count('file_access_decision') == 1
+    # Made along with the one of the caller
+    assert app.file_access_decision_cache[(DATASET_UUID, app.ACCESS_TIER_ANONYMOUS)] == 200
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.body = body
+        self.text = ''
+
+    def json(self):
+        return self.body
+
+
+# Mocked HTTP layer of the gateway cache serving the uuid-api/entity-api bodies of the files of DATASET_UUID,
+# the requests are counted by url under a lock as the batch makes them from many threads
+@pytest.fixture
+def upstream_http():
+    requests_made = Counter()
+    lock = threading.Lock()
+
+    def get(url, **kwargs):
+        with lock:
+            requests_made[url] += 1
+
+        if '/file-id/ffff' in url:
+            return FakeResponse({'ancestor_uuid': DATASET_UUID})
+        if url.endswith(f"/hmuuid/{DATASET_UUID}"):
+            return FakeResponse({'type': 'DATASET'})
+        if url.endswith(f"/entities/{DATASET_UUID}"):
+            return FakeResponse({'entity_type': 'Dataset', 'data_access_level': 'consortium', 'status': 'Published'})
+        raise AssertionError(f"Unexpected request {url}")
+
+    auth_helper = MagicMock()
+    auth_helper.getProcessSecret.return_value = 'secret'
+
+    app.cache.clear()
+    with patch.object(app.upstream_client, 'get', side_effect=get), \
+         patch.object(app, 'auth_helper_instance', auth_helper, create=True):
+        yield requests_made
+    app.cache.clear()
+
+
+def test_batch_dedupes_parent_entities(upstream_http):
+    file_uuids = [f"ffff{i:028x}" for i in range(500)]
+    items = [f"{file_uuid}/image.png" for file_uuid in file_uuids] + [DATASET_UUID, f"/{DATASET_UUID}/data.tsv"]
+
+    with patch.object(app.token_cache, 'get_user_data_access_level', return_value='Consortium') as get_level, \
+         app.app.test_client() as client:
+        response = client.post('/file_auth/batch', json={'items': items, 'token': 'token'})
+
+    assert response.status_code == 200
+    assert response.json == {item: 200 for item in items}
+
+    # The token is resolved once, each file uuid is looked up once, and the parent entity shared by all of them
+    # is resolved with a single uuid-api and a single entity-api request
+    assert get_level.call_count == 1
+    assert sorted(count for url, count in upstream_http.items() if '/file-id/' in url) == [1] * len(file_uuids)
+    assert [count for url, count in upstream_http.items() if url.endswith(f"/hmuuid/{DATASET_UUID}")] == [1]
+    assert [count for url, count in upstream_http.items() if url.endswith(f"/entities/{DATASET_UUID}")] == [1]
+
+
+def test_batch_uses_authorization_header(lookups):
+    get_entity_uuid, get_entity, get_level = lookups
+    get_entity.return_value = entity('protected')
+
+    with app.app.test_client() as client:
+        anonymous = client.post('/file_auth/batch', json={'items': [DATASET_UUID]})
+        with_token = client.post('/file_auth/batch', json={'items': [DATASET_UUID]}, headers={'Authorization': 'Bearer token'})
+
+    assert anonymous.json == {DATASET_UUID: 401}
+    assert with_token.json == {DATASET_UUID: 403}
+
+
+def test_batch_invalid_body():
+    with app.app.test_client() as client:
+        assert client.post('/file_auth/batch', json={'uuids': DATASET_UUID}).status_code == 400
+        assert client.post('/file_auth/batch', json={'items': [1, 2]}).status_code == 400
+        assert client.post('/file_auth/batch', json={'items': ['a'] * 1001}).status_code == 400
+
+
+def test_cold_entity_lookups_at_the_same_time(upstream):
+    results, make_api_request_get = upstream
+
+    def slow(result):
+        def get():
+            time.sleep(0.3)
+            return result
+        return get
+
+    results['/hmuuid/'] = slow(uuid_api_entity())
+    results['/entities/'] = slow(entity('public'))
+
+    start = time.perf_counter()
+    assert get_file_access(DATASET_UUID, None, make_request({})) == 200
+
+    # uuid-api /hmuuid and entity-api /entities in one round trip instead of two
+    assert time.perf_counter() - start < 0.5
+
+
+def test_files_of_a_resolved_entity(upstream):
+    results, make_api_request_get = upstream
+    results['/file-id/'] = UpstreamResult(200, DATASET_UUID, None, None, None, None, None)
+    results['/hmuuid/'] = uuid_api_entity()
+    results['/entities/'] = entity('public', status='Published')
+
+    assert get_file_access(FILE_UUID, None, make_request({})) == 200
+    assert app.entity_index.get(FILE_UUID).ancestor_uuid == DATASET_UUID
+    assert app.entity_index.get(DATASET_UUID).data_access_level == 'public'
+
+    # Another file of the same dataset only needs its own /file-id lookup
+    make_api_request_get.reset_mock()
+    other_file_uuid = 'ffff' + '0' * 28
+    assert get_file_access(other_file_uuid, None, make_request({})) == 200
+    assert [call.args[0] for call in make_api_request_get.call_args_list] == [f"{app.app.config['UUID_API_URL']}/file-id/{other_file_uuid}"]
+
+
+def test_avr_entity(upstream):
+    results, make_api_request_get = upstream
+    results['/hmuuid/'] = uuid_api_entity('AVR')
+
+    assert get_file_access(DATASET_UUID, None, make_request({})) == 200
+    assert app.entity_index.get(DATASET_UUID).is_avr
+
+
+def test_entity_found_by_entity_api_without_uuid_api(upstream):
+    results, make_api_request_get = upstream
+    results['/hmuuid/'] = UpstreamResult(500, None, None, None, None, None, 'error')
+    results['/entities/'] = entity('public')
+
+    assert get_file_access(DATASET_UUID, None, make_request({})) == 200
+
+
+def test_entity_not_found(upstream):
+    results, make_api_request_get = upstream
+    results['/hmuuid/'] = uuid_api_entity()
+
+    assert get_file_access(DATASET_UUID, None, make_request({})) == 404
+    assert app.entity_index.get(DATASET_UUID) is None
+
+    # Unknown to uuid-api too, remembered as unknown
+    del results['/hmuuid/']
+    assert get_file_access(DATASET_UUID, None, make_request({})) == 404
+
+    calls = make_api_request_get.call_count
+    assert get_file_access(DATASET_UUID, None, make_request({'Authorization': 'Bearer token'})) == 404
+    assert make_api_request_get.call_count == calls
+
+
+def test_invalid_uuid_format(upstream):
+    results, make_api_request_get = upstream
+
+    for uuid in ['wp-login.php', 'HBM123.ABCD.456', DATASET_UUID[:-1], DATASET_UUID + '0']:
+        assert get_file_access(uuid, None, make_request({})) == 404
+
+    assert make_api_request_get.call_count == 0
+
+
+def test_invalid_file_uuid_remembered(upstream):
+    results, make_api_request_get = upstream
+    results['/file-id/'] = UpstreamResult(400, None, None, None, None, None, 'Invalid file uuid')
+
+    assert get_file_access(FILE_UUID, None, make_request({})) == 404
+    assert get_file_access(FILE_UUID, None, make_request({})) == 404
+    assert make_api_request_get.call_count == 1
+
+
+def test_chained_lookups_share_the_deadline(upstream):
+    results, make_api_request_get = upstream
+
+    def slow(result):
+        def get():
+            time.sleep(0.3)
+            return result
+        return get
+
+    results['/file-id/'] = slow(UpstreamResult(200, DATASET_UUID, None, None, None, None, None))
+    results['/hmuuid/'] = slow(uuid_api_entity())
+    results['/entities/'] = slow(entity('public'))
+
+    # Each lookup is within the deadline, the file-id lookup then the entity lookups are not
+    start = time.perf_counter()
+    with patch.object(app, 'auth_request_deadline', 0.45):
+        assert get_file_access(FILE_UUID, None, make_request({})) == 500
+
+    assert time.perf_counter() - start < 0.55
+    assert len(app.file_access_decision_cache) == 0
+
+
+def test_open_circuit_fails_fast(upstream):
+    results, make_api_request_get = upstream
+
+    def circuit_open():
+        raise CircuitOpen("Circuit breaker of upstream uuid_api is open")
+
+    results['/hmuuid/'] = circuit_open
+    results['/entities/'] = circuit_open
+
+    assert get_file_access(DATASET_UUID, None, make_request({})) == 500
+
+    # Globus circuit open
+    with patch.object(app.token_cache, 'get_user_data_access_level', side_effect=CircuitOpen("Circuit breaker of upstream globus is open")):
+        assert get_file_access(DATASET_UUID, None, make_request({'Authorization': 'Bearer token'})) == 500
+
+        with app.app.test_client() as client:
+            response = client.post('/file_auth/batch', json={'items': [DATASET_UUID, FILE_UUID]}, headers={'Authorization': 'Bearer token'})
+        assert response.json == {DATASET_UUID: 500, FILE_UUID: 500}
+
+    assert len(app.file_access_decision_cache) == 0
@@ -0,0 +1,321 @@
+from unittest.mock import patch
+
+import pytest
+from cachetools import TTLCache, cached
+
+import gateway_cache
+from gateway_cache import UwsgiCache, create_cache, CACHE_BACKEND_LOCAL, CACHE_BACKEND_UWSGI
+
+
+# Minimal in-memory stand-in of the uWSGI cache API
+class FakeUwsgi:
+    def __init__(self):
+        self.caches = {}
+        self.signals = {}
+
+    def cache_get(self, key, name):
+        return self.caches.get(name, {}).get(key)
+
+    def cache_update(self, key, value, expires, name):
+        self.caches.setdefault(name, {})[key] = value
+        return True
+
+    def cache_del(self, key, name):
+        return self.caches.get(name, {}).pop(key, None) is not None
+
+    def cache_exists(self, key, name):
+        return key in self.caches.get(name, {})
+
+    def cache_clear(self, name):
+        self.caches.pop(name, None)
+
+    def cache_keys(self, name):
+        return [key.encode('utf-8') for key in self.caches.get(name, {})]
+
+    def lock(self):
+        pass
+
+    def unlock(self):
+        pass
+
+    def register_signal(self, num, who, handler):
+        self.signals[num] = handler
+
+    def signal(self, num):
+        self.signals[num](num)
+
+
+@pytest.fixture
+def fake_uwsgi():
+    fake = FakeUwsgi()
+    with patch.object(gateway_cache, 'uwsgi', fake), patch.object(gateway_cache, '_worker_clear_handlers', []):
+        yield fake
+
+
+def test_local_backend_without_uwsgi():
+    with patch.object(gateway_cache, 'uwsgi', None):
+        assert isinstance(create_cache(CACHE_BACKEND_UWSGI, 10, 60, 'hubmap-auth'), TTLCache)
+    assert isinstance(create_cache(CACHE_BACKEND_LOCAL, 10, 60), TTLCache)
+
+
+def test_uwsgi_backend_shared_by_cache_instances(fake_uwsgi):
+    cache = create_cache(CACHE_BACKEND_UWSGI, 10, 60, 'hubmap-auth')
+    assert isinstance(cache, UwsgiCache)
+
+    calls = []
+
+    @cached(cache)
+    def lookup(url):
+        calls.append(url)
+        return {'url': url}
+
+    assert lookup('http://entity-api/entities/1') == {'url': 'http://entity-api/entities/1'}
+    assert lookup('http://entity-api/entities/1') == {'url': 'http://entity-api/entities/1'}
+    assert calls == ['http://entity-api/entities/1']
+
+    # Another worker process creates its own UwsgiCache over the same uWSGI cache
+    other_worker_cache = UwsgiCache('hubmap-auth', 60)
+    assert ('http://entity-api/entities/1',) in other_worker_cache
+
+    other_worker_cache.clear()
+    assert ('http://entity-api/entities/1',) not in cache
+
+
+def test_broadcast_worker_clear(fake_uwsgi):
+    local_cache = TTLCache(maxsize=10, ttl=60)
+    local_cache['a'] = 1
+
+    gateway_cache.register_worker_clear(local_cache.clear)
+    gateway_cache.broadcast_worker_clear()
+
+    assert len(local_cache) == 0
+
+
+@pytest.mark.parametrize('backend', [CACHE_BACKEND_LOCAL, CACHE_BACKEND_UWSGI])
+def test_evict_by_prefix(fake_uwsgi, backend):
+    cache = create_cache(backend, 10, 60, 'hubmap-auth')
+    cache[('http://entity-api/entities/1',)] = 1
+    cache[('http://uuid-api/hmuuid/1',)] = 2
+    cache[('token', 'user', 'abc')] = 3
+
+    assert gateway_cache.evict_by_prefix(cache, ['http://entity-api/', 'token|']) in (
+        ['http://entity-api/entities/1', 'token|user|abc'], ['token|user|abc', 'http://entity-api/entities/1'])
+    assert ('http://uuid-api/hmuuid/1',) in cache
+    assert ('http://entity-api/entities/1',) not in cache
+
+
+def test_evict_by_prefix_without_uwsgi_cache_keys(fake_uwsgi, monkeypatch):
+    monkeypatch.delattr(FakeUwsgi, 'cache_keys')
+    assert gateway_cache.evict_by_prefix(UwsgiCache('hubmap-auth', 60), ['token|']) is None
+
+
+def test_worker_broadcast(fake_uwsgi):
+    cache = UwsgiCache('hubmap-auth', 60)
+    broadcast = gateway_cache.WorkerBroadcast(cache, 'broadcast_log', log_size=2)
+    messages = []
+    broadcast.register(messages.append)
+
+    assert broadcast.send('first')
+    assert broadcast.send('second')
+    assert messages == ['first', 'second']
+
+    # A worker busy while 3 messages were sent missed one of them, it clears its caches instead
+    local_cache = TTLCache(maxsize=10, ttl=60)
+    local_cache['a'] = 1
+    gateway_cache.register_worker_clear(local_cache.clear)
+
+    signal = fake_uwsgi.signals[gateway_cache.WORKER_BROADCAST_SIGNAL]
+    fake_uwsgi.signals[gateway_cache.WORKER_BROADCAST_SIGNAL] = lambda num: None
+    for message in ('third', 'fourth', 'fifth'):
+        broadcast.send(message)
+    signal(gateway_cache.WORKER_BROADCAST_SIGNAL)
+
+    assert messages == ['first', 'second']
+    assert len(local_cache) == 0
+
+
+def test_worker_broadcast_needs_shared_cache(fake_uwsgi):
+    broadcast = gateway_cache.WorkerBroadcast(TTLCache(maxsize=10, ttl=60), 'broadcast_log')
+    broadcast.register(lambda message: None)
+
+    assert not broadcast.send('first')
+
+
+def make_response(status, text):
+    from unittest.mock import MagicMock
+    import json
+
+    mock = MagicMock()
+    mock.status_code = status
+    mock.text = text
+    mock.json.side_effect = lambda: json.loads(text)
+    return mock
+
+
+def test_compact_response_keeps_only_used_fields():
+    result = gateway_cache.compact_response(make_response(200, '{"entity_type": "Dataset", "data_access_level": "protected", '
+                                                                '"status": "Published", "title": "Some dataset", "files": []}'))
+
+    assert result.status_code == 200
+    assert result.entity_type == 'Dataset'
+    assert result.data_access_level == 'protected'
+    assert result.status == 'Published'
+    assert result.ancestor_uuid is None
+    assert result.text is None
+
+
+def test_compact_response_keeps_error_text():
+    result = gateway_cache.compact_response(make_response(404, 'Not found' * 1000))
+
+    assert result.status_code == 404
+    assert result.entity_type is None
+    assert len(result.text) == gateway_cache.MAX_ERROR_TEXT_LENGTH
+
+
+def test_compact_response_unparsable_body():
+    result = gateway_cache.compact_response(make_response(200, '<html></html>'))
+
+    assert result.status_code == 200
+    assert result.type is None
+    assert result.text == '<html></html>'
+
+
+def run_concurrently(func, count):
+    import threading
+
+    barrier = threading.Barrier(count)
+    results = []
+    errors = []
+
+    def worker():
+        barrier.wait()
+        try:
+            results.append(func())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results, errors
+
+
+def test_single_flight_coalesces_cache_misses():
+    import time
+
+    calls = []
+
+    @gateway_cache.cached_single_flight(TTLCache(maxsize=10, ttl=60))
+    def lookup(url):
+        calls.append(url)
+        time.sleep(0.2)
+        return gateway_cache.UpstreamResult(200, None, 'DATASET', None, None, None, None)
+
+    results, errors = run_concurrently(lambda: lookup('http://uuid-api/hmuuid/1'), 50)
+
+    assert len(calls) == 1
+    assert len(results) == 50 and not errors
+    assert all(result.type == 'DATASET' for result in results)
+
+
+def test_single_flight_shares_error():
+    import time
+
+    calls = []
+
+    @gateway_cache.cached_single_flight(TTLCache(maxsize=10, ttl=60))
+    def lookup(url):
+        calls.append(url)
+        time.sleep(0.2)
+        raise ConnectionError("uuid-api is down")
+
+    results, errors = run_concurrently(lambda: lookup('http://uuid-api/hmuuid/1'), 20)
+
+    assert len(calls) == 1
+    assert len(errors) == 20 and not results
+
+    # Errors are not cached, the next call tries again
+    with pytest.raises(ConnectionError):
+        lookup('http://uuid-api/hmuuid/1')
+    assert len(calls) == 2
+
+
+def outcome_expiry(result):
+    if result.status_code == 200:
+        return 0.2, 5
+    if result.status_code == 404:
+        return 0.2, 0
+    return 0, 0
+
+
+def test_ttl_per_outcome():
+    import time
+
+    status_codes = {'found': 200, 'missing': 404, 'error': 500}
+    calls = []
+
+    @gateway_cache.cached_single_flight(TTLCache(maxsize=10, ttl=60), expiry=outcome_expiry)
+    def lookup(name):
+        calls.append(name)
+        return gateway_cache.UpstreamResult(status_codes[name], None, None, None, None, None, None)
+
+    for name in ['found', 'missing', 'error']:
+        lookup(name)
+        lookup(name)
+
+    # Errors are never cached
+    assert calls == ['found', 'missing', 'error', 'error']
+
+    time.sleep(0.3)
+
+    # The expired not found entry is fetched again at once
+    lookup('missing')
+    assert calls.count('missing') == 2
+
+
+def test_stale_while_revalidate():
+    import time
+
+    calls = []
+
+    @gateway_cache.cached_single_flight(TTLCache(maxsize=10, ttl=60), expiry=outcome_expiry)
+    def lookup(url):
+        calls.append(url)
+        time.sleep(0.2 if len(calls) > 1 else 0)
+        return gateway_cache.UpstreamResult(200, None, f"v{len(calls)}", None, None, None, None)
+
+    assert lookup('http://entity-api/entities/1').type == 'v1'
+    time.sleep(0.3)
+
+    # The stale value is served at once while a single background call refreshes it
+    start = time.time()
+    results, errors = run_concurrently(lambda: lookup('http://entity-api/entities/1'), 20)
+    assert time.time() - start < 0.15
+    assert all(result.type == 'v1' for result in results) and not errors
+
+    time.sleep(0.4)
+    assert len(calls) == 2
+    assert lookup('http://entity-api/entities/1').type == 'v2'
+
+
+def test_stale_value_kept_when_refresh_fails():
+    import time
+
+    calls = []
+
+    @gateway_cache.cached_single_flight(TTLCache(maxsize=10, ttl=60), expiry=outcome_expiry)
+    def lookup(url):
+        calls.append(url)
+        if len(calls) > 1:
+            raise ConnectionError("entity-api is down")
+        return gateway_cache.UpstreamResult(200, None, 'DATASET', None, None, None, None)
+
+    lookup('http://entity-api/entities/1')
+    time.sleep(0.3)
+
+    assert lookup('http://entity-api/entities/1').type == 'DATASET'
+    time.sleep(0.1)
+    assert lookup('http://entity-api/entities/1').type == 'DATASET'
@@ -0,0 +1,157 @@
+import json
+import time
+from unittest.mock import patch, MagicMock
+
+from cachetools import TTLCache
+
+import app
+from app import get_status_data
+from status_poller import StatusPoller
+
+SERVICES = ['uuid_api', 'entity_api', 'ingest_api', 'search_api', 'file_assets', 'cells_api',
+            'workspaces_api', 'ontology_api', 'ukv_api', 'data_products_api', 'scfind_api']
+
+
+def make_response(status, headers, text):
+    mock = MagicMock()
+    mock.status_code = status
+    mock.headers = headers
+    mock.text = text
+    def json_loader():
+        return json.loads(text)
+    mock.json.side_effect = json_loader
+    return mock
+
+
+# Mocked requests.get that sleeps for the delay injected for the target URL
+def delayed_get(delays):
+    def get(url, **kwargs):
+        time.sleep(delays.get(url, 0))
+        if url == app.app.config['SCFIND_API_STATUS_URL']:
+            return make_response(200, {"Content-Type": "text/plain"}, 'ok')
+        return make_response(200, {"Content-Type": "application/json"}, '{"version": "1.0"}')
+    return get
+
+
+@patch("app.get_gateway_version_build", return_value=("2.0.0", "abc123"))
+@patch("app.upstream_client.get")
+def test_services_checked_in_parallel(mock_get, mock_version_build):
+    mock_get.side_effect = delayed_get({app.app.config[f"{service.upper()}_STATUS_URL"]: 0.3 for service in SERVICES})
+
+    start = time.time()
+    status_data = get_status_data()
+    elapsed = time.time() - start
+
+    # 11 services of 0.3s each take 3.3s one after another
+    assert elapsed < 1.5
+    assert status_data['gateway'] == {'version': '2.0.0', 'build': 'abc123'}
+    assert status_data['uuid_api']['version'] == '1.0'
+    assert status_data['scfind_api']['scfind_status'] is True
+
+    for service in SERVICES:
+        assert 'checked_at' in status_data[service]
+        assert status_data[service]['latency_ms'] >= 250
+
+
+@patch("app.get_gateway_version_build", return_value=("2.0.0", "abc123"))
+@patch("app.upstream_client.get")
+def test_slow_service_reported_after_deadline(mock_get, mock_version_build):
+    mock_get.side_effect = delayed_get({app.app.config['SEARCH_API_STATUS_URL']: 2})
+
+    with patch.dict(app.app.config, {'STATUS_DEADLINE': 0.5}):
+        start = time.time()
+        status_data = get_status_data()
+        elapsed = time.time() - start
+
+    assert elapsed < 1.5
+    assert 'error' in status_data['search_api']
+    assert status_data['entity_api']['version'] == '1.0'
+
+
+def test_poller_returns_last_snapshot():
+    calls = []
+
+    def collect():
+        calls.append(time.time())
+        time.sleep(0.2)
+        return {'count': len(calls)}
+
+    poller = StatusPoller(collect, interval=60, cache=TTLCache(maxsize=10, ttl=60))
+
+    # No snapshot yet, poll synchronously
+    assert poller.snapshot() == {'count': 1}
+
+    start = time.time()
+    assert poller.snapshot() == {'count': 1}
+    assert time.time() - start < 0.1
+    assert len(calls) == 1
+
+
+def test_poller_reuses_snapshot_from_shared_cache():
+    shared_cache = TTLCache(maxsize=10, ttl=60)
+
+    worker_1 = StatusPoller(lambda: {'worker': 1}, interval=60, cache=shared_cache)
+    worker_2 = StatusPoller(lambda: {'worker': 2}, interval=60, cache=shared_cache)
+
+    worker_1.refresh()
+    worker_2.refresh()
+
+    assert worker_2.snapshot() == {'worker': 1}
+
+
+def test_poller_background_refresh():
+    calls = []
+    poller = StatusPoller(lambda: calls.append(1) or {'count': len(calls)}, interval=0.1, cache=TTLCache(maxsize=10, ttl=60))
+
+    poller.start()
+    time.sleep(0.35)
+    poller.stop()
+
+    assert len(calls) >= 2
+    assert poller.snapshot()['count'] >= 2
+
+
+@patch("app.get_gateway_version_build", return_value=("2.0.0", "abc123"))
+@patch("app.upstream_client.get")
+def test_status_checks_share_one_executor(mock_get, mock_version_build):
+    mock_get.side_effect = delayed_get({})
+
+    with patch.object(app, 'ThreadPoolExecutor') as mock_executor:
+        get_status_data()
+        get_status_data()
+
+    # No executor created per call
+    mock_executor.assert_not_called()
+    assert not app.status_executor._shutdown
+
+
+# Lock that records whether it's held
+class RecordingLock:
+    def __init__(self):
+        self.held = False
+
+    def __enter__(self):
+        self.held = True
+
+    def __exit__(self, *args):
+        self.held = False
+
+
+def test_poller_holds_cache_lock():
+    lock = RecordingLock()
+    held = []
+
+    class Cache(dict):
+        def get(self, key, default=None):
+            held.append(lock.held)
+            return super().get(key, default)
+
+        def __setitem__(self, key, value):
+            held.append(lock.held)
+            super().__setitem__(key, value)
+
+    poller = StatusPoller(lambda: {'count': 1}, interval=60, cache=Cache(), cache_lock=lock)
+    poller.refresh()
+    poller.snapshot()
+
+    assert held and all(held)
@@ -14,7 +14,7 @@ def make_response(status, headers, text):
     mock.json.side_effect = json_loader
     return mock
 
-@patch("requests.get")
+@patch("app.upstream_client.get")
 def test_json_response(mock_get):
     mock_get.return_value = make_response(
         status=200,
@@ -25,7 +25,7 @@ def test_json_response(mock_get):
     result = _get_status_info("http://example.com")
     assert result == {"service": "ok"}
 
-@patch("requests.get")
+@patch("app.upstream_client.get")
 def test_text_html_with_json(mock_get):
     mock_get.return_value = make_response(
         status=200,
@@ -36,7 +36,7 @@ def test_text_html_with_json(mock_get):
     result = _get_status_info("http://example.com")
     assert result == {"service": "ok"}
 
-@patch("requests.get")
+@patch("app.upstream_client.get")
 def test_text_plain_with_json(mock_get):
     mock_get.return_value = make_response(
         status=200,
@@ -47,7 +47,7 @@ def test_text_plain_with_json(mock_get):
     result = _get_status_info("http://example.com")
     assert result == {"a": 1}
 
-@patch("requests.get")
+@patch("app.upstream_client.get")
 def test_text_body_ok(mock_get):
     mock_get.return_value = make_response(
         status=200,
@@ -58,7 +58,7 @@ def test_text_body_ok(mock_get):
     result = _get_status_info("http://example.com")
     assert result == {"text": "ok"}
 
-@patch("requests.get")
+@patch("app.upstream_client.get")
 def test_text_non_json_unrecognized(mock_get):
     mock_get.return_value = make_response(
         status=200,
@@ -71,7 +71,7 @@ def test_text_non_json_unrecognized(mock_get):
         "error": "Unexpected response text 'Not JSON content' for HTTP 200"
     }
 
-@patch("requests.get")
+@patch("app.upstream_client.get")
 def test_unsupported_content_type(mock_get):
     mock_get.return_value = make_response(
         status=200,
@@ -82,21 +82,21 @@ def test_unsupported_content_type(mock_get):
     result = _get_status_info("http://example.com")
     assert result == {"error": "Unable to determine status from header content type"}
 
-@patch("requests.get")
+@patch("app.upstream_client.get")
 def test_connect_timeout(mock_get):
     mock_get.side_effect = requests.exceptions.ConnectTimeout()
 
     result = _get_status_info("http://example.com")
     assert result == {"connection_timeout": True, "read_timeout": None}
 
-@patch("requests.get")
+@patch("app.upstream_client.get")
 def test_read_timeout(mock_get):
     mock_get.side_effect = requests.exceptions.ReadTimeout()
 
     result = _get_status_info("http://example.com")
     assert result == {"connection_timeout": False, "read_timeout": True}
 
-@patch("requests.get")
+@patch("app.upstream_client.get")
 def test_generic_request_exception(mock_get):
     mock_get.side_effect = requests.exceptions.RequestException("Network issue")
 
@@ -0,0 +1,78 @@
+import threading
+from unittest.mock import patch
+
+import app
+from load_shedding import RouteGuard, queue_time, REJECTED_CONCURRENCY, REJECTED_IN_FLIGHT, REJECTED_QUEUE_TIME
+
+
+def test_queue_time():
+    assert queue_time('t=1700000000.250', now=1700000001.0) == 0.75
+    assert queue_time('1700000000.250', now=1700000001.0) == 0.75
+    # Clock skew between nginx and the app
+    assert queue_time('t=1700000002.000', now=1700000001.0) == 0
+    assert queue_time(None) is None
+    assert queue_time('t=abc') is None
+
+
+def test_route_concurrency_limit():
+    guard = RouteGuard({'status.json': 2}, {})
+
+    assert guard.enter('status.json') is None
+    assert guard.enter('status.json') is None
+    assert guard.enter('status.json') == REJECTED_CONCURRENCY
+    # The other routes are not limited
+    assert guard.enter('api_auth') is None
+
+    guard.leave('status.json')
+    assert guard.enter('status.json') is None
+    assert guard.in_flight() == {'status.json': 2, 'api_auth': 1}
+
+
+def test_low_priority_routes_shed_first():
+    guard = RouteGuard({}, {'file_auth': {'in_flight': 4}, 'status.json': {'in_flight': 2, 'queue_time': 1}})
+
+    assert guard.enter('api_auth') is None
+    assert guard.enter('file_auth') is None
+    assert guard.enter('status.json') == REJECTED_IN_FLIGHT
+    assert guard.enter('file_auth') is None
+    assert guard.enter('file_auth') is None
+    assert guard.enter('file_auth') == REJECTED_IN_FLIGHT
+
+    # api_auth is never shed
+    for _ in range(100):
+        assert guard.enter('api_auth') is None
+
+
+def test_queued_too_long():
+    guard = RouteGuard({}, {'status.json': {'queue_time': 1}})
+
+    assert guard.enter('status.json', waited=0.5) is None
+    assert guard.enter('status.json', waited=1.5) == REJECTED_QUEUE_TIME
+    assert guard.enter('api_auth', waited=30) is None
+
+
+def test_rejected_without_running_the_endpoint():
+    guard = RouteGuard({'status.json': 1}, {})
+    entered = threading.Event()
+    release = threading.Event()
+
+    def blocking_status_data():
+        entered.set()
+        release.wait(5)
+        return {}
+
+    with patch.object(app, 'route_guard', guard), \
+         patch.object(app, 'current_status_data', side_effect=blocking_status_data) as status_data:
+        first = threading.Thread(target=lambda: app.app.test_client().get('/status.json'))
+        first.start()
+        entered.wait(5)
+
+        response = app.app.test_client().get('/status.json')
+
+        release.set()
+        first.join()
+
+    assert response.status_code == 503
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert status_data.call_count == 1
+    assert guard.in_flight() == {}
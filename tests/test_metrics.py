@@ -0,0 +1,92 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from prometheus_client import REGISTRY
+
+import app
+from gateway_cache import MeteredTTLCache
+
+SRC_DIR = str(Path(__file__).absolute().parent.parent / 'hubmap-auth' / 'src')
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_auth_requests_recorded():
+    labels = {'route': 'api_auth', 'authority': 'other', 'decision': '401'}
+    before = sample('hubmap_auth_request_duration_seconds_count', **labels)
+
+    with app.app.test_client() as client:
+        assert client.get('/api_auth', headers={'Host': 'unknown.example.org'}).status_code == 401
+        response = client.get('/metrics')
+
+    assert sample('hubmap_auth_request_duration_seconds_count', **labels) == before + 1
+    assert sample('hubmap_auth_requests_in_flight', route='api_auth') == 0
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert b'hubmap_auth_request_duration_seconds_bucket{authority="other",decision="401"' in response.data
+
+
+def test_file_assets_authority_kept():
+    host = app.file_assets_authority
+    before = sample('hubmap_auth_request_duration_seconds_count', route='file_auth', authority=host, decision='401')
+
+    with app.app.test_client() as client:
+        client.get('/file_auth', headers={'Host': host})
+
+    assert sample('hubmap_auth_request_duration_seconds_count', route='file_auth', authority=host, decision='401') == before + 1
+
+
+def test_cache_evictions():
+    cache = MeteredTTLCache(maxsize=2, ttl=60, name='test')
+
+    for key in range(5):
+        cache[key] = key
+
+    assert sample('hubmap_auth_cache_evictions_total', cache='test') == 3
+
+    cache.clear()
+    assert sample('hubmap_auth_cache_evictions_total', cache='test') == 3
+
+
+def test_cache_lookups():
+    hits = sample('hubmap_auth_cache_hits_total', cache='entity_index')
+    misses = sample('hubmap_auth_cache_misses_total', cache='entity_index')
+
+    app.entity_index.put('a1b2', app.avr_metadata())
+    app.entity_index.get('a1b2')
+    app.entity_index.get('c3d4')
+    app.entity_index.clear()
+
+    assert sample('hubmap_auth_cache_hits_total', cache='entity_index') == hits + 1
+    assert sample('hubmap_auth_cache_misses_total', cache='entity_index') == misses + 1
+
+
+OBSERVE = """
+import metrics
+metrics.observe_upstream('uuid_api', 200, 0.01)
+metrics.requests_in_flight.labels('file_auth').inc()
+"""
+
+EXPOSE = """
+import sys
+import metrics
+sys.stdout.write(metrics.exposition().decode('utf-8'))
+"""
+
+
+# Each worker process writes its own files, the exposition of any process sums them up
+def test_multiprocess_aggregation(tmp_path):
+    env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': str(tmp_path), 'PYTHONPATH': SRC_DIR}
+
+    for _ in range(3):
+        subprocess.run([sys.executable, '-c', OBSERVE], env=env, check=True)
+
+    output = subprocess.run([sys.executable, '-c', EXPOSE], env=env, check=True, capture_output=True, text=True).stdout
+
+    assert 'hubmap_auth_upstream_request_duration_seconds_count{status="200",upstream="uuid_api"} 3.0' in output
+    # The live gauge of the exited processes is gone
+    assert 'hubmap_auth_requests_in_flight{route="file_auth"}' not in output
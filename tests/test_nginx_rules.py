@@ -0,0 +1,313 @@
+import json
+import random
+import re
+import shutil
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import app
+from endpoints_config import EndpointsConfig, HTTP_METHODS
+from nginx_rules import PUBLIC_VARIABLE, ROUTE_VARIABLE, generate_nginx_rules, generate_nginx_rules_file
+from route_index import WILDCARD_DELIMITER
+
+REPO_ROOT = Path(__file__).absolute().parent.parent
+
+ENDPOINTS = {
+    "ingest.api.hubmapconsortium.org": [
+        {"method": "GET", "endpoint": "/", "auth": False},
+        {"method": "GET", "endpoint": "/entities/<*>", "auth": False},
+        {"method": "GET", "endpoint": "/entities/secret", "auth": True},
+        {"method": "GET", "endpoint": "/files/<*>", "auth": True},
+        {"method": "GET", "endpoint": "/files/v<*>.json", "auth": False},
+        {"method": "get", "endpoint": "/datasets/data-status/", "auth": False},
+        {"method": "PUT", "endpoint": "/datasets/<*>/status/<*>", "auth": False},
+        {"method": "PUT", "endpoint": "/datasets/<*>/submit", "auth": True},
+    ],
+    "avr.xconsortia.org": [
+        {"method": "GET", "endpoint": "/static/<*>", "auth": False},
+    ],
+    "private.hubmapconsortium.org": [
+        {"method": "GET", "endpoint": "/<*>", "auth": True, "groups": ["g1"]},
+    ],
+}
+
+# Values put in place of the wildcards, some of them not matching one (empty, several segments, `~` not allowed)
+WILDCARD_VALUES = ['abc', 'HBM123.ABCD.456', 'a%20b', 'x:y@z', '1', 'secret', 'data-status', '', 'a/b', 'a~b']
+
+MAP_PATTERN = re.compile(r'^map (\S+|"[^"]*") \$(\w+) \{$')
+ENTRY_PATTERN = re.compile(r'^\s+("[^"]*"|default) ("[^"]*"|\S+);$')
+
+
+# The maps of the generated configuration: variable -> (source, default, exact values, [(regex, value)])
+def parse_maps(rules):
+    maps = {}
+    current = None
+
+    for line in rules.splitlines():
+        map_match = MAP_PATTERN.match(line)
+        entry_match = ENTRY_PATTERN.match(line)
+
+        if map_match is not None:
+            current = maps[map_match.group(2)] = [map_match.group(1).strip('"'), '', {}, []]
+        elif line == '}':
+            current = None
+        elif current is not None and entry_match is not None:
+            key, value = entry_match.group(1), entry_match.group(2).strip('"')
+
+            if key == 'default':
+                current[1] = value
+            elif key.startswith('"~'):
+                # Python names the groups with (?P<name>...)
+                current[3].append((re.compile(key[2:-1].replace('(?<', '(?P<')), value))
+            else:
+                current[2][key[1:-1].lower()] = value
+
+    return maps
+
+
+# Evaluate the map variable the way nginx does: the exact strings first (case-insensitive),
+# then the regexes in order, the first match wins, and the named captures can be used in the value
+def evaluate(maps, name, variables):
+    source, default, exact, regexes = maps[name]
+    resolve = lambda match: evaluate(maps, match.group(1), variables) if match.group(1) in maps else variables.get(match.group(1), '')
+    key = re.sub(r'\$(\w+)', resolve, source)
+
+    if key.lower() in exact:
+        return exact[key.lower()]
+
+    for regex, value in regexes:
+        match = regex.search(key)
+        if match is not None:
+            return re.sub(r'\$(\w+)', lambda m: match.groupdict().get(m.group(1), ''), value)
+
+    return default
+
+
+def nginx_variable(maps, name, headers):
+    variables = {
+        'http_host': headers.get('Host', ''),
+        'http_x_original_request_method': headers.get('X-Original-Request-Method', ''),
+        'http_x_original_uri': headers.get('X-Original-URI', ''),
+    }
+    return evaluate(maps, name, variables)
+
+
+# Run the njs functions of auth_cache.js with node on the given [(function, headers, variables)]
+# and return their values, `headers` are the request headers as read by r.headersIn
+NJS_RUNNER = """
+const source = require('fs').readFileSync(process.argv[1], 'utf8').replace('export default', 'return');
+const module = new Function('require', source)(require);
+const calls = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+console.log(JSON.stringify(calls.map(([name, headersIn, variables]) => module[name]({headersIn, variables}))));
+"""
+
+requires_node = pytest.mark.skipif(shutil.which('node') is None, reason="node is needed to run auth_cache.js")
+
+
+def run_njs(env, calls):
+    script = REPO_ROOT / 'nginx' / f"conf.d-{env}" / 'auth_cache.js'
+    output = subprocess.run(['node', '-e', NJS_RUNNER, str(script)], input=json.dumps(calls),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def nginx_public(maps, headers):
+    return nginx_variable(maps, PUBLIC_VARIABLE, headers) == '1'
+
+
+# Original requests derived from each endpoint: wildcard values, slashes, query strings, case, extra segments,
+# other methods and hosts. The methods are upper case and the URIs start with a slash as sent by nginx
+# ($request_method and $request_uri)
+def sample_requests(endpoints_data, rng):
+    requests = []
+
+    for authority, items in endpoints_data.items():
+        for item in items:
+            for _ in range(3):
+                path = item['endpoint'].strip('/')
+                while WILDCARD_DELIMITER in path:
+                    path = path.replace(WILDCARD_DELIMITER, rng.choice(WILDCARD_VALUES), 1)
+
+                variants = [f"/{path}", f"/{path}/", f"//{path}", f"/{path}?token=abc", f"/{path}/?next=/a/b",
+                            f"/{path.upper()}", f"/{path}/extra", f"/{path.rpartition('/')[0]}"]
+                for uri in variants:
+                    method = item['method'].upper() if rng.random() < 0.7 else rng.choice(sorted(HTTP_METHODS))
+                    host = authority if rng.random() < 0.9 else rng.choice([f"{authority}:443", authority.upper(), 'unknown.example.org'])
+                    requests.append({'Host': host, 'X-Original-Request-Method': method, 'X-Original-URI': uri})
+
+    return requests
+
+
+# The gateway app serving the given endpoints file, any token is invalid
+@contextmanager
+def gateway(endpoints_file):
+    with patch.object(app, 'endpoints_config', EndpointsConfig(str(endpoints_file), 0)), \
+         patch.object(app, 'auth_helper_instance', MagicMock(getProcessSecret=lambda: 'internal-token'), create=True), \
+         patch.object(app, 'get_user_info_for_access_check', return_value=None), \
+         app.app.test_client() as client:
+        yield client
+
+
+def assert_rules_agree(endpoints_file, rules, requests):
+    maps = parse_maps(rules)
+
+    with gateway(endpoints_file) as client:
+        for headers in requests:
+            # No token: api_auth() only allows the public endpoints
+            allowed = client.get('/api_auth', headers=headers).status_code == 200
+            assert nginx_public(maps, headers) == allowed, headers
+
+            # The endpoint in the key of the nginx cache of the decisions
+            item = app.match_api_endpoint(headers)
+            route = f"{item['method'].upper()} {item['endpoint']}" if item is not None else ''
+            assert nginx_variable(maps, ROUTE_VARIABLE, headers) == route, headers
+
+
+def test_rules_agree_with_api_auth(tmp_path):
+    endpoints_file = tmp_path / 'api_endpoints.json'
+    endpoints_file.write_text(json.dumps(ENDPOINTS))
+
+    assert_rules_agree(endpoints_file, generate_nginx_rules_file(str(endpoints_file)), sample_requests(ENDPOINTS, random.Random(0)))
+
+
+@pytest.mark.parametrize('env', ['prod', 'test', 'dev'])
+def test_deployed_rules_agree_with_api_auth(env):
+    endpoints_file = REPO_ROOT / f"api_endpoints.{env}.json"
+    rules = (REPO_ROOT / 'nginx' / f"conf.d-{env}" / 'api_auth_public.conf').read_text()
+
+    # The rules must be regenerated with nginx_rules.py whenever the endpoints file changes
+    assert rules == generate_nginx_rules_file(str(endpoints_file))
+
+    assert_rules_agree(endpoints_file, rules, sample_requests(json.loads(endpoints_file.read_text()), random.Random(0)))
+
+
+def test_static_endpoint_requiring_auth_hides_wildcard():
+    maps = parse_maps(generate_nginx_rules(ENDPOINTS, 'api_endpoints.json', 'version'))
+    headers = {'Host': 'ingest.api.hubmapconsortium.org', 'X-Original-Request-Method': 'GET'}
+
+    assert nginx_public(maps, {**headers, 'X-Original-URI': '/entities/abc'})
+    assert not nginx_public(maps, {**headers, 'X-Original-URI': '/entities/secret'})
+    # The wildcard endpoint requiring auth defined first wins
+    assert not nginx_public(maps, {**headers, 'X-Original-URI': '/files/v1.json'})
+
+
+def test_only_needed_rules_written():
+    rules = generate_nginx_rules(ENDPOINTS, 'api_endpoints.json', 'version')
+    # Only the public endpoint rules, all the endpoints are named by the route rules
+    rules = rules[:rules.index(f"${ROUTE_VARIABLE} {{")]
+
+    assert 'private.hubmapconsortium.org' not in rules
+    # Nothing public after them
+    assert 'submit' not in rules
+
+
+def test_missing_original_uri_not_public():
+    maps = parse_maps(generate_nginx_rules(ENDPOINTS, 'api_endpoints.json', 'version'))
+    headers = {'Host': 'ingest.api.hubmapconsortium.org', 'X-Original-Request-Method': 'GET'}
+
+    assert nginx_public(maps, {**headers, 'X-Original-URI': '/'})
+    assert not nginx_public(maps, headers)
+
+
+def test_unsupported_character():
+    with pytest.raises(ValueError):
+        generate_nginx_rules({"ingest.api.hubmapconsortium.org": [{"method": "GET", "endpoint": "/a\"b", "auth": False}]}, 'api_endpoints.json', 'version')
+
+
+# The key of the nginx cache of the /file_auth decisions must tell apart any two requests the gateway app tells apart
+# without any token in it
+@requires_node
+@pytest.mark.parametrize('env', ['prod', 'test', 'dev'])
+def test_file_auth_cache_key(env):
+    maps = parse_maps((REPO_ROOT / 'nginx' / f"conf.d-{env}" / 'auth_cache.conf').read_text())
+    requests = []
+
+    for path in ['', 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6', 'ffff1b2c3d4e5f6a7b8c9d0e1f2a3b4c', 'status', 'a;b', 'a%2Fb']:
+        for suffix in ['', '/', '/data/file.tsv', '//x', ';params', '#frag', '/a?b']:
+            for query in ['', '?token=abc', '?token=abc&token=def', '?x=1&token=a%20b', '?token=', '?token=abc#frag',
+                          '#f?token=abc', '?%74oken=abc', '?token=def&x=1', '?x=2']:
+                for uri in [f"/{path}{suffix}{query}", f"//{path}{suffix}{query}", f"{path}{suffix}{query}"]:
+                    for authorization in [None, 'Bearer abc', 'Bearer def']:
+                        headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': uri}
+                        if authorization is not None:
+                            headers['Authorization'] = authorization
+                        requests.append(headers)
+
+    calls = []
+    for headers in requests:
+        headers_in = {'Authorization': headers['Authorization']} if 'Authorization' in headers else {}
+        variables = {'hubmap_auth_file_query': nginx_variable(maps, 'hubmap_auth_file_query', headers)}
+        calls += [('fileParams', headers_in, variables), ('fileTokenHash', headers_in, variables)]
+
+    values = run_njs(env, calls)
+
+    parsed = {}
+    for index, headers in enumerate(requests):
+        params, token_hash = values[2 * index], values[2 * index + 1]
+        assert 'abc' not in params and 'def' not in params, headers
+
+        key = (nginx_variable(maps, 'hubmap_auth_file_uuid', headers), params, token_hash)
+        decision_input = (app.parse_file_auth_request(headers), headers.get('Authorization'))
+        assert parsed.setdefault(key, decision_input) == decision_input, headers
+
+
+@requires_node
+@pytest.mark.parametrize('env', ['prod', 'test', 'dev'])
+def test_cache_keys_without_tokens(env):
+    conf = (REPO_ROOT / 'nginx' / f"conf.d-{env}" / 'hubmap-auth.conf').read_text()
+    keys = re.findall(r'uwsgi_cache_key "([^"]*)";', conf)
+
+    assert keys
+    for key in keys:
+        assert '$http_authorization' not in key and '$http_mauthorization' not in key and '$hubmap_auth_file_query' not in key
+
+    hashes = run_njs(env, [('tokenHash', {'Authorization': 'Bearer abc'}, {}),
+                           ('tokenHash', {'Authorization': 'Bearer abc'}, {}),
+                           ('tokenHash', {'Authorization': 'Bearer def'}, {}),
+                           ('tokenHash', {'Mauthorization': 'Bearer abc'}, {}),
+                           ('tokenHash', {}, {})])
+
+    assert hashes[0] == hashes[1]
+    assert len(set(hashes[1:])) == 4
+    assert all(re.fullmatch('[0-9a-f]{64}', value) for value in hashes)
+
+
+def test_api_auth_decision_ttl(tmp_path):
+    endpoints_file = tmp_path / 'api_endpoints.json'
+    endpoints_file.write_text(json.dumps(ENDPOINTS))
+    headers = {'Host': 'ingest.api.hubmapconsortium.org', 'X-Original-Request-Method': 'GET'}
+
+    with gateway(endpoints_file) as client:
+        public = client.get('/api_auth', headers={**headers, 'X-Original-URI': '/entities/abc'})
+        protected = client.get('/api_auth', headers={**headers, 'X-Original-URI': '/entities/secret'})
+        unknown = client.get('/api_auth', headers={**headers, 'X-Original-URI': '/unknown'})
+
+    assert public.status_code == 200
+    assert public.headers['Cache-Control'] == f"max-age={app.auth_decision_ttl_public}"
+    assert protected.status_code == 401
+    assert protected.headers['Cache-Control'] == f"max-age={app.auth_decision_ttl_protected}"
+    assert unknown.headers['Cache-Control'] == f"max-age={app.auth_decision_ttl_protected}"
+
+
+# The operational endpoints of the gateway app are denied on the public ports, only port 8000 serves them
+@pytest.mark.parametrize('env', ['prod', 'test', 'dev'])
+def test_internal_endpoints_not_public(env):
+    conf = (REPO_ROOT / 'nginx' / f"conf.d-{env}" / 'hubmap-auth.conf').read_text()
+    servers = {re.search(r'listen (\d+)', server).group(1): server for server in conf.split('\nserver {')[1:]}
+
+    def denied(server, path):
+        for pattern, body in re.findall(r'location ~ (\S+) \{([^}]*)\}', server):
+            if re.search(pattern, path):
+                return 'deny all;' in body
+        return False
+
+    for path in ['/metrics', '/upstream_pool_stats', '/api_auth/config', '/cache_warmup', '/cache_warmup/']:
+        assert denied(servers['4430'], path) and denied(servers['8443'], path), path
+        assert not denied(servers['8000'], path), path
+
+    for path in ['/api_auth', '/file_auth', '/status.json', '/cache_invalidate', '/metrics.json']:
+        assert not denied(servers['4430'], path) and not denied(servers['8443'], path), path
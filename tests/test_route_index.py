@@ -0,0 +1,113 @@
+import json
+import re
+from pathlib import Path
+
+import pytest
+
+from route_index import RouteIndex, WILDCARD_DELIMITER, WILDCARD_REGEX_PATTERN
+
+REPO_ROOT = Path(__file__).absolute().parent.parent
+
+ENDPOINTS = {
+    "ingest.api.hubmapconsortium.org": [
+        {"method": "GET", "endpoint": "/", "auth": False},
+        {"method": "GET", "endpoint": "/datasets/<*>", "auth": True, "groups": ["g1"]},
+        {"method": "GET", "endpoint": "/datasets/data-status", "auth": False},
+        {"method": "get", "endpoint": "/entities/<*>", "auth": False},
+        {"method": "PUT", "endpoint": "/datasets/<*>/status/<*>", "auth": False},
+        {"method": "PUT", "endpoint": "/datasets/<*>/submit", "auth": True},
+        {"method": "PUT", "endpoint": "/datasets/bulk/submit", "auth": False},
+        {"method": "GET", "endpoint": "/metadata/<*>", "auth": True},
+        {"method": "GET", "endpoint": "/metadata/usergroups", "auth": False},
+        {"method": "GET", "endpoint": "/files/v<*>.json", "auth": False},
+    ]
+}
+
+
+# The original two-pass linear scan of api_auth(), used as the reference behavior
+def legacy_match(data, authority, method, endpoint):
+    if authority not in data:
+        return None
+
+    target_endpoint = endpoint.split("?")[0]
+
+    for item in data[authority]:
+        if (item['method'].upper() == method.upper()) and (WILDCARD_DELIMITER not in item['endpoint']):
+            if item['endpoint'].strip('/') == target_endpoint.strip('/'):
+                return item
+
+    for item in data[authority]:
+        if (item['method'].upper() == method.upper()) and (WILDCARD_DELIMITER in item['endpoint']):
+            endpoint_pattern = item['endpoint'].replace(WILDCARD_DELIMITER, WILDCARD_REGEX_PATTERN)
+            if re.fullmatch(endpoint_pattern.strip('/'), target_endpoint.strip('/')) is not None:
+                return item
+
+    return None
+
+
+@pytest.fixture
+def index():
+    return RouteIndex(ENDPOINTS)
+
+
+def test_static_match(index):
+    item = index.match("ingest.api.hubmapconsortium.org", "GET", "/")
+    assert item["endpoint"] == "/"
+
+
+def test_static_takes_precedence_over_wildcard(index):
+    item = index.match("ingest.api.hubmapconsortium.org", "GET", "/datasets/data-status")
+    assert item["endpoint"] == "/datasets/data-status"
+
+    item = index.match("ingest.api.hubmapconsortium.org", "PUT", "/datasets/bulk/submit/")
+    assert item["endpoint"] == "/datasets/bulk/submit"
+
+
+def test_wildcard_match_ignores_query_string_and_case(index):
+    item = index.match("ingest.api.hubmapconsortium.org", "get", "/entities/abc123?foo=bar")
+    assert item["endpoint"] == "/entities/<*>"
+
+
+def test_wildcard_matches_one_segment_only(index):
+    assert index.match("ingest.api.hubmapconsortium.org", "GET", "/entities/abc/def") is None
+
+    item = index.match("ingest.api.hubmapconsortium.org", "PUT", "/datasets/abc/status/new")
+    assert item["endpoint"] == "/datasets/<*>/status/<*>"
+
+
+def test_partial_segment_wildcard(index):
+    item = index.match("ingest.api.hubmapconsortium.org", "GET", "/files/v1.2.json")
+    assert item["endpoint"] == "/files/v<*>.json"
+
+
+def test_no_match(index):
+    assert index.match("ingest.api.hubmapconsortium.org", "DELETE", "/") is None
+    assert index.match("ingest.api.hubmapconsortium.org", "GET", "/unknown") is None
+    assert index.match("unknown.hubmapconsortium.org", "GET", "/") is None
+
+
+def test_first_defined_wildcard_wins():
+    index = RouteIndex({
+        "a": [
+            {"method": "GET", "endpoint": "/x/<*>", "auth": True},
+            {"method": "GET", "endpoint": "/<*>/y", "auth": False},
+        ]
+    })
+    assert index.match("a", "GET", "/x/y")["auth"] is True
+
+
+@pytest.mark.parametrize("file_name", ["api_endpoints.prod.json", "api_endpoints.dev.json", "api_endpoints.test.json"])
+def test_same_result_as_linear_scan(file_name):
+    with open(REPO_ROOT / file_name) as f:
+        data = json.load(f)
+
+    index = RouteIndex(data)
+
+    for authority, items in data.items():
+        for item in items:
+            for method in ("GET", "POST", "PUT", "DELETE"):
+                for endpoint in (item["endpoint"],
+                                 item["endpoint"].replace(WILDCARD_DELIMITER, "2c9d8e5f01a3") + "?a=b",
+                                 item["endpoint"].replace(WILDCARD_DELIMITER, "x/y"),
+                                 item["endpoint"] + "/extra"):
+                    assert index.match(authority, method, endpoint) is legacy_match(data, authority, method, endpoint)
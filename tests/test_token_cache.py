@@ -0,0 +1,251 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pytest
+from cachetools import TTLCache
+import flask
+from flask import Response
+from hubmap_commons.exceptions import HTTPException
+
+import app
+from circuit_breaker import CIRCUIT_CLOSED, CIRCUIT_OPEN, CircuitBreaker, CircuitOpen
+from endpoints_config import EndpointsConfig
+from token_cache import GlobusError, TokenCache
+from upstream import DeadlineExceeded, deadline_budget
+
+
+class FakeRequest:
+    def __init__(self, token):
+        self.headers = {'Authorization': 'Bearer ' + token} if token else {}
+
+
+def make_auth_helper():
+    auth_helper = MagicMock()
+
+    def get_tokens(headers):
+        if 'Authorization' not in headers:
+            return Response('No Authorization header', 401)
+        return headers['Authorization'][6:].strip()
+
+    auth_helper.getAuthorizationTokens.side_effect = get_tokens
+    return auth_helper
+
+
+@pytest.fixture
+def auth_helper():
+    return make_auth_helper()
+
+
+@pytest.fixture
+def token_cache(auth_helper):
+    return TokenCache(auth_helper, TTLCache(maxsize=100, ttl=900), ttl=900, negative_ttl=30)
+
+
+def test_user_info_cached_by_token_hash(auth_helper, token_cache):
+    auth_helper.getUserInfoUsingRequest.return_value = {'active': True, 'hmgroupids': ['g1', 'g2'], 'exp': time.time() + 3600}
+
+    for _ in range(5):
+        user_info = token_cache.get_user_info(FakeRequest('secret-token'), True)
+        assert user_info.group_ids == ('g1', 'g2')
+
+    assert auth_helper.getUserInfoUsingRequest.call_count == 1
+    # The raw token is never used as the key
+    assert not any('secret-token' in str(key) for key in token_cache.cache.keys())
+
+
+def test_user_info_with_and_without_groups_cached_separately(auth_helper, token_cache):
+    auth_helper.getUserInfoUsingRequest.return_value = {'active': True, 'hmgroupids': ['g1']}
+
+    assert token_cache.get_user_info(FakeRequest('token'), False).group_ids is None
+    assert token_cache.get_user_info(FakeRequest('token'), True).group_ids == ('g1',)
+    assert auth_helper.getUserInfoUsingRequest.call_count == 2
+
+
+def test_ttl_capped_by_token_expiry(auth_helper, token_cache):
+    auth_helper.getUserInfoUsingRequest.return_value = {'active': True, 'exp': time.time() - 1}
+
+    token_cache.get_user_info(FakeRequest('expired-token'), False)
+    token_cache.get_user_info(FakeRequest('expired-token'), False)
+
+    assert auth_helper.getUserInfoUsingRequest.call_count == 2
+
+
+def test_failed_validation_negative_entry(auth_helper, token_cache):
+    auth_helper.getUserInfoUsingRequest.return_value = Response('Non-active login', 401)
+
+    assert token_cache.get_user_info(FakeRequest('bad-token'), False) is None
+    assert token_cache.get_user_info(FakeRequest('bad-token'), False) is None
+    assert auth_helper.getUserInfoUsingRequest.call_count == 1
+
+
+def test_globus_error_not_cached(auth_helper, token_cache):
+    auth_helper.getUserInfoUsingRequest.return_value = Response('Unable to introspect user from token', 500)
+
+    for _ in range(2):
+        with pytest.raises(GlobusError):
+            token_cache.get_user_info(FakeRequest('token'), False)
+
+    # Valid again as soon as Globus is back
+    auth_helper.getUserInfoUsingRequest.return_value = {'active': True}
+    assert token_cache.get_user_info(FakeRequest('token'), False).valid
+    assert auth_helper.getUserInfoUsingRequest.call_count == 3
+
+
+def test_missing_header_not_cached(auth_helper, token_cache):
+    assert token_cache.get_user_info(FakeRequest(None), False) is None
+    assert auth_helper.getUserInfoUsingRequest.call_count == 0
+
+
+def test_data_access_level_cached(auth_helper, token_cache):
+    auth_helper.getUserDataAccessLevel.return_value = {'active': True, 'data_access_level': 'consortium'}
+
+    assert token_cache.get_user_data_access_level(FakeRequest('token')) == 'consortium'
+    assert token_cache.get_user_data_access_level(FakeRequest('token')) == 'consortium'
+    assert auth_helper.getUserDataAccessLevel.call_count == 1
+
+
+def test_data_access_level_negative_entry(auth_helper, token_cache):
+    auth_helper.getUserDataAccessLevel.side_effect = HTTPException("No valid authorization token found.", 401)
+
+    for _ in range(3):
+        with pytest.raises(HTTPException):
+            token_cache.get_user_data_access_level(FakeRequest('bad-token'))
+
+    assert auth_helper.getUserDataAccessLevel.call_count == 1
+
+
+def test_data_access_level_globus_error_not_cached(auth_helper, token_cache):
+    # AuthHelper.getUserDataAccessLevel() raises 401 whatever the introspection failure
+    auth_helper.getUserDataAccessLevel.side_effect = HTTPException("No valid authorization token found.", 401)
+    auth_helper.getUserInfoUsingRequest.return_value = Response('Unable to introspect user from token', 500)
+
+    for _ in range(2):
+        with pytest.raises(GlobusError):
+            token_cache.get_user_data_access_level(FakeRequest('token'))
+
+    auth_helper.getUserDataAccessLevel.side_effect = None
+    auth_helper.getUserDataAccessLevel.return_value = {'active': True, 'data_access_level': 'protected'}
+    assert token_cache.get_user_data_access_level(FakeRequest('token')) == 'protected'
+    assert auth_helper.getUserDataAccessLevel.call_count == 3
+
+
+def test_globus_circuit_breaker(auth_helper):
+    token_cache = TokenCache(auth_helper, TTLCache(maxsize=100, ttl=900), ttl=900, negative_ttl=30,
+                             breaker=CircuitBreaker('globus', failure_threshold=2, open_timeout=60, half_open_requests=1))
+    auth_helper.getUserDataAccessLevel.side_effect = HTTPException("Invalid token", 401)
+
+    # Invalid tokens are answers of a healthy Globus
+    for i in range(3):
+        with pytest.raises(HTTPException):
+            token_cache.get_user_data_access_level(FakeRequest(f"invalid-{i}"))
+
+    auth_helper.getUserDataAccessLevel.side_effect = ConnectionError("Globus is down")
+    for i in range(2):
+        with pytest.raises(ConnectionError):
+            token_cache.get_user_data_access_level(FakeRequest(f"token-{i}"))
+
+    with pytest.raises(CircuitOpen):
+        token_cache.get_user_data_access_level(FakeRequest('token-2'))
+
+    assert auth_helper.getUserDataAccessLevel.call_count == 5
+
+
+def test_globus_error_response_opens_circuit(auth_helper):
+    token_cache = TokenCache(auth_helper, TTLCache(maxsize=100, ttl=900), ttl=900, negative_ttl=30,
+                             breaker=CircuitBreaker('globus', failure_threshold=2, open_timeout=60, half_open_requests=1))
+    auth_helper.getUserInfoUsingRequest.return_value = Response('Unable to introspect user from token', 500)
+
+    for i in range(2):
+        with pytest.raises(GlobusError):
+            token_cache.get_user_info(FakeRequest(f"token-{i}"), False)
+
+    with pytest.raises(CircuitOpen):
+        token_cache.get_user_info(FakeRequest('token-2'), False)
+
+    assert token_cache.breaker.state == CIRCUIT_OPEN
+    assert auth_helper.getUserInfoUsingRequest.call_count == 2
+    # Nothing negative-cached
+    assert len(token_cache.cache) == 0
+
+
+def test_globus_call_within_deadline(auth_helper):
+    token_cache = TokenCache(auth_helper, TTLCache(maxsize=100, ttl=900), ttl=900, negative_ttl=30,
+                             executor=ThreadPoolExecutor(max_workers=1))
+    auth_helper.getUserInfoUsingRequest.side_effect = lambda request, group_required: time.sleep(0.5) or {'active': True}
+
+    start = time.perf_counter()
+    with deadline_budget(0.1):
+        with pytest.raises(DeadlineExceeded):
+            token_cache.get_user_info(FakeRequest('slow-token'), False)
+
+    assert time.perf_counter() - start < 0.4
+
+
+# AuthHelper reads the headers of the Flask request proxy, which is only bound on the thread of the request
+def read_headers(request, *args):
+    token = request.headers['Authorization'][6:].strip()
+
+    if token != 'good-token':
+        return Response('Non-active login', 401)
+    return {'active': True, 'hmgroupids': ['g1'], 'data_access_level': 'consortium'}
+
+
+def test_globus_call_within_deadline_from_flask_request(auth_helper):
+    token_cache = TokenCache(auth_helper, TTLCache(maxsize=100, ttl=900), ttl=900, negative_ttl=30,
+                             breaker=CircuitBreaker('globus', failure_threshold=1, open_timeout=60, half_open_requests=1),
+                             executor=ThreadPoolExecutor(max_workers=1))
+    auth_helper.getUserInfoUsingRequest.side_effect = read_headers
+    auth_helper.getUserDataAccessLevel.side_effect = read_headers
+
+    with app.app.test_request_context(headers={'Authorization': 'Bearer good-token'}), deadline_budget(5):
+        assert token_cache.get_user_info(flask.request, True).group_ids == ('g1',)
+        assert token_cache.get_user_data_access_level(flask.request) == 'consortium'
+
+    # Answers of a healthy Globus
+    assert token_cache.breaker.state == CIRCUIT_CLOSED
+
+
+def test_api_auth_token_within_deadline(tmp_path, auth_helper):
+    endpoints_file = tmp_path / 'api_endpoints.json'
+    endpoints_file.write_text(json.dumps({"ingest.api.hubmapconsortium.org": [{"method": "GET", "endpoint": "/secret", "auth": True}]}))
+    auth_helper.getUserInfoUsingRequest.side_effect = read_headers
+    auth_helper.getProcessSecret.return_value = 'internal-token'
+    headers = {'Host': 'ingest.api.hubmapconsortium.org', 'X-Original-Request-Method': 'GET', 'X-Original-URI': '/secret'}
+
+    with patch.object(app, 'endpoints_config', EndpointsConfig(str(endpoints_file), 0)), \
+         patch.object(app, 'auth_helper_instance', auth_helper, create=True), \
+         patch.object(app, 'auth_request_deadline', 5), \
+         patch.object(app.token_cache, 'auth_helper', auth_helper), \
+         patch.object(app.token_cache, 'cache', TTLCache(maxsize=100, ttl=900)), \
+         app.app.test_client() as client:
+        assert client.get('/api_auth', headers={**headers, 'Authorization': 'Bearer good-token'}).status_code == 200
+        assert client.get('/api_auth', headers={**headers, 'Authorization': 'Bearer bad-token'}).status_code == 401
+
+    assert auth_helper.getUserInfoUsingRequest.call_count == 2
+
+
+def test_auth_requests_fail_on_globus_error(tmp_path, auth_helper):
+    endpoints_file = tmp_path / 'api_endpoints.json'
+    endpoints_file.write_text(json.dumps({"ingest.api.hubmapconsortium.org": [{"method": "GET", "endpoint": "/secret", "auth": True}]}))
+    auth_helper.getUserInfoUsingRequest.return_value = Response('Unable to introspect user from token', 500)
+    auth_helper.getUserDataAccessLevel.side_effect = HTTPException("No valid authorization token found.", 401)
+    auth_helper.getProcessSecret.return_value = 'internal-token'
+    api_headers = {'Host': 'ingest.api.hubmapconsortium.org', 'X-Original-Request-Method': 'GET', 'X-Original-URI': '/secret',
+                   'Authorization': 'Bearer good-token'}
+    file_headers = {'X-Original-Request-Method': 'GET', 'X-Original-URI': '/a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6/data.tsv',
+                    'Authorization': 'Bearer good-token'}
+
+    with patch.object(app, 'endpoints_config', EndpointsConfig(str(endpoints_file), 0)), \
+         patch.object(app, 'auth_helper_instance', auth_helper, create=True), \
+         patch.object(app.token_cache, 'auth_helper', auth_helper), \
+         patch.object(app.token_cache, 'cache', TTLCache(maxsize=100, ttl=900)), \
+         app.app.test_client() as client:
+        for headers in (api_headers, file_headers):
+            path = '/api_auth' if headers is api_headers else '/file_auth'
+            response = client.get(path, headers=headers)
+
+            # An error, not a 401 for nginx to cache
+            assert response.status_code == 500
+            assert response.headers['Cache-Control'] == 'no-store'
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+import pytest
+import requests
+
+import app
+import asgi
+
+UMLS_KEY = 'my-umls-key'
+HEADERS = {'X-Original-Request-Method': 'GET', 'X-Original-URI': f"/umls/download.zip?umls-key={UMLS_KEY}"}
+
+
+def umls_response(status_code=200, body=True):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = body
+    return response
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    app.cache.clear()
+    yield
+    app.cache.clear()
+
+
+@pytest.fixture
+def umls_get():
+    with patch.object(app.upstream_client, 'get', return_value=umls_response()) as get:
+        yield get
+
+
+def umls_auth():
+    with app.app.test_client() as client:
+        return client.get('/umls_auth', headers=HEADERS).status_code
+
+
+def test_valid_key_cached(umls_get):
+    assert umls_auth() == 200
+    assert umls_auth() == 200
+    assert umls_get.call_count == 1
+
+    # Only the hash of the key is stored
+    assert not any(UMLS_KEY in str(key) for key in app.cache.keys())
+
+
+def test_invalid_key_cached(umls_get):
+    umls_get.return_value = umls_response(body=False)
+
+    assert umls_auth() == 403
+    assert umls_auth() == 403
+    assert umls_get.call_count == 1
+
+
+@pytest.mark.parametrize('failure', [umls_response(status_code=502, body=None),
+                                     requests.exceptions.ConnectTimeout("UMLS is down")])
+def test_unavailable_fails_closed(umls_get, failure):
+    if isinstance(failure, Exception):
+        umls_get.side_effect = failure
+    else:
+        umls_get.return_value = failure
+
+    assert umls_auth() == 500
+    assert umls_auth() == 500
+    # Not cached, the next request tries again
+    assert umls_get.call_count == 2
+
+
+def test_unavailable_fails_open(umls_get):
+    umls_get.side_effect = requests.exceptions.ReadTimeout("UMLS is slow")
+
+    with patch.dict(app.app.config, {'UMLS_FAIL_OPEN': True}):
+        assert umls_auth() == 200
+
+
+def test_concurrent_validations_share_one_request(umls_get):
+    def slow_get(url):
+        time.sleep(0.2)
+        return umls_response()
+
+    umls_get.side_effect = slow_get
+    codes = []
+    threads = [threading.Thread(target=lambda: codes.append(umls_auth())) for _ in range(10)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert codes == [200] * 10
+    assert umls_get.call_count == 1
+
+
+def test_async_mode_shares_the_cache(umls_get):
+    umls_get.return_value = umls_response(body=False)
+    assert umls_auth() == 403
+
+    async def validate():
+        with patch.object(asgi.upstreams, 'get', side_effect=AssertionError("Not cached")):
+            return await asgi.umls_auth(asgi.Headers(list(HEADERS.items())))
+
+    status_code, content_type, body, cache_control = asyncio.run(validate())
+    assert status_code == 403
@@ -0,0 +1,148 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from circuit_breaker import CircuitOpen
+from upstream import UpstreamClient, DeadlineExceeded, deadline_budget, remaining_budget
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    status_codes = []
+
+    def do_GET(self):
+        status = 200
+        if self.path.startswith('/slow'):
+            # Still running after the test timed out, the status codes belong to the next requests
+            time.sleep(1)
+        elif self.status_codes:
+            status = self.status_codes.pop(0)
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_connections_reused(server):
+    client = UpstreamClient(pool_size=4, policies={}, upstream_names={server[len('http://'):]: 'entity_api'})
+
+    for i in range(10):
+        assert client.get(f"{server}/entities/{i}").status_code == 200
+
+    stats = client.stats()[server]
+    assert stats['upstream'] == 'entity_api'
+    assert stats['requests'] == 10
+    assert stats['new_connections'] == 1
+    assert stats['reused_connections'] == 9
+
+
+def test_policy_per_upstream():
+    client = UpstreamClient(pool_size=4,
+                            policies={'default': {'read_timeout': 5}, 'uuid_api': {'read_timeout': 1, 'retries': 2}},
+                            upstream_names={'uuid-api:8080': 'uuid_api'})
+
+    assert client.upstream_name('http://uuid-api:8080/hmuuid/abc') == 'uuid_api'
+    assert client.upstream_name('https://search-api.dev.hubmapconsortium.org/status') == 'default'
+    assert client.policy('uuid_api')['read_timeout'] == 1
+    assert client.policy('uuid_api')['retries'] == 2
+    assert client.policy('default')['read_timeout'] == 5
+    assert client.policy('default')['connect_timeout'] == 3
+
+
+def test_retry_on_gateway_error(server):
+    KeepAliveHandler.status_codes = [503, 503]
+    client = UpstreamClient(pool_size=4, policies={'default': {'retries': 2, 'backoff_factor': 0}})
+
+    assert client.get(f"{server}/status").status_code == 200
+
+
+def test_read_timeout(server):
+    client = UpstreamClient(pool_size=4, policies={'default': {'read_timeout': 0.2}})
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.get(f"{server}/slow")
+
+
+def test_timeout_capped_by_deadline(server):
+    client = UpstreamClient(pool_size=4, policies={'default': {'read_timeout': 5}})
+
+    start = time.perf_counter()
+    with deadline_budget(0.2):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            client.get(f"{server}/slow")
+
+        # The chained calls share what is left
+        time.sleep(0.2)
+        with pytest.raises(DeadlineExceeded):
+            client.get(f"{server}/status")
+
+    assert time.perf_counter() - start < 0.8
+    assert client.stats()[server]['requests'] == 1
+
+
+def test_timeout_capped_by_deadline_not_a_failure(server):
+    client = UpstreamClient(pool_size=4, policies={'default': {'read_timeout': 5, 'failure_threshold': 1}})
+
+    with deadline_budget(0.2):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            client.get(f"{server}/slow")
+
+    # The upstream didn't get its own timeout, the circuit stays closed
+    assert client.stats()[server]['circuit'] == 'closed'
+
+    # Its own timeout opens it
+    slow_client = UpstreamClient(pool_size=4, policies={'default': {'read_timeout': 0.2, 'failure_threshold': 1}})
+    with deadline_budget(5):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            slow_client.get(f"{server}/slow")
+
+    assert slow_client.stats()[server]['circuit'] == 'open'
+
+
+def test_nested_deadline_budget():
+    with deadline_budget(1):
+        with deadline_budget(10):
+            assert remaining_budget() <= 1
+        with deadline_budget(0):
+            assert remaining_budget() <= 1
+
+    assert remaining_budget() is None
+
+
+def test_circuit_breaker_fails_fast(server):
+    KeepAliveHandler.status_codes = [500, 503, 500]
+    client = UpstreamClient(pool_size=4, policies={'default': {'failure_threshold': 3, 'open_timeout': 60}})
+
+    for _ in range(3):
+        assert client.get(f"{server}/status").status_code >= 500
+
+    with pytest.raises(CircuitOpen):
+        client.get(f"{server}/status")
+
+    # Not sent to the upstream, reported by the pool stats
+    assert client.stats()[server]['requests'] == 3
+    assert client.stats()[server]['circuit'] == 'open'
+
+    # 4xx responses come from a healthy upstream
+    KeepAliveHandler.status_codes = [404] * 10
+    other_client = UpstreamClient(pool_size=4, policies={'default': {'failure_threshold': 3}})
+    for _ in range(10):
+        assert other_client.get(f"{server}/status").status_code == 404
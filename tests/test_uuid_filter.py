@@ -0,0 +1,55 @@
+from unittest.mock import patch
+
+import uuid_filter
+from uuid_filter import DecayingBloomFilter, is_valid_uuid
+
+
+def test_is_valid_uuid():
+    assert is_valid_uuid('a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6')
+    assert is_valid_uuid('FFFF1B2C3D4E5F6A7B8C9D0E1F2A3B4C')
+
+    for uuid in ['', 'status', 'HBM123.ABCD.456', 'a1b2c3d4-e5f6-a7b8-c9d0-e1f2a3b4c5d6', 'g' * 32, 'a' * 33]:
+        assert not is_valid_uuid(uuid)
+
+
+def test_false_positive_rate():
+    bloom_filter = DecayingBloomFilter(capacity=1000, false_positive_rate=0.01, ttl=60)
+
+    for i in range(1000):
+        bloom_filter.add(f"{i:032x}")
+
+    assert all(f"{i:032x}" in bloom_filter for i in range(1000))
+    # Both bit arrays are checked, about twice the configured rate at most
+    false_positives = sum(f"{i:032x}" in bloom_filter for i in range(1000, 11000))
+    assert false_positives < 10000 * 0.02 * 1.5
+
+
+def test_decay():
+    now = [1000.0]
+
+    with patch.object(uuid_filter.time, 'monotonic', side_effect=lambda: now[0]):
+        bloom_filter = DecayingBloomFilter(capacity=100, false_positive_rate=0.001, ttl=60)
+        bloom_filter.add('first')
+
+        now[0] += 61
+        bloom_filter.add('second')
+        assert 'first' in bloom_filter
+
+        # The first one was added more than twice the ttl ago
+        now[0] += 61
+        assert 'first' not in bloom_filter
+        assert 'second' in bloom_filter
+
+        now[0] += 200
+        assert 'second' not in bloom_filter
+
+
+def test_rotates_when_full():
+    bloom_filter = DecayingBloomFilter(capacity=10, false_positive_rate=0.001, ttl=3600)
+
+    for i in range(25):
+        bloom_filter.add(f"uuid-{i}")
+
+    # The first 10 were dropped with the previous array, the last 15 are still there
+    assert 'uuid-0' not in bloom_filter
+    assert all(f"uuid-{i}" in bloom_filter for i in range(10, 25))